@@ -0,0 +1,531 @@
+#=========<Code Start>==========#
+
+# Concurrent-client benchmark for server.py
+#
+#   python bench.py --modes eventlet threading --clients 50
+#
+# Each mode starts server.py in a scratch folder on localhost, seeds a test
+# file, then has every client thread reuse one keep-alive HTTPS connection
+# for a mix of /files listings and full downloads. Results are printed as JSON.
+#
+#   python bench.py --scenario compression --link-mbps 200
+#
+# downloads a log-like CSV with each Accept-Encoding instead, reporting bytes
+# on the wire and the transfer time they would take over a link of that speed.
+#
+#   python bench.py --scenario handshake --workers 4
+#
+# times TLS handshakes against RSA-4096 and ECDSA P-256 certificates, both
+# full and resumed from a session ticket issued by whichever worker answered.
+#
+#   python bench.py --scenario disk --large-uploads 4 --large-size 2048
+#
+# uploads large files with write-behind off (direct pwrite, as before) and on,
+# reporting throughput, CPU and how far dirty and cached memory grew.
+#
+#   python server.py bench --workloads small-uploads listing
+#
+# runs the release suite (the same as --scenario suite): each workload gets a
+# fresh server and reports throughput, p50/p99 latency and the server's CPU
+# seconds per GB moved, so regressions in the hot paths show up as numbers.
+
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'server.py')
+WORKLOADS = ['small-uploads', 'large-uploads', 'downloads', 'listing', 'socketio']
+
+def client_context():
+    # The server uses a self-signed certificate
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+def wait_for_server(port, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1) as sock:
+                with client_context().wrap_socket(sock):
+                    return True
+        except (OSError, ssl.SSLError):
+            time.sleep(0.5)
+    return False
+
+def start_server(workdir, port, mode, extra_args=()):
+    log = open(os.path.join(workdir, f'server-{mode}.log'), 'w')
+    process = subprocess.Popen(
+        [sys.executable, SERVER_SCRIPT, '--host', '127.0.0.1', '--port', str(port), '--server', mode, *extra_args],
+        cwd=workdir, stdout=log, stderr=subprocess.STDOUT
+    )
+    if not wait_for_server(port):
+        process.kill()
+        raise RuntimeError(f'{mode} server did not start, see {log.name}')
+    return process
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def upload(port, name, data):
+    connection = http.client.HTTPSConnection('127.0.0.1', port, context=client_context())
+    connection.request('PUT', f'/upload/raw/{name}', body=data)
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    if response.status != 200:
+        raise RuntimeError(f'Seeding {name} failed with HTTP {response.status}')
+
+def process_tree(pid):
+    # Prefork servers do their work in child processes
+    pids = [pid]
+    for task in os.listdir(f'/proc/{pid}/task'):
+        try:
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                for child in f.read().split():
+                    pids.extend(process_tree(int(child)))
+        except OSError:
+            pass
+    return pids
+
+def cpu_seconds(pid):
+    # User plus system time of the server and its workers, None where /proc is missing
+    if not os.path.exists(f'/proc/{pid}/stat'):
+        return None
+    total = 0
+    for tree_pid in process_tree(pid):
+        try:
+            with open(f'/proc/{tree_pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total / os.sysconf('SC_CLK_TCK')
+
+def add_cpu(stats, process, cpu_before, data_bytes):
+    cpu_after = cpu_seconds(process.pid)
+    if cpu_before is None or cpu_after is None:
+        stats['cpu_seconds'] = stats['cpu_seconds_per_gb'] = None
+        return stats
+    stats['cpu_seconds'] = round(cpu_after - cpu_before, 2)
+    stats['cpu_seconds_per_gb'] = round(stats['cpu_seconds'] / (data_bytes / 1e9), 2) if data_bytes else None
+    return stats
+
+def meminfo_mb(*fields):
+    # System-wide figures from /proc/meminfo, None where it is missing
+    try:
+        with open('/proc/meminfo') as f:
+            values = dict(line.split(':', 1) for line in f)
+    except OSError:
+        return None
+    return {field: int(values[field].split()[0]) // 1024 for field in fields}
+
+def run_disk(workdir, args, mode):
+    size = args.large_size * 1024 * 1024
+    results = {}
+    for write_behind in ('false', 'true'):
+        folder = os.path.join(workdir, mode, f'write-behind-{write_behind}')
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'server_config.ini'), 'w') as f:
+            f.write(f'[Server]\nwrite_behind = {write_behind}\n')
+        process = start_server(folder, args.port, mode, ['--workers', str(args.workers)])
+        peak_dirty = [0]
+        sampling = threading.Event()
+
+        def sample():
+            while not sampling.wait(0.2):
+                memory = meminfo_mb('Dirty')
+                if memory:
+                    peak_dirty[0] = max(peak_dirty[0], memory['Dirty'])
+
+        try:
+            before = meminfo_mb('Cached')
+            sampler = threading.Thread(target=sample)
+            sampler.start()
+            cpu_before = cpu_seconds(process.pid)
+            stats = run_uploads(args.port, args.large_uploads, args.large_uploads, size, 'disk')
+            stats = add_cpu(stats, process, cpu_before, size * (stats['requests'] - stats['errors']))
+            sampling.set()
+            sampler.join()
+            after = meminfo_mb('Cached')
+            if before and after:
+                stats['page_cache_growth_mb'] = after['Cached'] - before['Cached']
+                stats['peak_dirty_mb'] = peak_dirty[0]
+        finally:
+            stop_server(process)
+        results['write_behind' if write_behind == 'true' else 'direct'] = stats
+        shutil.rmtree(folder, ignore_errors=True)
+    return results
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def make_log(size):
+    # Repetitive but not trivial text, like the logs and CSVs people move around
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = f'2026-10-18T12:{i // 60 % 60:02d}:{i % 60:02d},GET,/api/items/{i * 7919 % 100000},{200 if i % 17 else 404},{i * 31 % 977}ms\n'
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return ''.join(lines).encode()[:size]
+
+def run_clients(port, clients, requests, paths, headers=None):
+    latencies = []
+    errors = [0]
+    received = [0]
+    encodings = set()
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(clients)
+
+    def client(number):
+        connection = http.client.HTTPSConnection('127.0.0.1', port, context=client_context(), timeout=120)
+        start_barrier.wait()
+        for i in range(requests):
+            path = paths[i % len(paths)]
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers or {})
+                response = connection.getresponse()
+                size = len(response.read())
+                ok = response.status == 200
+                encodings.add(response.getheader('Content-Encoding', 'identity'))
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPSConnection('127.0.0.1', port, context=client_context(), timeout=120)
+                size, ok = 0, False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                received[0] += size
+                if not ok:
+                    errors[0] += 1
+        connection.close()
+
+    seconds = run_threads(client, clients)
+    stats = summarize(clients, latencies, errors[0], received[0], seconds)
+    stats['content_encodings'] = sorted(encodings)
+    return stats
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+def summarize(clients, latencies, errors, data_bytes, seconds):
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'mb_per_second': round(data_bytes / seconds / (1024 * 1024), 1),
+        'bytes_per_request': data_bytes // max(len(latencies), 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2)
+    }
+
+def body_blocks(size, block):
+    # Stream a large body without holding it in memory
+    sent = 0
+    while sent < size:
+        chunk = block[:size - sent]
+        sent += len(chunk)
+        yield chunk
+
+def run_uploads(port, clients, files, size, prefix):
+    latencies = []
+    errors = [0]
+    sent = [0]
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(clients)
+    block = os.urandom(min(size, 1024 * 1024))
+
+    def client(number):
+        connection = http.client.HTTPSConnection('127.0.0.1', port, context=client_context(), timeout=600)
+        start_barrier.wait()
+        for i in range(number, files, clients):
+            started = time.perf_counter()
+            try:
+                connection.request('PUT', f'/upload/raw/{prefix}-{i}.bin', body=body_blocks(size, block),
+                                   headers={'Content-Length': str(size)})
+                response = connection.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPSConnection('127.0.0.1', port, context=client_context(), timeout=600)
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if ok:
+                    sent[0] += size
+                else:
+                    errors[0] += 1
+        connection.close()
+
+    seconds = run_threads(client, clients)
+    return summarize(clients, latencies, errors[0], sent[0], seconds)
+
+def generate_certificate(workdir, key_type):
+    cert_path = os.path.join(workdir, f'{key_type}-cert.pem')
+    key_path = os.path.join(workdir, f'{key_type}-key.pem')
+    new_key = ['-newkey', 'rsa:4096'] if key_type == 'rsa' else ['-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1']
+    subprocess.run(['openssl', 'req', '-x509', *new_key, '-nodes', '-out', cert_path, '-keyout', key_path,
+                    '-days', '1', '-subj', '/CN=localhost'], check=True, capture_output=True)
+    return cert_path, key_path
+
+def fetch_session(port, context):
+    # TLS 1.3 tickets arrive after the handshake, so complete one request first
+    with socket.create_connection(('127.0.0.1', port)) as sock:
+        with context.wrap_socket(sock, server_hostname='localhost') as tls:
+            tls.sendall(b'GET /files?limit=1 HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+            while tls.recv(65536):
+                pass
+            return tls.session
+
+def run_handshakes(port, clients, requests, resume):
+    latencies = []
+    reused = [0]
+    errors = [0]
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(clients)
+
+    def client(number):
+        context = client_context()
+        session = fetch_session(port, context) if resume else None
+        start_barrier.wait()
+        for _ in range(requests):
+            started = time.perf_counter()
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=30) as sock:
+                    with context.wrap_socket(sock, server_hostname='localhost', session=session) as tls:
+                        elapsed = time.perf_counter() - started
+                        was_reused = tls.session_reused
+            except (OSError, ssl.SSLError):
+                with lock:
+                    errors[0] += 1
+                continue
+            with lock:
+                latencies.append(elapsed)
+                reused[0] += was_reused
+
+    seconds = run_threads(client, clients)
+
+    return {
+        'handshakes': len(latencies),
+        'errors': errors[0],
+        'resumed': reused[0],
+        'handshakes_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2)
+    }
+
+def run_compression(port, clients, requests, file_size, encodings, link_mbps):
+    data = make_log(file_size)
+    upload(port, 'bench.csv', data)
+    link_bytes_per_second = link_mbps * 1000 * 1000 / 8
+    results = {}
+    for encoding in encodings:
+        stats = run_clients(port, clients, requests, ['/download/bench.csv'], {'Accept-Encoding': encoding})
+        stats['ratio'] = round(stats['bytes_per_request'] / len(data), 3)
+        # Loopback hides the network; this is what one download costs on a real link
+        stats['link_ms_per_request'] = round(stats['bytes_per_request'] / link_bytes_per_second * 1000, 1)
+        results[encoding] = stats
+    return results
+
+def run_fanout(port, clients, rounds):
+    try:
+        import socketio
+    except ImportError:
+        return {'error': 'python-socketio is not installed'}
+    arrivals = [{} for _ in range(clients)]
+    sockets = []
+    failed = [0]
+    lock = threading.Lock()
+
+    def connect(number):
+        sio = socketio.Client(ssl_verify=False)
+
+        @sio.on('files_update')
+        def on_update(delta):
+            now = time.perf_counter()
+            for entry in delta.get('added', []) + delta.get('changed', []):
+                arrivals[number].setdefault(entry['name'], now)
+
+        try:
+            sio.connect(f'https://127.0.0.1:{port}', transports=['websocket'], wait_timeout=30)
+        except (socketio.exceptions.ConnectionError, OSError):
+            with lock:
+                failed[0] += 1
+            return
+        with lock:
+            sockets.append(sio)
+
+    connect_seconds = run_threads(connect, clients)
+    uploaded = {}
+    for i in range(rounds):
+        name = f'fanout-{i}.bin'
+        upload(port, name, os.urandom(1024))
+        uploaded[name] = time.perf_counter()
+        time.sleep(1)  # Let each upload go out as its own files_update
+    time.sleep(3)
+    for sio in sockets:
+        sio.disconnect()
+
+    latencies = []
+    for seen in arrivals:
+        for name, done in uploaded.items():
+            if name in seen:
+                latencies.append(max(seen[name] - done, 0))
+    return {
+        'clients': clients,
+        'connected': len(sockets),
+        'connect_errors': failed[0],
+        'connect_seconds': round(connect_seconds, 3),
+        'deliveries': len(latencies),
+        'expected_deliveries': len(sockets) * rounds,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2)
+    }
+
+def seed_listing(folder, entries):
+    # Written straight to disk: uploading 100k files would dwarf the listing itself
+    os.makedirs(folder, exist_ok=True)
+    for i in range(entries):
+        with open(os.path.join(folder, f'entry-{i:06d}.txt'), 'w') as f:
+            f.write(str(i))
+
+def run_workload(workload, workdir, args, mode):
+    folder = os.path.join(workdir, mode, workload)
+    os.makedirs(folder)
+    if workload == 'listing':
+        results = {}
+        for entries in args.listing_sizes:
+            listing_dir = os.path.join(folder, str(entries))
+            seed_listing(os.path.join(listing_dir, 'uploads'), entries)
+            process = start_server(listing_dir, args.port, mode, ['--workers', str(args.workers)])
+            try:
+                results[entries] = {}
+                for view, path in (('full', '/files'), ('page', '/files?sort=mtime&order=desc&limit=100')):
+                    cpu_before = cpu_seconds(process.pid)
+                    stats = run_clients(args.port, min(args.clients, 8), args.requests, [path])
+                    results[entries][view] = add_cpu(stats, process, cpu_before, stats['bytes_per_request'] * stats['requests'])
+            finally:
+                stop_server(process)
+        return results
+
+    process = start_server(folder, args.port, mode, ['--workers', str(args.workers)])
+    try:
+        cpu_before = cpu_seconds(process.pid)
+        if workload == 'small-uploads':
+            stats = run_uploads(args.port, args.clients, args.small_uploads, args.small_size * 1024, 'small')
+            return add_cpu(stats, process, cpu_before, args.small_size * 1024 * (stats['requests'] - stats['errors']))
+        if workload == 'large-uploads':
+            size = args.large_size * 1024 * 1024
+            stats = run_uploads(args.port, args.large_uploads, args.large_uploads, size, 'large')
+            return add_cpu(stats, process, cpu_before, size * (stats['requests'] - stats['errors']))
+        if workload == 'downloads':
+            upload(args.port, 'bench.bin', os.urandom(args.file_size * 1024 * 1024))
+            cpu_before = cpu_seconds(process.pid)
+            stats = run_clients(args.port, args.clients, args.requests, ['/download/bench.bin'])
+            return add_cpu(stats, process, cpu_before, stats['bytes_per_request'] * stats['requests'])
+        stats = run_fanout(args.port, args.socketio_clients, args.fanout_rounds)
+        return add_cpu(stats, process, cpu_before, 0)
+    finally:
+        stop_server(process)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent-client benchmark for server.py')
+    parser.add_argument('--modes', nargs='+', default=['eventlet', 'threading'], help='Server modes to compare')
+    parser.add_argument('--clients', type=int, default=50, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='Requests per client')
+    parser.add_argument('--file-size', type=int, default=4, help='Download size in MB')
+    parser.add_argument('--port', type=int, default=8443, help='Port used for the benchmark servers')
+    parser.add_argument('--scenario', choices=['modes', 'compression', 'handshake', 'suite', 'disk'], default='modes',
+                        help='What to compare')
+    parser.add_argument('--encodings', nargs='+', default=['identity', 'gzip', 'br', 'zstd'],
+                        help='Accept-Encoding values for the compression scenario')
+    parser.add_argument('--link-mbps', type=float, default=100, help='Link speed used to estimate transfer times')
+    parser.add_argument('--workers', type=int, default=1, help='Server worker processes for the handshake and suite scenarios')
+    parser.add_argument('--workloads', nargs='+', choices=WORKLOADS, default=WORKLOADS, help='Workloads for the suite scenario')
+    parser.add_argument('--small-uploads', type=int, default=2000, help='Files sent by the small-uploads workload')
+    parser.add_argument('--small-size', type=int, default=64, help='Size of each small upload in KB')
+    parser.add_argument('--large-uploads', type=int, default=2,
+                        help='Concurrent files sent by the large-uploads workload and the disk scenario')
+    parser.add_argument('--large-size', type=int, default=1024, help='Size of each large upload in MB')
+    parser.add_argument('--listing-sizes', nargs='+', type=int, default=[10000, 100000],
+                        help='Folder sizes for the listing workload')
+    parser.add_argument('--socketio-clients', type=int, default=100, help='Socket.IO clients for the fan-out workload')
+    parser.add_argument('--fanout-rounds', type=int, default=10, help='Uploads broadcast to the Socket.IO clients')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='localhttps-bench-')
+    results = {}
+    try:
+        for mode in args.modes:
+            if args.scenario == 'suite':
+                results[mode] = {}
+                for workload in args.workloads:
+                    results[mode][workload] = run_workload(workload, workdir, args, mode)
+                continue
+            if args.scenario == 'disk':
+                results[mode] = run_disk(workdir, args, mode)
+                continue
+            if args.scenario == 'handshake':
+                results[mode] = {}
+                for key_type in ('rsa', 'ecdsa'):
+                    cert_path, key_path = generate_certificate(workdir, key_type)
+                    process = start_server(workdir, args.port, mode,
+                                           ['--cert', cert_path, '--key', key_path, '--workers', str(args.workers)])
+                    try:
+                        results[mode][key_type] = {
+                            'full': run_handshakes(args.port, args.clients, args.requests, resume=False),
+                            'resumed': run_handshakes(args.port, args.clients, args.requests, resume=True)
+                        }
+                    finally:
+                        stop_server(process)
+                continue
+            process = start_server(workdir, args.port, mode)
+            try:
+                if args.scenario == 'compression':
+                    results[mode] = run_compression(args.port, args.clients, args.requests, args.file_size * 1024 * 1024,
+                                                    args.encodings, args.link_mbps)
+                    continue
+                upload(args.port, 'bench.bin', os.urandom(args.file_size * 1024 * 1024))
+                results[mode] = run_clients(args.port, args.clients, args.requests, ['/files', '/download/bench.bin'])
+            finally:
+                stop_server(process)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
+
+#=========<Code End>==========#
@@ -0,0 +1,134 @@
+#=========<Code Start>==========#
+
+# Preview worker process for server.py
+#
+# server.py keeps a few of these running and sends each one JSON lines on
+# stdin, {"kind": "image" | "video", "sources": [...], "destination": ...,
+# "size": ...}, getting back {} or {"error": ...} per line. A file stored
+# deduplicated arrives as its chunk paths, read back to back. Living outside
+# server.py lets the worker start without Flask, eventlet or the server's
+# configuration; it exits when server.py closes its stdin.
+
+import bisect
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None  # image thumbnails are only rendered when Pillow is installed
+
+THUMBNAIL_QUALITY = 80
+VIDEO_SEEK = 1  # seconds into a video for its frame, past most fade-ins
+FFMPEG_TIMEOUT = 30
+
+class ChunkedSource(io.RawIOBase):
+    """The chunk files of a deduplicated file read as one seekable stream"""
+
+    def __init__(self, sources):
+        self.sources = sources
+        self.starts = []  # offset of each chunk in the whole file
+        self.size = 0
+        for path in sources:
+            self.starts.append(self.size)
+            self.size += os.path.getsize(path)
+        self.position = 0
+        self.current = None  # index and open file of the chunk last read
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError('negative seek position')
+        self.position = offset
+        return offset
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index = bisect.bisect_right(self.starts, self.position) - 1
+        if self.current is None or self.current[0] != index:
+            self.drop_current()
+            self.current = (index, open(self.sources[index], 'rb'))
+        f = self.current[1]
+        f.seek(self.position - self.starts[index])
+        read = f.readinto(buffer)  # Stops at the chunk's end; the next call opens the following one
+        self.position += read
+        return read
+
+    def drop_current(self):
+        if self.current is not None:
+            self.current[1].close()
+            self.current = None
+
+    def close(self):
+        self.drop_current()
+        super().close()
+
+def open_source(sources):
+    if len(sources) == 1:
+        return open(sources[0], 'rb')
+    return io.BufferedReader(ChunkedSource(sources))
+
+def image_thumbnail(sources, destination, size):
+    if Image is None:
+        raise RuntimeError('Pillow is not installed')
+    with open_source(sources) as f, Image.open(f) as image:
+        image.draft('RGB', (size, size))  # JPEGs decode straight at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.save(destination, 'JPEG', quality=THUMBNAIL_QUALITY)
+
+def video_thumbnail(sources, destination, size):
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError('ffmpeg is not installed')
+    source = sources[0] if len(sources) == 1 else 'concat:' + '|'.join(sources)
+    for seek in (VIDEO_SEEK, 0):
+        # Videos shorter than VIDEO_SEEK have no frame there
+        subprocess.run([ffmpeg, '-v', 'error', '-y', '-ss', str(seek), '-i', source, '-frames:v', '1',
+                        '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+                        '-f', 'image2', '-c:v', 'mjpeg', destination],
+                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=FFMPEG_TIMEOUT)
+        if os.path.exists(destination) and os.path.getsize(destination):
+            return
+    raise RuntimeError('ffmpeg could not read a frame')
+
+RENDERERS = {'image': image_thumbnail, 'video': video_thumbnail}
+
+def main():
+    try:
+        os.nice(10)  # Previews never compete with transfers for the CPU
+    except (AttributeError, OSError):
+        pass
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            RENDERERS[job['kind']](job['sources'], job['destination'], job['size'])
+            reply = {}
+        except Exception as e:
+            reply = {'error': str(e) or type(e).__name__}
+        sys.stdout.write(json.dumps(reply) + '\n')
+        sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
+
+#=========<Code End>==========#
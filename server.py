@@ -1,51 +1,187 @@
 #=========<Code Start>==========#
 
-from flask import Flask, request, send_file, jsonify, render_template_string, redirect
+import argparse
+import configparser
+import os
+import sys
+import time
+
+startup_marks = [('start', time.perf_counter())]  # (phase, end time) for --profile-startup
+
+def mark_startup(phase):
+    startup_marks.append((phase, time.perf_counter()))
+
+CONFIG_FILE = 'server_config.ini'
+CERT_JOBS_FILE = 'cert_jobs.json'
+SERVER_MODES = ['eventlet', 'threading']
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description='Secure File Transfer Server',
+                                     epilog='Run "%(prog)s bench --help" for the benchmark suite')
+    parser.add_argument('--host', help='Host address')
+    parser.add_argument('--port', type=int, help='Port number')
+    parser.add_argument('--cert', help='Path to SSL certificate')
+    parser.add_argument('--key', help='Path to SSL private key')
+    parser.add_argument('--server', choices=SERVER_MODES,
+                        help='eventlet (green threads) or threading (Werkzeug development server)')
+    parser.add_argument('--max-connections', type=int, help='Maximum concurrent connections')
+    parser.add_argument('--keepalive', type=int, help='Keep-alive idle timeout in seconds, 0 disables it')
+    parser.add_argument('--workers', type=int, help='Worker processes sharing the listening socket')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Report where startup time goes, then exit without serving')
+    return parser
+
+def run_bench_command():
+    # `python server.py bench ...` runs the benchmark suite in bench.py, which
+    # starts its own servers, so it has to happen before anything is patched
+    if __name__ != '__main__' or sys.argv[1:2] != ['bench']:
+        return
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bench
+    bench.main(['--scenario', 'suite', *sys.argv[2:]])
+    sys.exit(0)
+
+def early_server_mode():
+    # eventlet has to patch the standard library before Flask, watchdog and
+    # threading are imported, so the server mode is settled first
+    if __name__ != '__main__':
+        return None
+    args, _ = build_arg_parser().parse_known_args()
+    if args.server:
+        return args.server
+    file_config = configparser.ConfigParser()
+    file_config.read(CONFIG_FILE)
+    return file_config.get('Server', 'server_mode', fallback='eventlet')
+
+run_bench_command()
+SERVER_MODE = early_server_mode()
+if SERVER_MODE == 'eventlet':
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+    except ImportError:
+        print("eventlet is not installed, falling back to the threading server")
+        SERVER_MODE = 'threading'
+mark_startup('eventlet')
+
+from flask import Flask, request, jsonify, redirect
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO
+import socketio as socketio_module
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
+from werkzeug.http import http_date, parse_date, is_resource_modified
+from werkzeug.wsgi import wrap_file, ClosingIterator
 from werkzeug.middleware.proxy_fix import ProxyFix
-import os
+from werkzeug.exceptions import HTTPException
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, File, Field, Data, Epilogue
+mark_startup('flask and socketio')
 import ssl
+import datetime
+import ipaddress
+import stat
+import bisect
+import socket
+import signal
+import struct
+import shutil
+import subprocess
+import tempfile
 import json
+import sqlite3
 import threading
-import time
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-import argparse
-import configparser
-import base64
+import io
+import gzip
+import tarfile
+import zlib
+import uuid
+import hashlib
+import mimetypes
+from urllib.parse import quote
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None  # xxh128 digests are only offered when xxhash is installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zstd transfer encoding is only offered when zstandard is installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+mark_startup('other imports')
 
 app = Flask(__name__)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1)
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=SERVER_MODE)
 CORS(app)
 
 # Configuration
-CONFIG_FILE = 'server_config.ini'
 DEFAULT_CONFIG = {
     'Server': {
         'host': '0.0.0.0',
         'port': '443',
         'upload_folder': 'uploads',
         'cert_path': 'certificate.pem',
-        'key_path': 'private_key.pem'
+        'key_path': 'private_key.pem',
+        'upload_concurrency': '3',  # files uploaded in parallel by the web client
+        'chunk_streams': '4',  # parallel chunk requests per file
+        'max_streams_per_client': '16',  # concurrent chunk writes accepted from one client
+        'server_mode': 'eventlet',
+        'max_connections': '1000',  # eventlet green thread pool size
+        'keepalive_timeout': '75',  # seconds, 0 disables keep-alive
+        'workers': '1',  # prefork worker processes (eventlet mode, Unix only)
+        'digest_algorithm': 'sha256',  # sha256, blake2b or xxh128 (needs xxhash)
+        'dedup': 'false',  # store new uploads as deduplicated chunks + manifests
+        'compression': 'true',  # negotiate Content-Encoding for compressible downloads
+        'compression_cache_mb': '1024',  # disk budget for precompressed hot files
+        'cert_key_type': 'ecdsa',  # ecdsa (P-256) or rsa (4096 bit) for generated certificates
+        'tls_session_tickets': 'true',  # TLS session resumption; ticket keys live until a restart
+        'max_upload_size_gb': '64',  # largest accepted request body
+        'partial_upload_hours': '48',  # resumable uploads untouched this long are deleted, 0 keeps them
+        'drain_timeout': '3600',  # seconds a restart waits for active transfers to finish
+        'bandwidth_limit_mbps': '0',  # Mbit/s for the whole server, 0 is unlimited
+        'client_bandwidth_mbps': '0',  # Mbit/s per client address
+        'transfer_bandwidth_mbps': '0',  # Mbit/s per upload or download
+        'upload_weight': '1',  # share of the limits an upload gets next to a download
+        'download_weight': '1',
+        'max_disk_writers': '8',  # uploads writing to disk at once, across all workers
+        'upload_queue_size': '64',  # uploads waiting for a writer before new ones get 503
+        'write_behind': 'true',  # write large uploads in blocks from I/O threads
+        'preview_cache_mb': '256',  # disk budget for cached thumbnails
+        'preview_workers': '2'  # thumbnail processes per server process
     }
 }
 
 def load_config():
     config = configparser.ConfigParser()
+    # Start from the defaults so older config files pick up new keys
+    config.read_dict(DEFAULT_CONFIG)
     if os.path.exists(CONFIG_FILE):
         config.read(CONFIG_FILE)
+        if config.has_option('Server', 'tls_ticket_lifetime'):
+            # Older files gave the tickets a lifetime in seconds, with 0 turning them off
+            lifetime = config['Server'].get('tls_ticket_lifetime')
+            config['Server']['tls_session_tickets'] = 'false' if lifetime.strip() == '0' else 'true'
+            config.remove_option('Server', 'tls_ticket_lifetime')
     else:
-        config.read_dict(DEFAULT_CONFIG)
         with open(CONFIG_FILE, 'w') as configfile:
             config.write(configfile)
     return config
 
 def save_config(config):
-    with open(CONFIG_FILE, 'w') as configfile:
+    # Replaced in one step, so a watcher never reads a half-written file
+    temp_path = f'{CONFIG_FILE}.{uuid.uuid4().hex}.tmp'
+    with open(temp_path, 'w') as configfile:
         config.write(configfile)
+    os.replace(temp_path, CONFIG_FILE)
 
 config = load_config()
 
@@ -55,104 +191,2746 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024 * 1024  # 64GB max-size
+app.config['MAX_CONTENT_LENGTH'] = config['Server'].getint('max_upload_size_gb') * 1024 * 1024 * 1024
 
-# Improved FileHandler with debouncing
-class FileHandler(FileSystemEventHandler):
+# Metrics
+# Each OS thread updates its own shard of counters, so hot paths never take a
+# lock; /metrics sums the shards. Under eventlet every green thread shares one
+# OS thread and so one shard. Prefork workers also write their totals to a
+# shared folder every few seconds, and /metrics folds in the other workers'.
+METRICS = {
+    'localhttps_http_bytes_received_total': ('counter', 'Request body bytes read, by route'),
+    'localhttps_http_bytes_sent_total': ('counter', 'Response body bytes written, by route'),
+    'localhttps_active_transfers': ('gauge', 'Uploads and downloads in progress'),
+    'localhttps_transfer_throughput_bytes_per_second': ('histogram', 'Throughput of finished transfers of 1MB or more'),
+    'localhttps_tls_handshake_seconds': ('histogram', 'Server side TLS handshake time (eventlet server)'),
+    'localhttps_socketio_clients': ('gauge', 'Connected Socket.IO clients'),
+    'localhttps_socketio_emits_total': ('counter', 'Socket.IO events emitted, by event'),
+    'localhttps_file_events_total': ('counter', 'Upload folder events from watchdog, by type'),
+    'localhttps_listing_seconds': ('histogram', 'Time to build a /files response')
+}
+HISTOGRAM_BUCKETS = {
+    'localhttps_transfer_throughput_bytes_per_second': (1e6, 1e7, 5e7, 1e8, 2.5e8, 5e8, 1e9, 2.5e9),
+    'localhttps_tls_handshake_seconds': (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+    'localhttps_listing_seconds': (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5)
+}
+METRICS_FLUSH_INTERVAL = 5  # seconds between prefork workers' snapshots
+THROUGHPUT_MIN_BYTES = 1024 * 1024
+
+class Metrics:
     def __init__(self):
-        self.last_modified = 0
-        self.delay = 1  # 1 second debounce delay
+        self.shards = {}  # native thread id -> {(name, labels): value or histogram counts}
+        self.folder = None  # Shared snapshot folder in prefork mode
 
-    def on_any_event(self, event):
-        if event.is_directory:
-            return
+    def shard(self):
+        ident = threading.get_native_id()
+        shard = self.shards.get(ident)
+        if shard is None:
+            shard = self.shards[ident] = {}
+        return shard
+
+    def inc(self, name, labels=(), value=1):
+        shard = self.shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name, value, labels=()):
+        shard = self.shard()
+        key = (name, labels)
+        counts = shard.get(key)
+        if counts is None:
+            # One slot per bucket plus +Inf, then the running sum
+            counts = shard[key] = [0] * (len(HISTOGRAM_BUCKETS[name]) + 2)
+        counts[bisect.bisect_left(HISTOGRAM_BUCKETS[name], value)] += 1
+        counts[-1] += value
+
+    def snapshot(self):
+        totals = {}
+        for shard in list(self.shards.values()):
+            for key, value in shard.copy().items():
+                merge_metric(totals, key, value)
+        return totals
+
+    def flush(self):
+        temp_path = os.path.join(self.folder, f'{os.getpid()}.json.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump([[name, labels, value] for (name, labels), value in self.snapshot().items()], f)
+        os.replace(temp_path, os.path.join(self.folder, f'{os.getpid()}.json'))
+
+    def run_flusher(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self):
+        totals = self.snapshot()
+        if self.folder is None:
+            return totals
+        for entry in os.listdir(self.folder):
+            pid = entry.split('.')[0]
+            if not entry.endswith('.json') or pid == str(os.getpid()):
+                continue
+            try:
+                with open(os.path.join(self.folder, entry)) as f:
+                    values = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = process_alive(int(pid))
+            for name, labels, value in values:
+                # Counters outlive a worker; its gauges go with it
+                if alive or METRICS[name][0] != 'gauge':
+                    merge_metric(totals, (name, tuple(tuple(label) for label in labels)), value)
+        return totals
+
+def merge_metric(totals, key, value):
+    if isinstance(value, list):
+        current = totals.get(key)
+        totals[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+    else:
+        totals[key] = totals.get(key, 0) + value
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+def render_metrics(totals):
+    # Prometheus text exposition format 0.0.4
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (metric, labels), value in sorted(totals.items()):
+            if metric != name:
+                continue
+            if kind != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS[name] + (float('inf'),), value):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# Endpoints that move file contents, and the route label they are metered under
+TRANSFER_ENDPOINTS = {
+    'download_file': '/download/<filename>',
+    'download_archive': '/archive',
+    'upload_file': '/upload',
+    'upload_raw': '/upload',
+    'upload_batch': '/upload',
+    'upload_chunk': '/upload',
+    'finalize_chunked_upload': '/upload',
+    'store_chunk': '/store',
+    'store_file': '/store'
+}
+
+def metrics_route(environ):
+    # Matched with the app's own URL map, so /upload_cert or a status call is no transfer
+    if 'localhttps.route' not in environ:
+        try:
+            endpoint, _ = app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = None
+        route = TRANSFER_ENDPOINTS.get(endpoint)
+        environ['localhttps.route'] = (('route', route),) if route else None
+    return environ['localhttps.route']
+
+class CountingInput:
+    """wsgi.input wrapper that counts the request body bytes the app reads"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.received = 0
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.received += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.received += len(data)
+        return data
+
+    def readinto(self, view):
+        if hasattr(self.stream, 'readinto'):
+            read = self.stream.readinto(view)
+        else:
+            data = self.stream.read(len(view))
+            read = len(data)
+            view[:read] = data
+        self.received += read
+        return read
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+class MeteredResponse:
+    """Counts the response body as it is sent and records the transfer once it closes"""
+
+    def __init__(self, iterable, labels, body, started, environ):
+        self.iterable = iterable
+        self.labels = labels
+        self.body = body
+        self.started = started
+        self.environ = environ
+        self.sent = 0
+
+    def __iter__(self):
+        for data in self.iterable:
+            self.sent += len(data)
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            finish_transfer(self.labels, self.body.received, self.sent, self.started, self.environ)
+
+def note_transfer(direction, name, size=None, seconds=None):
+    # Recorded in the transfer history once the response is closed; size and
+    # seconds default to what the request actually moved and took
+    notes = request.environ.get('localhttps.transfers')
+    if notes is not None:
+        notes.append((direction, name, size, seconds))
+
+def finish_transfer(labels, received, sent, started, environ):
+    metrics.inc('localhttps_active_transfers', value=-1)
+    metrics.inc('localhttps_http_bytes_received_total', labels, received)
+    metrics.inc('localhttps_http_bytes_sent_total', labels, sent)
+    size = max(received, sent)
+    seconds = time.perf_counter() - started
+    if size >= THROUGHPUT_MIN_BYTES and seconds > 0:
+        direction = (('direction', 'upload'),) if received > sent else (('direction', 'download'),)
+        metrics.observe('localhttps_transfer_throughput_bytes_per_second', size / seconds, direction)
+    notes = environ.get('localhttps.transfers')
+    if notes:
+        client = environ.get('REMOTE_ADDR')
+        rows = [(name, direction, client, (sent if direction == 'download' else received) if size is None else size,
+                 seconds if elapsed is None else elapsed) for direction, name, size, elapsed in notes]
+        try:
+            metadata_store().record_transfers(rows)
+        except sqlite3.Error as e:
+            print(f"Error recording transfers: {e}")
+
+class TransferMetrics:
+    """WSGI middleware metering the upload and download routes"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        labels = metrics_route(environ)
+        if labels is None:
+            return self.wsgi_app(environ, start_response)
+        started = time.perf_counter()
+        body = environ['wsgi.input'] = CountingInput(environ['wsgi.input'])
+        # Shared by reference: the Socket.IO middleware hands Flask a copy of environ
+        environ['localhttps.transfers'] = []
+        metrics.inc('localhttps_active_transfers')
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+        except BaseException:
+            finish_transfer(labels, body.received, 0, started, environ)
+            raise
+        return MeteredResponse(iterable, labels, body, started, environ)
+
+app.wsgi_app = TransferMetrics(app.wsgi_app)
+
+# Bandwidth shaping
+# Every upload and download paces itself with its own token bucket. The bucket's
+# rate is the transfer's weighted share of the server-wide and per-client limits,
+# recomputed as transfers come and go, so one large download no longer starves
+# everyone else. Prefork workers publish their active weights in shared memory.
+SHAPING_REFRESH = 0.25  # seconds between rate recomputations
+SHAPING_BURST = 0.25  # seconds of traffic an idle bucket may save up
+SHAPING_BLOCK = 64 * 1024  # downloads are paced in pieces this size
+CLIENT_SLOTS = 256  # client addresses hash into this many shared weight counters
+
+class Bandwidth:
+    """Active transfer weights, in total and per client, for every worker"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.row = 0
+        self.weights = [0.0] * (1 + CLIENT_SLOTS)
+
+    def share_between(self, workers):
+        # Called before forking; each worker then only writes to its own row
+        self.weights = RawArray('d', workers * (1 + CLIENT_SLOTS))
+
+    def use_row(self, row):
+        self.row = row
+        start = row * (1 + CLIENT_SLOTS)
+        self.weights[start:start + 1 + CLIENT_SLOTS] = [0.0] * (1 + CLIENT_SLOTS)  # A respawned worker starts clean
+
+    def add(self, slot, weight):
+        start = self.row * (1 + CLIENT_SLOTS)
+        with self.lock:
+            self.weights[start] += weight
+            self.weights[start + 1 + slot] += weight
+
+    def totals(self, slot):
+        rows = range(0, len(self.weights), 1 + CLIENT_SLOTS)
+        return sum(self.weights[i] for i in rows), sum(self.weights[i + 1 + slot] for i in rows)
+
+    def rate(self, slot, weight):
+        # Bytes per second this transfer may use right now
+        server = config['Server']
+        limits = [server.getint('transfer_bandwidth_mbps')]
+        total, client_total = self.totals(slot)
+        for key, active in (('bandwidth_limit_mbps', total), ('client_bandwidth_mbps', client_total)):
+            limits.append(server.getint(key) * weight / max(active, weight))
+        limits = [limit for limit in limits if limit > 0]
+        return min(limits) * 125000 if limits else None
+
+bandwidth = Bandwidth()
 
-        # Implement debouncing
-        current_time = time.time()
-        if current_time - self.last_modified < self.delay:
+class TokenBucket:
+    """Paces one transfer at its current share of the bandwidth"""
+
+    def __init__(self, client, weight):
+        self.slot = zlib.crc32(client.encode()) % CLIENT_SLOTS
+        self.weight = weight
+        self.rate = None
+        self.tokens = 0
+        self.updated = self.refresh_at = time.monotonic()
+        self.active = False  # Holds a share only while bytes flow, not while queued or thinking
+
+    def limited(self):
+        return self.rate is not None
+
+    def consume(self, size):
+        if not size:
             return
-        
-        self.last_modified = current_time
-        
-        # Get updated file list
-        files = []
-        for filename in os.listdir(UPLOAD_FOLDER):
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
+        now = time.monotonic()
+        if not self.active:
+            bandwidth.add(self.slot, self.weight)
+            self.active = True
+            self.tokens = 0
+            self.updated = self.refresh_at = now
+        if now >= self.refresh_at:
+            self.rate = bandwidth.rate(self.slot, self.weight)
+            self.refresh_at = now + SHAPING_REFRESH
+        elapsed, self.updated = now - self.updated, now
+        if self.rate is None:
+            self.tokens = 0
+            return
+        # Going into debt and sleeping it off keeps the average rate exact
+        self.tokens = min(self.tokens + elapsed * self.rate, self.rate * SHAPING_BURST) - size
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.rate)
+
+    def pause(self):
+        if self.active:
+            bandwidth.add(self.slot, -self.weight)
+            self.active = False
+
+    close = pause
+
+class ShapedInput:
+    """wsgi.input wrapper that paces request body reads"""
+
+    def __init__(self, stream, bucket, length):
+        self.stream = stream
+        self.bucket = bucket
+        self.remaining = length  # None for chunked bodies, which end with an empty read
+
+    def consumed(self, size):
+        if self.remaining is not None:
+            self.remaining -= size
+        self.bucket.consume(size)
+        if not size or self.remaining == 0:
+            self.bucket.pause()  # The body is in; writing and answering take no bandwidth
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.consumed(len(data))
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.consumed(len(data))
+        return data
+
+    def readinto(self, view):
+        read = read_into(self.stream, view)
+        self.consumed(read)
+        return read
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+class ShapedResponse:
+    """Paces the response body and gives the transfer's share back once it closes"""
+
+    def __init__(self, iterable, bucket):
+        self.iterable = iterable
+        self.bucket = bucket
+
+    def __iter__(self):
+        for data in self.iterable:
+            if len(data) <= SHAPING_BLOCK or not self.bucket.limited():
+                self.bucket.consume(len(data))
+                yield data
+                continue
+            for start in range(0, len(data), SHAPING_BLOCK):
+                piece = data[start:start + SHAPING_BLOCK]
+                self.bucket.consume(len(piece))
+                yield piece
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.bucket.close()
+
+class BandwidthShaping:
+    """WSGI middleware applying the bandwidth limits to the upload and download routes"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if metrics_route(environ) is None:
+            return self.wsgi_app(environ, start_response)
+        direction = 'download_weight' if environ.get('REQUEST_METHOD') in ('GET', 'HEAD') else 'upload_weight'
+        bucket = TokenBucket(environ.get('REMOTE_ADDR', ''), config['Server'].getint(direction))
+        length = environ.get('CONTENT_LENGTH')
+        environ['wsgi.input'] = ShapedInput(environ['wsgi.input'], bucket,
+                                            int(length) if length and length.isdigit() else None)
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+        except BaseException:
+            bucket.close()
+            raise
+        return ShapedResponse(iterable, bucket)
+
+app.wsgi_app = BandwidthShaping(app.wsgi_app)
+
+# File index
+def walk_files(folder, prefix=''):
+    """Yields (name, DirEntry) for every visible file under folder, names being
+    '/'-separated paths relative to it; dot files and folders are skipped"""
+    pending = [(folder, prefix)]
+    while pending:
+        path, prefix = pending.pop()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.name.startswith('.'):
+                        continue  # In-progress uploads, metadata, the content store
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append((entry.path, prefix + entry.name + '/'))
+                        elif entry.is_file():
+                            yield prefix + entry.name, entry
+                    except OSError:
+                        continue  # Skip entries that can't be accessed
+        except OSError:
+            continue
+
+RECONCILE_YIELD_EVERY = 1000  # files stat()ed between yields while checking the folder
+
+class FileIndex:
+    """In-memory listing of the upload folder and its subfolders, seeded from
+    the metadata store and checked against the folder in the background, kept
+    current by applying watchdog events as deltas and written through to the store"""
+
+    SORT_KEYS = {
+        'name': lambda entry: entry['name'],
+        'size': lambda entry: entry['size'],
+        'mtime': lambda entry: entry['mtime']
+    }
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.folder = None
+        self.watched = False  # True once a file monitor keeps the index current
+        self.replica = False  # Prefork workers > 0 only apply deltas broadcast by worker 0
+        self.sorted_views = {}  # sort key -> entries in ascending order, dropped on change
+        # Every change bumps the version; take_delta() reports what changed since
+        # the last broadcast so clients can patch their copy
+        self.version = 0
+        self.seeded_version = 0
+        self.broadcast_version = 0
+        self.created = {}  # name -> version it was added at (0 if present when seeded)
+        self.dirty = set()  # names changed since the last broadcast
+
+    @staticmethod
+    def make_entry(name, st, digest):
+        return FileIndex.stored_entry(name, (st.st_size, st.st_mtime_ns, st.st_ino, digest))
+
+    @staticmethod
+    def stored_entry(name, row):
+        # From a metadata store row; mtime comes from nanoseconds either way so
+        # the two kinds of entry compare equal for an unchanged file
+        size, mtime_ns, _, digest = row
+        return {
+            'name': name,
+            'size': size,
+            'size_readable': convert_size(size),
+            'mtime': mtime_ns / 1e9,
+            'digest': digest
+        }
+
+    @staticmethod
+    def manifest_entry(name, header):
+        return {
+            'name': name,
+            'size': header['size'],
+            'size_readable': convert_size(header['size']),
+            'mtime': header['mtime'],
+            'digest': relabel_digest(header.get('digest'))
+        }
+
+    def seed(self, folder, stored=False, notify=None):
+        # With stored=True the index starts from the metadata store's rows and the
+        # folder is checked against them in the background, calling notify() if
+        # anything changed; replicas leave the check to worker 0. Otherwise, or
+        # when the store is empty, the folder is walked before this returns.
+        started = time.perf_counter()
+        metadata = metadata_store(folder)
+        known = metadata.load()
+        if stored and known:
+            entries = {name: self.stored_entry(name, row) for name, row in known.items()}
+            print(f"Loaded {len(entries)} files from the metadata store in {time.perf_counter() - started:.2f}s")
+        else:
+            entries = self.scan(folder, metadata, known)
+            print(f"Indexed {len(entries)} files in {time.perf_counter() - started:.2f}s")
+        store = ContentStore(folder)
+        for name in store.manifest_names():
+            header = None if name in entries else store.read_header(name)
+            if header:
+                entries[name] = self.manifest_entry(name, header)
+        with self.lock:
+            self.folder = folder
+            self.entries = entries
+            self.sorted_views = {}
+            # Versions start from the clock so they keep increasing across restarts
+            self.version = max(self.version + 1, int(time.time() * 1000))
+            self.seeded_version = self.version
+            self.created = {}
+            self.dirty = set()
+        if stored and known and not self.replica:
+            threading.Thread(target=self.reconcile, args=(folder, known, notify), daemon=True).start()
+
+    def scan(self, folder, metadata, known):
+        # Full walk; files whose stat still matches their stored row keep it,
+        # only new, changed and vanished files are written back
+        entries = {}
+        changed = []
+        for name, entry in walk_files(folder):
             try:
-                size = os.path.getsize(filepath)
-                files.append({
-                    'name': filename,
-                    'size': size,
-                    'size_readable': convert_size(size)
-                })
+                st = entry.stat()
             except OSError:
                 continue  # Skip files that can't be accessed
-                
-        # Emit update through Socket.IO
-        socketio.emit('files_update', {'files': files}, namespace='/')
+            row = known.pop(name, None)
+            if row is not None and row[:3] == (st.st_size, st.st_mtime_ns, st.st_ino):
+                digest = row[3]
+            else:
+                legacy = read_file_metadata(name, st, folder)  # JSON sidecar from older versions
+                digest = legacy and relabel_digest(legacy.get('digest'))
+                changed.append((name, st, digest))
+            entries[name] = self.make_entry(name, st, digest)
+        if changed and known:
+            # Files moved while the server was down keep their inode and digest
+            moved = {row[:3]: row[3] for row in known.values() if row[3]}
+            changed = [(name, st, digest or moved.get((st.st_size, st.st_mtime_ns, st.st_ino)))
+                       for name, st, digest in changed]
+            for name, st, digest in changed:
+                entries[name]['digest'] = digest
+        metadata.sync(changed, list(known))
+        return entries
+
+    def reconcile(self, folder, known, notify):
+        # Background half of a stored seed: applies what changed while the server
+        # was down through refresh, so it reaches clients as an ordinary delta
+        started = time.perf_counter()
+        changed = []
+        for count, (name, entry) in enumerate(walk_files(folder)):
+            if count % RECONCILE_YIELD_EVERY == 0:
+                time.sleep(0)  # Lets requests run between batches of stat() calls under eventlet
+                if self.folder != folder:
+                    return  # The upload folder was switched and seeded afresh
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            row = known.pop(name, None)
+            if row is None or row[:3] != (st.st_size, st.st_mtime_ns, st.st_ino):
+                changed.append(name)
+        self.refresh_many(changed)
+        for name in known:
+            self.refresh(name)  # Gone, unless an event already brought it back
+        print(f"Checked the upload folder in {time.perf_counter() - started:.2f}s: "
+              f"{len(changed)} new or changed, {len(known)} gone")
+        if (changed or known) and notify:
+            notify()
+
+    def ensure_current(self):
+        # Without a file monitor there are no events to apply, so rescan
+        if not self.watched or self.folder != app.config['UPLOAD_FOLDER']:
+            self.seed(app.config['UPLOAD_FOLDER'])
+
+    def name_for(self, path):
+        # Index name for a path under the upload folder, None outside it or under a dot folder
+        if self.folder is None:
+            return None
+        parts = os.path.relpath(os.path.abspath(path), os.path.abspath(self.folder)).split(os.sep)
+        if parts[0] in ('.', '..') or any(part.startswith('.') for part in parts):
+            return None
+        return '/'.join(parts)
+
+    def refresh(self, name):
+        if self.folder is None or self.replica:
+            return None  # Not seeded yet, or worker 0 will broadcast the change
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+        except OSError:
+            st = None
+        metadata = None
+        if st is not None and stat.S_ISREG(st.st_mode):
+            metadata = metadata_store(self.folder)
+            entry = self.make_entry(name, st, metadata.digest(name, st))
+        else:
+            header = ContentStore(self.folder).read_header(name)
+            if header is None:
+                return self.remove(name)
+            entry = self.manifest_entry(name, header)
+        with self.lock:
+            if self.entries.get(name) == entry:
+                return None
+            self.version += 1
+            if name not in self.entries:
+                self.created[name] = self.version
+            self.entries[name] = entry
+            self.sorted_views = {}
+            self.dirty.add(name)
+        if metadata is not None:
+            metadata.put(name, st, entry['digest'])
+        return entry
+
+    def refresh_many(self, names):
+        # A batch of new files becomes one version, so it goes out as one delta
+        if self.folder is None or self.replica:
+            return
+        metadata = metadata_store(self.folder)
+        entries = {}
+        rows = []
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                continue
+            entries[name] = self.make_entry(name, st, metadata.digest(name, st))
+            rows.append((name, st, entries[name]['digest']))
+        metadata.sync(rows, [])
+        with self.lock:
+            changed = {name: entry for name, entry in entries.items() if self.entries.get(name) != entry}
+            if not changed:
+                return
+            self.version += 1
+            for name, entry in changed.items():
+                if name not in self.entries:
+                    self.created[name] = self.version
+                self.entries[name] = entry
+                self.dirty.add(name)
+            self.sorted_views = {}
+
+    def remove(self, name):
+        if self.replica:
+            return None
+        if self.folder is not None:
+            metadata_store(self.folder).sync([], [name])
+        with self.lock:
+            if self.entries.pop(name, None) is None:
+                return None
+            self.version += 1
+            self.sorted_views = {}
+            self.dirty.add(name)
+        return name
+
+    def take_delta(self):
+        # Changes since the last call, as added/changed entries and removed names
+        with self.lock:
+            base = self.broadcast_version
+            self.broadcast_version = self.version
+            if base < self.seeded_version:
+                self.dirty = set()
+                return {'version': self.version, 'base_version': base, 'resync': True, 'folder': self.folder}
+            delta = {'version': self.version, 'base_version': base, 'added': [], 'changed': [], 'removed': []}
+            for name in self.dirty:
+                entry = self.entries.get(name)
+                created = self.created.get(name, 0)
+                if entry is None:
+                    self.created.pop(name, None)
+                    if created <= base:
+                        delta['removed'].append(name)  # Skip files that came and went in one window
+                elif created > base:
+                    delta['added'].append(entry)
+                else:
+                    delta['changed'].append(entry)
+            self.dirty = set()
+            return delta
+
+    def apply_delta(self, delta):
+        # Replica side of take_delta(): adopt the broadcaster's state and version
+        if delta.get('resync') and delta.get('folder') not in (None, self.folder):
+            self.seed(delta['folder'])  # The upload folder was switched
+        with self.lock:
+            if delta.get('resync'):
+                pass  # Our own scan is current enough; clients will refetch
+            else:
+                for entry in delta['added'] + delta['changed']:
+                    self.entries[entry['name']] = entry
+                for name in delta['removed']:
+                    self.entries.pop(name, None)
+            self.version = delta['version']
+            self.sorted_views = {}
+
+    def remove_folder(self, name):
+        with self.lock:
+            names = [entry for entry in self.entries if entry.startswith(name + '/')]
+        for entry in names:
+            self.remove(entry)
+
+    def refresh_folder(self, name):
+        # A folder moved in arrives as a single event; its files need indexing
+        for entry, _ in walk_files(os.path.join(self.folder, name), name + '/'):
+            self.refresh(entry)
+
+    def apply_event(self, event):
+        if event.is_directory:
+            if event.event_type in ('deleted', 'moved'):
+                name = self.name_for(event.src_path)
+                if name:
+                    self.remove_folder(name)
+            if event.event_type in ('created', 'moved'):
+                name = self.name_for(getattr(event, 'dest_path', '') or event.src_path)
+                if name:
+                    self.refresh_folder(name)
+            return
+        if event.event_type == 'moved':
+            old_name = self.name_for(event.src_path)
+            name = self.name_for(event.dest_path)
+            if old_name and name and not self.replica:
+                metadata_store(self.folder).rename(old_name, name)  # The digest moves with the file
+            if old_name:
+                self.remove(old_name)
+            if name:
+                self.refresh(name)
+        else:
+            name = self.name_for(event.src_path)
+            if name:
+                self.refresh(name)
+
+    def sorted_view(self, sort):
+        with self.lock:
+            view = self.sorted_views.get(sort)
+            if view is None:
+                view = sorted(self.entries.values(), key=self.SORT_KEYS[sort])
+                self.sorted_views[sort] = view
+            return view
+
+    def query(self, sort='name', reverse=False, prefix='', search='', offset=0, limit=None):
+        view = self.sorted_view(sort)
+        if prefix and sort == 'name':
+            # Names are sorted, so the matches are one contiguous slice
+            start = bisect.bisect_left(view, prefix, key=lambda entry: entry['name'])
+            end = start
+            while end < len(view) and view[end]['name'].startswith(prefix):
+                end += 1
+            view = view[start:end]
+        elif prefix:
+            view = [entry for entry in view if entry['name'].startswith(prefix)]
+        if search:
+            search = search.casefold()
+            view = [entry for entry in view if search in entry['name'].casefold()]
+        if reverse:
+            view = view[::-1]
+        end = None if limit is None else offset + limit
+        return len(view), view[offset:end]
+
+file_index = FileIndex()
+
+COALESCE_WINDOW = 0.25  # seconds of quiet before a files_update goes out
+COALESCE_MAX_DELAY = 2  # but never hold changes back longer than this
+
+class FileBroadcaster:
+    """Coalesces file index changes over a trailing window and emits them as one delta"""
+
+    def __init__(self):
+        self.wake = threading.Event()
+        self.last_event = 0
+
+    def notify(self):
+        self.last_event = time.monotonic()
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            first_event = time.monotonic()
+            while True:
+                now = time.monotonic()
+                quiet = now - self.last_event
+                if quiet >= COALESCE_WINDOW or now - first_event >= COALESCE_MAX_DELAY:
+                    break
+                time.sleep(COALESCE_WINDOW - quiet)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        delta = file_index.take_delta()
+        if delta.get('resync') or delta['added'] or delta['changed'] or delta['removed']:
+            metrics.inc('localhttps_socketio_emits_total', (('event', 'files_update'),))
+            socketio.emit('files_update', delta, namespace='/')
+
+class FileHandler(FileSystemEventHandler):
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.subfolders = {}  # path -> watch, for top-level folders
+
+    def on_any_event(self, event):
+        if event.event_type in ('opened', 'closed', 'closed_no_write') or file_index.folder is None:
+            return  # Not seeded yet; the seed sees the folder as it is
+        if event.is_directory:
+            if event.event_type == 'modified':
+                return
+            self.track_subfolder(event)
+        metrics.inc('localhttps_file_events_total', (('type', event.event_type),))
+        file_index.apply_event(event)
+        if not event.is_directory:
+            # Uploads replace files by renaming out of the unwatched .partial folder,
+            # which watchdog reports as created
+            for path in (event.src_path, getattr(event, 'dest_path', '')):
+                name = path and file_index.name_for(path)
+                if name:
+                    preview_cache.invalidate(name)
+        self.broadcaster.notify()
+
+    def track_subfolder(self, event):
+        # Top-level folders get their own recursive watch, see watch_upload_folder()
+        if event.event_type in ('deleted', 'moved'):
+            watch = self.subfolders.pop(os.path.abspath(event.src_path), None)
+            if watch is not None:
+                file_observer.unschedule(watch)
+        if event.event_type in ('created', 'moved'):
+            path = os.path.abspath(getattr(event, 'dest_path', '') or event.src_path)
+            if os.path.dirname(path) == os.path.abspath(file_index.folder) and not os.path.basename(path).startswith('.'):
+                self.subfolders[path] = file_observer.schedule(self, path, recursive=True)
+
+def watch_upload_folder(folder):
+    # A recursive watch on the upload folder itself would also see every write
+    # into .partial and .store, so only its visible subfolders are watched
+    # recursively; folders created later are added by track_subfolder()
+    file_observer.unschedule_all()
+    file_observer.schedule(file_event_handler, folder, recursive=False)
+    file_event_handler.subfolders = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+                path = os.path.abspath(entry.path)
+                file_event_handler.subfolders[path] = file_observer.schedule(file_event_handler, path, recursive=True)
+
+file_observer = None  # Set in the process that watches the upload folder
+file_event_handler = None
 
 def start_file_monitor():
-    event_handler = FileHandler()
+    global file_observer, file_event_handler
+    broadcaster = FileBroadcaster()
+    event_handler = FileHandler(broadcaster)
     observer = Observer()
-    observer.schedule(event_handler, UPLOAD_FOLDER, recursive=False)
+    file_observer, file_event_handler = observer, event_handler
+    # Seed first: events are applied against the index, and seeding creates .meta
+    file_index.seed(UPLOAD_FOLDER, stored=True, notify=broadcaster.notify)
+    watch_upload_folder(UPLOAD_FOLDER)
     observer.start()
+    file_index.broadcast_version = file_index.version
+    file_index.watched = True
+    threading.Thread(target=broadcaster.run, daemon=True).start()
+    threading.Thread(target=run_partial_sweeper, daemon=True).start()
+    if dedup_enabled():
+        threading.Thread(target=ContentStore(UPLOAD_FOLDER).collect_garbage, daemon=True).start()
     return observer
 
+def switch_upload_folder(folder):
+    # Uploads already under way keep the folder they started in
+    global UPLOAD_FOLDER
+    UPLOAD_FOLDER = folder
+    app.config['UPLOAD_FOLDER'] = folder
+    if file_observer is not None:
+        watch_upload_folder(folder)
+        file_index.seed(folder)
+        file_event_handler.broadcaster.notify()  # Goes out as a resync
+
 # Certificate management
 def generate_ssl_certificate(cert_path, key_path, country="US", state="State", 
                            locality="City", org="Organization", 
-                           common_name="localhost", days=365):
-    cmd = (
-        f'openssl req -x509 -newkey rsa:4096 -nodes '
-        f'-out {cert_path} -keyout {key_path} '
-        f'-days {days} -subj "/C={country}/ST={state}/L={locality}'
-        f'/O={org}/CN={common_name}"'
+                           common_name="localhost", days=365, key_type="ecdsa"):
+    # Imported here: most starts reuse an existing certificate and never need it
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+    # ECDSA P-256 signs handshakes far faster than RSA-4096 and every browser accepts it
+    if key_type == 'rsa':
+        key = rsa.generate_private_key(public_exponent=65537, key_size=4096)
+    else:
+        key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([
+        x509.NameAttribute(NameOID.COUNTRY_NAME, country),
+        x509.NameAttribute(NameOID.STATE_OR_PROVINCE_NAME, state),
+        x509.NameAttribute(NameOID.LOCALITY_NAME, locality),
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, org),
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name)
+    ])
+    alt_names = [x509.DNSName(name) for name in dict.fromkeys([common_name, 'localhost'])]
+    alt_names.append(x509.IPAddress(ipaddress.ip_address('127.0.0.1')))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=days))
+        .add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+        .sign(key, hashes.SHA256())
     )
-    os.system(cmd)
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    # Write both next to their targets first so a reload never sees half a pair
+    for path, data, mode in ((key_path, key_pem, 0o600), (cert_path, cert.public_bytes(serialization.Encoding.PEM), 0o644)):
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode), 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
 
-def setup_ssl_context(cert_path, key_path):
-    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
-        print("Generating SSL certificate...")
-        generate_ssl_certificate(cert_path, key_path)
-        print("SSL certificate generated.")
-    
+certificate_context = None  # Built by reload_certificate(), used by handshakes from then on
+
+def use_current_certificate(ssl_object, server_name, context):
+    # Runs for every ClientHello, with or without SNI
+    if certificate_context is not None:
+        ssl_object.context = certificate_context
+
+def load_certificate_context(cert_path, key_path):
+    # Copies of the pair are loaded so a half-written upload can't be read mid-change
+    with tempfile.TemporaryDirectory() as staging:
+        cert_copy = shutil.copyfile(cert_path, os.path.join(staging, 'cert.pem'))
+        key_copy = shutil.copyfile(key_path, os.path.join(staging, 'key.pem'))
+        return build_ssl_context(cert_copy, key_copy)
+
+def reload_certificate():
+    # Open connections keep the certificate they started with
+    global certificate_context
+    certificate_context = load_certificate_context(config['Server']['cert_path'], config['Server']['key_path'])
+
+def announce_certificate_reload():
+    # Prefork workers each hold their own SSLContext; the supervisor passes
+    # SIGHUP on to all of them
+    if PREFORK_PARENT:
+        os.kill(PREFORK_PARENT, signal.SIGHUP)
+
+def handle_reload_signal(signum, frame):
+    # The handler may interrupt code holding config_lock or the index lock, or
+    # run inside eventlet's hub, so the reload itself happens on its own thread
+    if SERVER_MODE == 'eventlet':
+        eventlet.spawn(reload_config_and_certificate)
+    else:
+        threading.Thread(target=reload_config_and_certificate, daemon=True).start()
+
+def reload_config_and_certificate():
+    reload_config_file()
+    try:
+        reload_certificate()
+        print("Reloaded TLS certificate")
+    except (ssl.SSLError, OSError) as e:
+        print(f"Could not reload TLS certificate: {e}")
+
+# Certificate jobs
+# Generation runs on a background executor. Job status is kept in a small JSON
+# file so whichever prefork worker answers a poll can report it.
+CERT_JOBS_KEPT = 20
+cert_executor = ThreadPoolExecutor(max_workers=1)
+cert_jobs_lock = threading.Lock()
+
+def read_cert_jobs():
+    try:
+        with open(CERT_JOBS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cert_job(job):
+    with cert_jobs_lock:
+        jobs = read_cert_jobs()
+        jobs[job['id']] = dict(job)
+        for job_id in sorted(jobs, key=lambda job_id: jobs[job_id]['created'])[:-CERT_JOBS_KEPT]:
+            del jobs[job_id]
+        temp_path = f'{CERT_JOBS_FILE}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(jobs, f)
+        os.replace(temp_path, CERT_JOBS_FILE)
+
+def run_blocking(function, *args, **kwargs):
+    # Key generation is pure CPU; under eventlet it goes to a real OS thread so
+    # the hub keeps serving while RSA-4096 primes are found
+    if SERVER_MODE == 'eventlet':
+        import eventlet.tpool
+        return eventlet.tpool.execute(function, *args, **kwargs)
+    return function(*args, **kwargs)
+
+def run_cert_job(job, options):
+    job['status'] = 'running'
+    save_cert_job(job)
+    try:
+        run_blocking(generate_ssl_certificate, config['Server']['cert_path'], config['Server']['key_path'], **options)
+        reload_certificate()
+        announce_certificate_reload()
+        job['status'] = 'done'
+    except Exception as e:
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    job['finished'] = time.time()
+    save_cert_job(job)
+
+def build_ssl_context(cert_path, key_path):
     ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
     ssl_context.load_cert_chain(cert_path, key_path)
     ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
     ssl_context.set_ciphers('ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256:ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384')
     ssl_context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
     ssl_context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+    # Kernel TLS (Python 3.12+ with OpenSSL 3) lets downloads go out with sendfile, see send_file_slice()
+    ssl_context.options |= getattr(ssl, 'OP_ENABLE_KTLS', 0)
+    # Session tickets let returning browsers, and every parallel request after
+    # the first, skip the full handshake. OpenSSL makes the ticket keys with this
+    # context and prefork workers fork after it exists, so they all accept each
+    # other's tickets. Python can't set or rotate the keys; they last until a restart.
+    if not config['Server'].getboolean('tls_session_tickets'):
+        ssl_context.options |= ssl.OP_NO_TICKET
     
     return ssl_context
 
-@app.route('/upload', methods=['POST'])
-def upload_file():
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+def setup_ssl_context(cert_path, key_path):
+    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+        print("Generating SSL certificate...")
+        generate_ssl_certificate(cert_path, key_path, key_type=config['Server']['cert_key_type'])
+        print("SSL certificate generated.")
     
-    if file:
-        filename = secure_filename(file.filename)
+    ssl_context = build_ssl_context(cert_path, key_path)
+    # OpenSSL keeps one certificate per key type in a context, so a reload
+    # builds a new one and each handshake is switched over to it here. This
+    # context stays the listener's and keeps the session ticket keys.
+    ssl_context.sni_callback = use_current_certificate
+    return ssl_context
+
+# Live configuration
+# Changes from /config or an edited server_config.ini are validated as a whole
+# and then swapped in together, without a restart. Only settings baked into the
+# listening socket or the process layout need one.
+RESTART_KEYS = {'host', 'port', 'server_mode', 'workers', 'max_connections', 'keepalive_timeout',
+                'tls_session_tickets'}
+POSITIVE_KEYS = {'port', 'upload_concurrency', 'chunk_streams', 'max_streams_per_client', 'max_connections',
+                 'workers', 'max_upload_size_gb', 'upload_weight', 'download_weight', 'max_disk_writers',
+                 'upload_queue_size', 'preview_workers'}
+NON_NEGATIVE_KEYS = {'keepalive_timeout', 'compression_cache_mb', 'preview_cache_mb', 'drain_timeout', 'partial_upload_hours',
+                     'bandwidth_limit_mbps', 'client_bandwidth_mbps', 'transfer_bandwidth_mbps'}
+CHOICES = {
+    'server_mode': SERVER_MODES,
+    'cert_key_type': ['ecdsa', 'rsa'],
+    'dedup': list(configparser.ConfigParser.BOOLEAN_STATES),
+    'compression': list(configparser.ConfigParser.BOOLEAN_STATES),
+    'write_behind': list(configparser.ConfigParser.BOOLEAN_STATES),
+    'tls_session_tickets': list(configparser.ConfigParser.BOOLEAN_STATES)
+}
+config_lock = threading.Lock()
+
+def validate_config(values):
+    errors = []
+    for key, value in values.items():
+        if key not in DEFAULT_CONFIG['Server']:
+            errors.append(f'Unknown setting {key}')
+        elif key in POSITIVE_KEYS or key in NON_NEGATIVE_KEYS:
+            try:
+                number = int(value)
+            except ValueError:
+                errors.append(f'{key} must be a whole number')
+                continue
+            if number < (1 if key in POSITIVE_KEYS else 0) or (key == 'port' and number > 65535):
+                errors.append(f'{key} is out of range')
+        elif key in CHOICES and value.lower() not in CHOICES[key]:
+            errors.append(f"{key} must be one of {', '.join(CHOICES[key])}")
+        elif key == 'digest_algorithm' and value not in DIGEST_ALGORITHMS:
+            errors.append(f"{key} must be one of {', '.join(DIGEST_ALGORITHMS)}")
+        elif key == 'digest_algorithm' and value == 'xxh128' and xxhash is None:
+            errors.append('xxh128 digests need the xxhash package')
+        elif key in ('upload_folder', 'cert_path', 'key_path', 'host') and not value.strip():
+            errors.append(f'{key} must not be empty')
+    return errors
+
+def apply_config(values):
+    """Validates new settings and applies the ones that changed. Returns the keys
+    applied live and the keys that only take effect after a restart."""
+    values = {key: str(value) for key, value in values.items()}
+    errors = validate_config(values)
+    if errors:
+        raise ValueError('; '.join(errors))
+    with config_lock:
+        changed = {key: value for key, value in values.items() if config['Server'].get(key) != value}
+        # Everything that can fail happens before any setting is touched
+        tls_context = None
+        if 'cert_path' in changed or 'key_path' in changed:
+            try:
+                tls_context = load_certificate_context(changed.get('cert_path', config['Server']['cert_path']),
+                                                       changed.get('key_path', config['Server']['key_path']))
+            except (ssl.SSLError, OSError) as e:
+                raise ValueError(f'Certificate and key do not load: {e}')
+        folder = changed.get('upload_folder')
+        if folder is not None:
+            try:
+                os.makedirs(folder, exist_ok=True)
+            except OSError as e:
+                raise ValueError(f'upload_folder is not usable: {e}')
+
+        config['Server'].update(changed)
+        app.config['MAX_CONTENT_LENGTH'] = config['Server'].getint('max_upload_size_gb') * 1024 * 1024 * 1024
+        if tls_context is not None:
+            global certificate_context
+            certificate_context = tls_context
+        if folder is not None:
+            switch_upload_folder(folder)
+    applied = sorted(key for key in changed if key not in RESTART_KEYS)
+    restart_required = sorted(key for key in changed if key in RESTART_KEYS)
+    return applied, restart_required
+
+def reload_config_file():
+    file_config = configparser.ConfigParser()
+    file_config.read_dict(DEFAULT_CONFIG)
+    try:
+        file_config.read(CONFIG_FILE)
+        values = {key: value for key, value in file_config['Server'].items() if key in DEFAULT_CONFIG['Server']}
+        applied, restart_required = apply_config(values)
+    except (configparser.Error, ValueError) as e:
+        print(f"Ignoring invalid {CONFIG_FILE}: {e}")
+        return
+    if applied:
+        print(f"Applied configuration changes: {', '.join(applied)}")
+    if restart_required:
+        print(f"Restart to apply: {', '.join(restart_required)}")
+
+class ConfigFileHandler(FileSystemEventHandler):
+    def on_any_event(self, event):
+        if event.event_type not in ('created', 'modified', 'moved'):
+            return
+        path = getattr(event, 'dest_path', '') or event.src_path
+        if os.path.abspath(path) == os.path.abspath(CONFIG_FILE):
+            reload_config_file()
+
+def start_config_watcher():
+    # Every process watches for itself, prefork workers included
+    observer = Observer()
+    observer.schedule(ConfigFileHandler(), os.path.dirname(os.path.abspath(CONFIG_FILE)), recursive=False)
+    observer.start()
+    return observer
+
+# Streaming uploads
+CHUNK_SIZE = 8 * 1024 * 1024  # 8MB per chunk
+COPY_BUFFER_SIZE = 1024 * 1024  # 1MB network reads
+OPEN_FLAGS = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+
+copy_buffers = threading.local()
+
+def copy_buffer():
+    # One reusable read buffer per worker thread instead of a new bytes object per read
+    view = getattr(copy_buffers, 'view', None)
+    if view is None:
+        view = copy_buffers.view = memoryview(bytearray(COPY_BUFFER_SIZE))
+    return view
+
+def read_into(stream, view):
+    if hasattr(stream, 'readinto'):
+        return stream.readinto(view)
+    data = stream.read(len(view))
+    view[:len(data)] = data
+    return len(data)
+
+def partial_folder(folder=None):
+    # Kept inside the upload folder so the final rename never crosses filesystems
+    return os.path.join(folder or app.config['UPLOAD_FOLDER'], '.partial')
+
+def unallocated_partial_space(folder):
+    # Bytes that uploads in progress have claimed but the disk hasn't handed out yet
+    total = 0
+    try:
+        with os.scandir(partial_folder(folder)) as it:
+            for entry in it:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                if hasattr(st, 'st_blocks'):
+                    total += max(0, st.st_size - st.st_blocks * 512)
+    except OSError:
+        pass
+    return total
+
+def write_at(fd, data, offset, lock):
+    view = memoryview(data)
+    while view:
+        if hasattr(os, 'pwrite'):
+            written = os.pwrite(fd, view, offset)
+        else:
+            # Windows has no pwrite, so seek + write under the upload lock
+            with lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+# Write-behind
+# Large uploads are read straight into WRITE_BLOCK_SIZE blocks at block-aligned
+# offsets and written on real OS threads, two buffers per upload so the next
+# block fills from the network while the previous one goes to disk. Every
+# SYNC_INTERVAL bytes the file is flushed in the background and its clean pages
+# dropped, which keeps dirty memory bounded and stops uploads from evicting the
+# page cache.
+WRITE_BLOCK_SIZE = 4 * 1024 * 1024
+SYNC_INTERVAL = 64 * 1024 * 1024
+WRITE_BEHIND_MIN_SIZE = 16 * 1024 * 1024  # smaller uploads are written directly
+IO_THREADS = 4
+
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='upload-io')
+
+def submit_io(function, *args):
+    """Runs function on an OS thread; returns a callable that waits for its result"""
+    if SERVER_MODE == 'eventlet':
+        # Green threads share one OS thread, so disk waits go to eventlet's real thread pool
+        import eventlet.tpool
+        return eventlet.spawn(eventlet.tpool.execute, function, *args).wait
+    return io_executor.submit(function, *args).result
+
+def write_behind_enabled(size):
+    # Positional writes from several threads need pwrite
+    return (config['Server'].getboolean('write_behind') and hasattr(os, 'pwrite')
+            and (size is None or size >= WRITE_BEHIND_MIN_SIZE))
+
+def sync_and_drop(fd):
+    getattr(os, 'fdatasync', os.fsync)(fd)
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)  # Only clean pages go, so it's safe mid-upload
+
+class DiskWriter:
+    """Block writes to one upload file, with periodic syncs to bound its dirty pages"""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.unsynced = 0
+        self.syncing = None
+
+    def write_block(self, block, offset):
+        write_at(self.fd, block, offset, None)
+
+    def written(self, size):
+        # Writes go on while a sync runs; only a second sync waits for the first,
+        # so at most two intervals of a file are ever dirty
+        self.unsynced += size
+        if self.unsynced < SYNC_INTERVAL:
+            return
+        self.unsynced = 0
+        self.wait_sync()
+        self.syncing = submit_io(sync_and_drop, self.fd)
+
+    def wait_sync(self):
+        if self.syncing is not None:
+            syncing, self.syncing = self.syncing, None
+            syncing()
+
+class BlockWriter:
+    """Double-buffered write-behind for one stream of writes at increasing offsets"""
+
+    def __init__(self, disk, offset):
+        self.disk = disk
+        self.offset = offset
+        self.buffers = [bytearray(WRITE_BLOCK_SIZE), bytearray(WRITE_BLOCK_SIZE)]
+        self.filled = 0
+        self.pending = None
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            size = min(len(view), WRITE_BLOCK_SIZE - self.filled)
+            self.buffers[0][self.filled:self.filled + size] = view[:size]
+            self.filled += size
+            view = view[size:]
+            if self.filled == WRITE_BLOCK_SIZE:
+                self.submit()
+
+    def fill(self, stream, limit=WRITE_BLOCK_SIZE):
+        """Reads from stream straight into the current block; returns a view of what was read"""
+        end = self.filled + min(limit, WRITE_BLOCK_SIZE - self.filled)
+        view = memoryview(self.buffers[0])[self.filled:end]
+        read = read_into(stream, view)
+        self.filled += read
+        if self.filled == WRITE_BLOCK_SIZE:
+            self.submit()  # The view stays valid: this buffer is only reused after the next block
+        return view[:read]
+
+    def submit(self):
+        self.wait()  # The other buffer is free again once its write is done
+        block = memoryview(self.buffers[0])[:self.filled]
+        self.pending = submit_io(self.disk.write_block, block, self.offset)
+        self.disk.written(self.filled)
+        self.offset += self.filled
+        self.filled = 0
+        self.buffers.reverse()
+
+    def wait(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            pending()
+
+    def flush(self):
+        if self.filled:
+            self.submit()
+        self.wait()
+
+    def abandon(self):
+        # The descriptor must not be closed under a write still in flight
+        for wait in (self.wait, self.disk.wait_sync):
+            try:
+                wait()
+            except OSError:
+                pass
+
+def preallocate(fd, size):
+    if hasattr(os, 'posix_fallocate') and size > 0:
         try:
-            file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            return jsonify({'message': 'File uploaded successfully'})
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass  # Filesystem doesn't support it, fall back to a sparse file
+    os.ftruncate(fd, size)
 
-# HTML template with enhanced multiple file upload support
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-<meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Secure File Transfer</title>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
-    <style>
-        body {
+def format_throughput(size, seconds):
+    rate = size / seconds if seconds > 0 else 0
+    return {
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'throughput': round(rate),
+        'throughput_readable': convert_size(rate) + '/s'
+    }
+
+# Integrity digests
+# A file's digest is the hash of its per-chunk (CHUNK_SIZE) digests, so it can be
+# computed as bytes stream through whether chunks arrive in order or in parallel
+DIGEST_ALGORITHMS = ['sha256', 'blake2b'] + (['xxh128'] if xxhash else [])
+
+class DigestMismatch(ValueError):
+    pass
+
+def new_hasher(algorithm):
+    if algorithm == 'xxh128':
+        return xxhash.xxh3_128()
+    return hashlib.new(algorithm)
+
+def digest_algorithm():
+    algorithm = config['Server']['digest_algorithm']
+    return algorithm if algorithm in DIGEST_ALGORITHMS else 'sha256'
+
+def combine_digests(algorithm, chunk_digests):
+    hasher = new_hasher(algorithm)
+    for chunk_digest in chunk_digests:
+        hasher.update(chunk_digest)
+    return hasher.hexdigest()
+
+def tree_label(algorithm):
+    # Whole-file digests hash the chunk digests, so they differ from sha256sum
+    # and friends; the label says so
+    return f'{algorithm}-tree'
+
+def relabel_digest(digest):
+    # Digests stored before they were labelled as tree digests
+    if digest and ':' in digest and not digest.partition(':')[0].endswith('-tree'):
+        algorithm, _, hex_digest = digest.partition(':')
+        return f'{tree_label(algorithm)}:{hex_digest}'
+    return digest
+
+def parse_client_digest(value, label):
+    # Accepts "<label>:<hex>" or bare hex, label being the algorithm for chunk
+    # digests and tree_label(algorithm) for whole files
+    if not value:
+        return None
+    name, _, hex_digest = value.strip().rpartition(':')
+    if name and name.lower() != label:
+        raise ValueError(f'Digest must use {label}')
+    return hex_digest.lower()
+
+class StreamDigest:
+    """Hashes a sequential stream chunk by chunk, matching chunked-upload digests"""
+
+    def __init__(self, algorithm):
+        self.algorithm = algorithm
+        self.chunk_digests = []
+        self.current = new_hasher(algorithm)
+        self.filled = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        while view:
+            take = min(len(view), CHUNK_SIZE - self.filled)
+            self.current.update(view[:take])
+            self.filled += take
+            view = view[take:]
+            if self.filled == CHUNK_SIZE:
+                self.chunk_digests.append(self.current.digest())
+                self.current = new_hasher(self.algorithm)
+                self.filled = 0
+
+    def hexdigest(self):
+        tail = [self.current.digest()] if self.filled else []
+        return combine_digests(self.algorithm, self.chunk_digests + tail)
+
+def metadata_folder(folder=None):
+    return os.path.join(folder or app.config['UPLOAD_FOLDER'], '.meta')
+
+def read_file_metadata(name, st, folder=None):
+    # JSON sidecars from before the metadata store; only read to migrate them
+    try:
+        with open(os.path.join(metadata_folder(folder), name + '.json')) as f:
+            metadata = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if metadata.get('size') != st.st_size or metadata.get('mtime_ns') != st.st_mtime_ns:
+        return None  # File was replaced or modified outside of an upload
+    return metadata
+
+# Metadata store
+# One SQLite database per upload folder, in WAL mode so every prefork worker can
+# read while one writes. It holds what the filesystem can't tell us cheaply or at
+# all: digests, and who transferred what, when and how fast. Rows keep size,
+# mtime and inode, so a restart only rewrites the rows of files that changed.
+METADATA_DB = 'files.db'
+TRANSFER_HISTORY_LIMIT = 1000  # most rows /transfers returns
+
+class MetadataStore:
+    """Files and transfer history of one upload folder, in SQLite"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            name TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            digest TEXT
+        );
+        CREATE INDEX IF NOT EXISTS files_by_inode ON files (inode);
+        CREATE TABLE IF NOT EXISTS transfers (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            direction TEXT NOT NULL,
+            client TEXT,
+            bytes INTEGER NOT NULL,
+            seconds REAL NOT NULL,
+            throughput REAL,
+            finished REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS transfers_by_name ON transfers (name, finished);
+        CREATE INDEX IF NOT EXISTS transfers_by_time ON transfers (finished);
+    """
+    UPSERT = ('INSERT INTO files (name, size, mtime_ns, inode, digest) VALUES (?, ?, ?, ?, ?) '
+              'ON CONFLICT (name) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, '
+              'inode = excluded.inode, digest = excluded.digest')
+
+    def __init__(self, folder):
+        os.makedirs(metadata_folder(folder), exist_ok=True)
+        # Autocommit; batches open their own transaction. Writers from other
+        # workers hold the lock for a few milliseconds at most.
+        self.db = sqlite3.connect(os.path.join(metadata_folder(folder), METADATA_DB), timeout=10,
+                                  isolation_level=None, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')  # WAL stays consistent; a crash may lose the last commits
+        self.db.executescript(self.SCHEMA)
+        if self.db.execute('PRAGMA user_version').fetchone()[0] < 1:
+            self.db.execute("UPDATE files SET digest = substr(digest, 1, instr(digest, ':') - 1) || '-tree' || "
+                            "substr(digest, instr(digest, ':')) WHERE digest LIKE '%:%' AND digest NOT LIKE '%-tree:%'")
+            self.db.execute('PRAGMA user_version = 1')  # Digests carry tree labels
+        self.lock = threading.Lock()
+
+    def load(self):
+        # name -> (size, mtime_ns, inode, digest)
+        with self.lock:
+            return {row[0]: row[1:] for row in self.db.execute('SELECT name, size, mtime_ns, inode, digest FROM files')}
+
+    def digest(self, name, st):
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime_ns, digest FROM files WHERE name = ?', (name,)).fetchone()
+            if row is None or row[:2] != (st.st_size, st.st_mtime_ns):
+                # Replaced or modified since the digest was taken, or moved here
+                # from a folder whose events arrive separately
+                row = self.db.execute('SELECT size, mtime_ns, digest FROM files WHERE inode = ? AND size = ? '
+                                      'AND mtime_ns = ?', (st.st_ino, st.st_size, st.st_mtime_ns)).fetchone()
+        return row and row[2]
+
+    def put(self, name, st, digest):
+        with self.lock:
+            self.db.execute(self.UPSERT, (name, st.st_size, st.st_mtime_ns, st.st_ino, digest))
+
+    def sync(self, changed, removed):
+        # changed holds (name, stat, digest) rows, removed names; one transaction
+        if not changed and not removed:
+            return
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self.db.executemany(self.UPSERT, ((name, st.st_size, st.st_mtime_ns, st.st_ino, digest)
+                                                  for name, st, digest in changed))
+                self.db.executemany('DELETE FROM files WHERE name = ?', ((name,) for name in removed))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def rename(self, old_name, new_name):
+        with self.lock:
+            self.db.execute('BEGIN')
+            try:
+                self.db.execute('DELETE FROM files WHERE name = ?', (new_name,))
+                self.db.execute('UPDATE files SET name = ? WHERE name = ?', (new_name, old_name))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def record_transfers(self, transfers):
+        # (name, direction, client, bytes, seconds) rows
+        finished = time.time()
+        with self.lock:
+            self.db.executemany(
+                'INSERT INTO transfers (name, direction, client, bytes, seconds, throughput, finished) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((name, direction, client, size, seconds, size / seconds if seconds > 0 else None, finished)
+                 for name, direction, client, size, seconds in transfers))
+
+    def transfers(self, name=None, direction=None, limit=100):
+        query = 'SELECT name, direction, client, bytes, seconds, throughput, finished FROM transfers'
+        conditions, params = [], []
+        if name is not None:
+            conditions.append('name = ?')
+            params.append(name)
+        if direction is not None:
+            conditions.append('direction = ?')
+            params.append(direction)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY finished DESC LIMIT ?'
+        with self.lock:
+            rows = self.db.execute(query, (*params, limit)).fetchall()
+        columns = ('name', 'direction', 'client', 'bytes', 'seconds', 'throughput', 'finished')
+        return [dict(zip(columns, row)) for row in rows]
+
+metadata_stores = {}  # (pid, folder) -> MetadataStore; connections must not cross a fork
+
+def metadata_store(folder=None):
+    key = (os.getpid(), os.path.abspath(folder or app.config['UPLOAD_FOLDER']))
+    store = metadata_stores.get(key)
+    if store is None:
+        store = metadata_stores[key] = MetadataStore(key[1])
+    return store
+
+class IncomingFile:
+    """Streams one upload into a temp file next to its destination, then renames it into place"""
+
+    def __init__(self, filename, size=None):
+        self.folder = app.config['UPLOAD_FOLDER']
+        os.makedirs(partial_folder(self.folder), exist_ok=True)
+        self.name = filename
+        self.destination = os.path.join(self.folder, filename)
+        self.temp_path = os.path.join(partial_folder(self.folder), uuid.uuid4().hex + '.upload')
+        self.size = size
+        self.offset = 0
+        self.digest = StreamDigest(digest_algorithm())
+        self.lock = threading.Lock()
+        self.fd = os.open(self.temp_path, OPEN_FLAGS | os.O_TRUNC, 0o600)
+        if size:
+            preallocate(self.fd, size)
+        self.blocks = BlockWriter(DiskWriter(self.fd), 0) if write_behind_enabled(size) else None
+
+    def write(self, data):
+        if self.blocks:
+            self.blocks.write(data)
+        else:
+            write_at(self.fd, data, self.offset, self.lock)
+        self.digest.update(data)
+        self.offset += len(data)
+
+    def receive(self, stream):
+        # Write-behind path of receive_stream(): no copy between network and block
+        while True:
+            data = self.blocks.fill(stream)
+            if not data:
+                return self.offset
+            self.digest.update(data)
+            self.offset += len(data)
+
+    def commit(self, expected_digest=None):
+        digest = self.finish(expected_digest)
+        self.publish()
+        file_index.refresh(self.name)
+        return digest
+
+    def finish(self, expected_digest=None):
+        # Everything but the rename into place; the temp file stays until publish()
+        if self.blocks:
+            try:
+                self.blocks.flush()
+                self.blocks.disk.wait_sync()
+                submit_io(sync_and_drop, self.fd)()
+            except OSError:
+                self.discard()
+                raise
+            self.blocks = None  # A batch keeps finished files until publish(); their buffers can go now
+        digest = self.digest.hexdigest()
+        if expected_digest and expected_digest != digest:
+            self.discard()
+            raise DigestMismatch(f'Digest mismatch for {self.name}: expected {expected_digest}, got {digest}')
+        if self.size is not None and self.offset != self.size:
+            os.ftruncate(self.fd, self.offset)
+        self.stat = os.fstat(self.fd)
+        os.close(self.fd)
+        self.fd = None
+        return digest
+
+    def publish(self):
+        metadata_store(self.folder).put(self.name, self.stat, f'{tree_label(self.digest.algorithm)}:{self.digest.hexdigest()}')
+        os.replace(self.temp_path, self.destination)
+        self.temp_path = None
+        ContentStore(self.folder).remove_manifest(self.name)
+
+    def discard(self):
+        if self.temp_path is None:
+            return
+        if self.blocks:
+            self.blocks.abandon()
+            self.blocks = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        os.remove(self.temp_path)
+        self.temp_path = None
+
+# Deduplicating storage
+# With dedup enabled, uploads are cut into content-defined chunks stored once
+# under .store/chunks by SHA-256, and each file becomes a manifest listing its
+# chunks. A boundary is a CDC_ANCHOR byte whose preceding CDC_WINDOW bytes have
+# a CRC-32 matching CDC_MASK, so cuts follow content rather than offsets and
+# an insertion only changes the chunks around it. Finding anchors is a memchr
+# call, which keeps chunking fast in pure Python.
+CDC_MIN_SIZE = 256 * 1024
+CDC_MAX_SIZE = 4 * 1024 * 1024
+CDC_WINDOW = 48
+CDC_ANCHOR = b'\x8f'
+CDC_MASK = 0xfff  # about 1MB past CDC_MIN_SIZE on random data
+MANIFEST_RECORD = struct.Struct('>32sQ')  # chunk SHA-256, chunk length
+STORE_GARBAGE_GRACE = 24 * 3600  # unreferenced chunks younger than this may belong to an upload in progress
+
+def dedup_enabled():
+    return config['Server'].getboolean('dedup')
+
+def cdc_cut(data, start, final=False):
+    # End offset of the chunk starting at start, or None if more data is needed
+    end = len(data)
+    limit = min(start + CDC_MAX_SIZE, end)
+    pos = data.find(CDC_ANCHOR, start + CDC_MIN_SIZE, limit)
+    while pos != -1:
+        if zlib.crc32(data[pos - CDC_WINDOW:pos]) & CDC_MASK == 0:
+            return pos
+        pos = data.find(CDC_ANCHOR, pos + 1, limit)
+    if start + CDC_MAX_SIZE <= end:
+        return start + CDC_MAX_SIZE
+    return end if final else None
+
+def valid_chunk_id(chunk_id):
+    return len(chunk_id) == 64 and all(c in '0123456789abcdef' for c in chunk_id)
+
+class ContentStore:
+    """Chunk store and file manifests kept under the upload folder's .store directory"""
+
+    def __init__(self, folder):
+        self.root = os.path.join(folder, '.store')
+        self.chunks = os.path.join(self.root, 'chunks')
+        self.manifests = os.path.join(self.root, 'manifests')
+
+    def chunk_path(self, chunk_id):
+        return os.path.join(self.chunks, chunk_id[:2], chunk_id)
+
+    def missing(self, chunk_ids):
+        return [chunk_id for chunk_id in chunk_ids if not os.path.exists(self.chunk_path(chunk_id))]
+
+    def put_chunk(self, chunk_id, data):
+        path = self.chunk_path(chunk_id)
+        if os.path.exists(path):
+            return False  # Already stored, which is the whole point
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return True
+
+    def receive_chunk(self, chunk_id, stream, length):
+        data = bytearray(length)
+        view = memoryview(data)
+        received = 0
+        while received < length:
+            read = read_into(stream, view[received:])
+            if not read:
+                raise IOError(f'Chunk truncated, {length - received} bytes missing')
+            received += read
+        if hashlib.sha256(data).hexdigest() != chunk_id:
+            raise DigestMismatch(f'Chunk {chunk_id} digest mismatch')
+        return self.put_chunk(chunk_id, data)
+
+    def manifest_path(self, name):
+        return os.path.join(self.manifests, name + '.manifest')
+
+    def write_manifest(self, name, chunks, size, digest=None):
+        # One JSON header line, then a fixed-size record per chunk
+        os.makedirs(self.manifests, exist_ok=True)
+        path = self.manifest_path(name)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        header = {'name': name, 'size': size, 'mtime': time.time(), 'digest': digest, 'chunks': len(chunks)}
+        with open(temp_path, 'wb') as f:
+            f.write(json.dumps(header).encode() + b'\n')
+            for chunk_id, length in chunks:
+                f.write(MANIFEST_RECORD.pack(bytes.fromhex(chunk_id), length))
+        os.replace(temp_path, path)
+        try:
+            os.remove(os.path.join(os.path.dirname(self.root), name))  # The manifest replaces any plain copy
+        except OSError:
+            pass
+        return header
+
+    def read_header(self, name):
+        try:
+            with open(self.manifest_path(name), 'rb') as f:
+                return json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+
+    def load_manifest(self, name):
+        try:
+            with open(self.manifest_path(name), 'rb') as f:
+                header = json.loads(f.readline())
+                records = f.read()
+        except (OSError, ValueError):
+            return None
+        header['chunks'] = [(chunk_id.hex(), length) for chunk_id, length in MANIFEST_RECORD.iter_unpack(records)]
+        return header
+
+    def remove_manifest(self, name):
+        try:
+            os.remove(self.manifest_path(name))
+        except OSError:
+            pass
+
+    def manifest_names(self):
+        try:
+            return [name[:-9] for name in os.listdir(self.manifests) if name.endswith('.manifest')]
+        except OSError:
+            return []
+
+    def collect_garbage(self, grace=STORE_GARBAGE_GRACE):
+        # Mark every chunk a manifest references, then sweep old unreferenced ones
+        referenced = set()
+        for name in self.manifest_names():
+            manifest = self.load_manifest(name)
+            if manifest:
+                referenced.update(chunk_id for chunk_id, _ in manifest['chunks'])
+        cutoff = time.time() - grace
+        removed = 0
+        for directory, _, names in os.walk(self.chunks):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if name not in referenced and os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            print(f"Removed {removed} unreferenced chunks")
+
+def content_store():
+    return ContentStore(app.config['UPLOAD_FOLDER'])
+
+class ManifestFile:
+    """Read-only file object that reassembles a deduplicated file from its chunks"""
+
+    def __init__(self, store, manifest):
+        self.store = store
+        self.chunks = manifest['chunks']
+        self.starts = []
+        offset = 0
+        for _, length in self.chunks:
+            self.starts.append(offset)
+            offset += length
+        self.size = offset
+        self.position = 0
+        self.index = None
+        self.file = None
+
+    def fileno(self):
+        raise io.UnsupportedOperation('fileno')  # No single descriptor to sendfile from
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        # Reads stop at chunk boundaries; callers loop until b''
+        if self.position >= self.size or size == 0:
+            return b''
+        index = bisect.bisect_right(self.starts, self.position) - 1
+        if index != self.index:
+            self.close()
+            self.file = open(self.store.chunk_path(self.chunks[index][0]), 'rb')
+            self.index = index
+        skip = self.position - self.starts[index]
+        available = self.chunks[index][1] - skip
+        self.file.seek(skip)
+        data = self.file.read(available if size < 0 else min(size, available))
+        if not data:
+            raise IOError(f'Chunk {self.chunks[index][0]} is missing data')
+        self.position += len(data)
+        return data
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.index = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class DedupIncoming:
+    """Streams one upload into the chunk store, with the same interface as IncomingFile"""
+
+    def __init__(self, filename, size=None):
+        self.store = content_store()
+        self.destination = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        self.size = size
+        self.offset = 0
+        self.digest = StreamDigest(digest_algorithm())
+        self.buffer = bytearray()
+        self.chunks = []
+
+    def store_chunks(self, final=False):
+        pos = 0
+        while pos < len(self.buffer):
+            cut = cdc_cut(self.buffer, pos, final)
+            if cut is None:
+                break
+            chunk = self.buffer[pos:cut]
+            chunk_id = hashlib.sha256(chunk).hexdigest()
+            self.store.put_chunk(chunk_id, chunk)
+            self.chunks.append((chunk_id, len(chunk)))
+            pos = cut
+        del self.buffer[:pos]
+
+    def write(self, data):
+        self.buffer += data
+        self.digest.update(data)
+        self.offset += len(data)
+        if len(self.buffer) >= 2 * CDC_MAX_SIZE:
+            self.store_chunks()
+
+    def commit(self, expected_digest=None):
+        digest = self.digest.hexdigest()
+        name = os.path.basename(self.destination)
+        if expected_digest and expected_digest != digest:
+            self.discard()
+            raise DigestMismatch(f'Digest mismatch for {name}: expected {expected_digest}, got {digest}')
+        self.store_chunks(final=True)
+        self.store.write_manifest(name, self.chunks, self.offset, f'{tree_label(self.digest.algorithm)}:{digest}')
+        file_index.refresh(name)
+        return digest
+
+    def discard(self):
+        # Chunks already stored are left for collect_garbage()
+        self.buffer = bytearray()
+
+def open_incoming(filename, size=None):
+    return DedupIncoming(filename, size) if dedup_enabled() else IncomingFile(filename, size)
+
+def receive_stream(stream, incoming):
+    if getattr(incoming, 'blocks', None):
+        return incoming.receive(stream)
+    view = copy_buffer()
+    while True:
+        read = read_into(stream, view)
+        if not read:
+            break
+        incoming.write(view[:read])
+    return incoming.offset
+
+def receive_multipart(stream, boundary, expected_digest=None):
+    # Parses multipart/form-data as it arrives, so file parts go straight to
+    # their final folder instead of being spooled by Werkzeug first. A `digest`
+    # field applies to the file part that follows it.
+    # Returns the saved file names and whether an empty file part was seen.
+    decoder = MultipartDecoder(boundary)
+    view = copy_buffer()
+    saved = []
+    empty_part = False
+    incoming = None
+    field = None
+    algorithm = digest_algorithm()
+    try:
+        while True:
+            read = read_into(stream, view)
+            decoder.receive_data(view[:read] if read else None)
+            event = decoder.next_event()
+            while not isinstance(event, (NeedData, Epilogue)):
+                if isinstance(event, File) and event.name == 'file':
+                    filename = secure_filename(event.filename or '')
+                    if filename:
+                        incoming = open_incoming(filename)
+                    else:
+                        empty_part = True
+                elif isinstance(event, Field) and event.name == 'digest':
+                    field = bytearray()
+                elif isinstance(event, Data) and field is not None:
+                    field += event.data
+                    if not event.more_data:
+                        expected_digest = parse_client_digest(field.decode(), tree_label(algorithm))
+                        field = None
+                elif isinstance(event, Data) and incoming is not None:
+                    incoming.write(event.data)
+                    if not event.more_data:
+                        current, incoming = incoming, None
+                        current.commit(expected_digest)
+                        saved.append((os.path.basename(current.destination), current.offset))
+                        expected_digest = None
+                event = decoder.next_event()
+            if isinstance(event, Epilogue) or not read:
+                break
+    except BaseException:
+        if incoming is not None:
+            incoming.discard()
+        raise
+    return saved, empty_part
+
+# Upload admission
+# Concurrent writers turn a burst of uploads into random I/O on one disk, so at
+# most max_disk_writers request bodies are received at a time, across prefork
+# workers too. Later uploads wait in line and hear their position over
+# Socket.IO; once the line is full they get a quick 503 instead. The body is
+# only read after admission, so rejected clients don't send it for nothing.
+ADMISSION_POLL = 0.05  # seconds between checks for a free writer
+ADMISSION_TIMEOUT = 300  # seconds an upload may wait in line
+ADMISSION_RETRY_AFTER = 5
+FREE_SPACE_RESERVE = 64 * 1024 * 1024  # never fill the disk to the last byte
+FREE_SPACE_CHECK = 64 * 1024 * 1024  # decoded bytes between free space checks of compressed bodies
+QUEUE_SLOTS = 256  # most uploads that can wait in line, whatever upload_queue_size says
+
+class AdmissionError(Exception):
+    def __init__(self, message, status, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    def response(self):
+        headers = {'Retry-After': str(self.retry_after)} if self.retry_after else {}
+        return jsonify({'error': str(self)}), self.status, headers
+
+@app.errorhandler(AdmissionError)
+def admission_error(e):
+    # Raised mid-body when a compressed upload runs the disk low; the route has cleaned up
+    return e.response()
+
+def check_free_space(size):
+    # Compressed bodies have no size up front (None); DecodedBody checks as they decode
+    size = size or 0
+    if size > app.config['MAX_CONTENT_LENGTH']:
+        raise AdmissionError('File exceeds maximum upload size', 413)
+    # Sparse preallocations (no fallocate) still have to come out of what statvfs calls free
+    free = max(0, shutil.disk_usage(UPLOAD_FOLDER).free - unallocated_partial_space(UPLOAD_FOLDER))
+    if size + FREE_SPACE_RESERVE > free:
+        raise AdmissionError(f'Not enough free space: {convert_size(size)} needed, {convert_size(free)} free', 507)
+
+class UploadScheduler:
+    """Caps the uploads writing to disk at once and queues the rest in arrival order"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.row = 0
+        self.writers = [0]  # per worker
+        # The line, shared by every worker: [0] is the last ticket handed out,
+        # each other slot holds a waiting upload's ticket (0 when free) and its
+        # owner the worker it waits in, so a respawned worker can clear its own
+        self.queue = [0] * (QUEUE_SLOTS + 1)
+        self.owners = [0] * (QUEUE_SLOTS + 1)
+
+    def share_between(self, workers):
+        # Called before forking; every worker then works on the same arrays
+        self.writers = RawArray('i', workers)
+        self.queue = RawArray('q', QUEUE_SLOTS + 1)
+        self.owners = RawArray('i', QUEUE_SLOTS + 1)
+        self.lock = multiprocessing.Lock()
+
+    def use_row(self, row):
+        self.row = row
+        with self.lock:
+            self.writers[row] = 0  # A respawned worker starts clean
+            for slot in range(1, QUEUE_SLOTS + 1):
+                if self.owners[slot] == row:
+                    self.queue[slot] = 0
+
+    def tickets(self):
+        return sorted(ticket for ticket in self.queue[1:] if ticket)
+
+    def totals(self):
+        return sum(self.writers), len(self.tickets())
+
+    def admit(self, size, name=None):
+        """Waits for a writer slot, raising AdmissionError when the upload can't be taken"""
+        check_free_space(size)
+        server = config['Server']
+        with self.lock:
+            tickets = self.tickets()
+            if not tickets and sum(self.writers) < server.getint('max_disk_writers'):
+                self.writers[self.row] += 1
+                return
+            if len(tickets) >= min(server.getint('upload_queue_size'), QUEUE_SLOTS):
+                raise AdmissionError('Upload queue is full', 503, ADMISSION_RETRY_AFTER)
+            self.queue[0] += 1
+            ticket = self.queue[0]
+            slot = self.queue[1:].index(0) + 1
+            self.queue[slot] = ticket
+            self.owners[slot] = self.row
+
+        sid = request.headers.get('X-Socket-Id')
+        deadline = time.monotonic() + ADMISSION_TIMEOUT
+        reported = None
+        try:
+            while True:
+                with self.lock:
+                    tickets = self.tickets()
+                    waiting = len(tickets)
+                    position = tickets.index(ticket) + 1
+                    if position == 1 and sum(self.writers) < server.getint('max_disk_writers'):
+                        self.queue[slot] = 0
+                        self.writers[self.row] += 1
+                        break
+                if sid and (position, waiting) != reported:
+                    reported = (position, waiting)
+                    metrics.inc('localhttps_socketio_emits_total', (('event', 'upload_queue'),))
+                    socketio.emit('upload_queue', {'name': name, 'position': position, 'waiting': waiting}, to=sid)
+                if time.monotonic() > deadline:
+                    raise AdmissionError('Timed out waiting for the disk', 503, ADMISSION_RETRY_AFTER)
+                time.sleep(ADMISSION_POLL)
+        except BaseException:
+            with self.lock:
+                if self.queue[slot] == ticket:
+                    self.queue[slot] = 0
+            raise
+        if sid:
+            metrics.inc('localhttps_socketio_emits_total', (('event', 'upload_queue'),))
+            socketio.emit('upload_queue', {'name': name, 'position': 0, 'waiting': waiting - 1}, to=sid)
+        try:
+            check_free_space(size)  # Other uploads may have used it up in the meantime
+        except AdmissionError:
+            self.release()
+            raise
+
+    def release(self):
+        with self.lock:
+            self.writers[self.row] -= 1
+
+upload_scheduler = UploadScheduler()
+
+@app.route('/upload', methods=['POST'])
+def upload_file():
+    boundary = request.mimetype_params.get('boundary')
+    if request.mimetype != 'multipart/form-data' or not boundary:
+        return jsonify({'error': 'No file part'}), 400
+
+    try:
+        body, length = request_body()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 415
+    try:
+        upload_scheduler.admit(length)
+    except AdmissionError as e:
+        return e.response()
+    started = time.monotonic()
+    try:
+        expected_digest = parse_client_digest(request.headers.get('X-File-Digest'), tree_label(digest_algorithm()))
+        saved, empty_part = receive_multipart(body, boundary.encode(), expected_digest)
+    except DigestMismatch as e:
+        return jsonify({'error': str(e)}), 422
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        upload_scheduler.release()
+    if not saved:
+        return jsonify({'error': 'No selected file' if empty_part else 'No file part'}), 400
+
+    for name, size in saved:
+        note_transfer('upload', name, size)
+    stats = format_throughput(sum(size for _, size in saved), time.monotonic() - started)
+    print(f"Received {', '.join(name for name, _ in saved)} at {stats['throughput_readable']}")
+    return jsonify({'message': 'File uploaded successfully', **stats})
+
+@app.route('/upload/raw/<filename>', methods=['PUT', 'POST'])
+def upload_raw(filename):
+    # Request body is the file itself, e.g. `curl -T big.iso https://host/upload/raw/big.iso`
+    filename = secure_filename(filename)
+    if not filename:
+        return jsonify({'error': 'No selected file'}), 400
+
+    try:
+        expected_digest = parse_client_digest(request.headers.get('X-File-Digest'), tree_label(digest_algorithm()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        body, length = request_body()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 415
+    try:
+        upload_scheduler.admit(length, filename)
+    except AdmissionError as e:
+        return e.response()
+
+    try:
+        started = time.monotonic()
+        try:
+            incoming = open_incoming(filename, length)
+        except OSError as e:
+            return jsonify({'error': str(e)}), 500
+        try:
+            size = receive_stream(body, incoming)
+            if length is not None and size != length:
+                raise IOError(f'Body truncated, {length - size} bytes missing')
+            digest = incoming.commit(expected_digest)
+        except DigestMismatch as e:
+            return jsonify({'error': str(e)}), 422
+        except (IOError, OSError) as e:
+            incoming.discard()
+            return jsonify({'error': str(e)}), 500
+        except BaseException:
+            incoming.discard()
+            raise
+    finally:
+        upload_scheduler.release()
+
+    note_transfer('upload', filename, size)
+    stats = format_throughput(size, time.monotonic() - started)
+    print(f"Received {filename} at {stats['throughput_readable']}")
+    return jsonify({'message': 'File uploaded successfully',
+                    'digest': f'{tree_label(incoming.digest.algorithm)}:{digest}', **stats})
+
+# Batch uploads
+# Thousands of small files cost a request, a multipart parse and a round of TLS
+# records each. /upload/batch takes them as one tar stream instead and unpacks
+# it into .partial; nothing appears in the upload folder until the whole
+# stream arrived, and then every file is renamed into place in one go.
+def batch_member_name(name):
+    # secure_filename() per path component: subfolders survive, '..' and dot names don't
+    parts = (secure_filename(part) for part in name.replace('\\', '/').split('/'))
+    return '/'.join(part for part in parts if part)
+
+class BatchUpload:
+    """Stages the files of one tar stream and publishes them together"""
+
+    def __init__(self):
+        self.staged = {}  # name -> finished IncomingFile, a later member replaces an earlier one
+
+    def receive(self, stream):
+        with tarfile.open(fileobj=stream, mode='r|', bufsize=COPY_BUFFER_SIZE) as archive:
+            for member in archive:
+                if not member.isfile():
+                    continue  # Folders come with their files; links and devices aren't accepted
+                name = batch_member_name(member.name)
+                if not name:
+                    continue
+                incoming = IncomingFile(name, member.size)
+                previous = self.staged.pop(name, None)
+                if previous:
+                    previous.discard()
+                self.staged[name] = incoming
+                source = archive.extractfile(member)
+                while True:
+                    data = source.read(COPY_BUFFER_SIZE)
+                    if not data:
+                        break
+                    incoming.write(data)
+                if incoming.offset != member.size:
+                    raise IOError(f'{name} truncated, {member.size - incoming.offset} bytes missing')
+                incoming.finish()
+        return sum(incoming.offset for incoming in self.staged.values())
+
+    def publish(self):
+        for incoming in self.staged.values():
+            os.makedirs(os.path.dirname(incoming.destination), exist_ok=True)
+            incoming.publish()
+        file_index.refresh_many(self.staged)
+
+    def discard(self):
+        # Files already published stay; discard() skips them
+        for incoming in self.staged.values():
+            incoming.discard()
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Unpack a tar stream of files into the upload folder as one batch"""
+    try:
+        body, length = request_body()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 415
+    try:
+        upload_scheduler.admit(length, request.args.get('name'))
+    except AdmissionError as e:
+        return e.response()
+
+    started = time.monotonic()
+    batch = BatchUpload()
+    try:
+        try:
+            size = batch.receive(body)
+            batch.publish()
+        except tarfile.TarError as e:
+            batch.discard()
+            return jsonify({'error': f'Not a valid tar stream: {e}'}), 400
+        except (IOError, OSError) as e:
+            batch.discard()
+            return jsonify({'error': str(e)}), 500
+        except BaseException:
+            batch.discard()
+            raise
+    finally:
+        upload_scheduler.release()
+    if not batch.staged:
+        return jsonify({'error': 'No files in archive'}), 400
+
+    elapsed = time.monotonic() - started
+    for name, incoming in batch.staged.items():
+        # Each file gets its share of the batch's time, so its throughput is the batch's
+        note_transfer('upload', name, incoming.offset, elapsed * incoming.offset / size if size else elapsed)
+    stats = format_throughput(size, elapsed)
+    print(f"Received {len(batch.staged)} files in one batch at {stats['throughput_readable']}")
+    return jsonify({'message': 'Files uploaded successfully', 'files': list(batch.staged), **stats})
+
+# Chunked, resumable uploads
+class ChunkedUpload:
+    def __init__(self, upload_id, name, size, chunk_size, algorithm):
+        self.upload_id = upload_id
+        self.name = name
+        self.size = size
+        self.chunk_size = chunk_size
+        self.algorithm = algorithm
+        self.digest_size = new_hasher(algorithm).digest_size
+        self.total_chunks = (size + chunk_size - 1) // chunk_size
+        self.received = set()
+        self.lock = threading.Lock()
+        self.folder = app.config['UPLOAD_FOLDER']
+        base = os.path.join(partial_folder(self.folder), upload_id)
+        self.data_path = base + '.part'
+        self.map_path = base + '.map'
+        self.meta_path = base + '.json'
+        self.claim_path = base + '.finalizing'
+        self.digests_path = base + '.digests'
+        self.data_fd = None
+        self.map_fd = None
+        self.digests_fd = None
+        self.disk = None
+        self.writers = 0
+        self.idle = threading.Condition(self.lock)
+        self.closed = False
+
+    def create(self):
+        os.makedirs(partial_folder(self.folder), exist_ok=True)
+        with open(self.meta_path, 'w') as f:
+            json.dump({'name': self.name, 'size': self.size, 'chunk_size': self.chunk_size,
+                       'digest_algorithm': self.algorithm}, f)
+        self.data_fd = os.open(self.data_path, OPEN_FLAGS, 0o600)
+        preallocate(self.data_fd, self.size)
+        self.disk = DiskWriter(self.data_fd)
+        # One byte per chunk, flipped to 1 once the chunk is fully on disk
+        self.map_fd = os.open(self.map_path, OPEN_FLAGS, 0o600)
+        os.ftruncate(self.map_fd, self.total_chunks)
+        # Fixed-size slot per chunk for the digest computed while it streamed in
+        self.digests_fd = os.open(self.digests_path, OPEN_FLAGS, 0o600)
+        os.ftruncate(self.digests_fd, self.total_chunks * self.digest_size)
+
+    @classmethod
+    def load(cls, upload_id):
+        base = os.path.join(partial_folder(), upload_id)
+        with open(base + '.json') as f:
+            meta = json.load(f)
+        upload = cls(upload_id, meta['name'], meta['size'], meta['chunk_size'],
+                     meta.get('digest_algorithm', 'sha256'))
+        upload.data_fd = os.open(upload.data_path, OPEN_FLAGS, 0o600)
+        upload.disk = DiskWriter(upload.data_fd)
+        upload.map_fd = os.open(upload.map_path, OPEN_FLAGS, 0o600)
+        upload.digests_fd = os.open(upload.digests_path, OPEN_FLAGS, 0o600)
+        upload.read_received()
+        return upload
+
+    def read_received(self):
+        # The map is the shared record: prefork workers each write some of the chunks
+        with open(self.map_path, 'rb') as f:
+            chunk_map = f.read()
+        with self.lock:
+            self.received = {i for i, flag in enumerate(chunk_map) if flag}
+            return set(self.received)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def write_chunk(self, index, stream, expected_digest=None):
+        # Chunks may arrive in any order and in parallel; positional writes never
+        # overlap, so writers only need to keep the descriptors open until done
+        with self.lock:
+            if self.closed:
+                raise IOError('Upload is no longer active')
+            self.writers += 1
+        blocks = None
+        try:
+            length = self.chunk_length(index)
+            offset = index * self.chunk_size
+            remaining = length
+            view = copy_buffer()
+            hasher = new_hasher(self.algorithm)
+            if write_behind_enabled(self.size):
+                blocks = BlockWriter(self.disk, offset)
+            while remaining:
+                if blocks:
+                    data = blocks.fill(stream, remaining)
+                else:
+                    data = view[:read_into(stream, view[:remaining])]
+                    write_at(self.data_fd, data, offset, self.lock)
+                if not data:
+                    raise IOError(f'Chunk {index} truncated, {remaining} bytes missing')
+                hasher.update(data)
+                offset += len(data)
+                remaining -= len(data)
+            if blocks:
+                blocks.flush()
+            if expected_digest and expected_digest != hasher.hexdigest():
+                # Leave it unmarked so the client resends it
+                raise DigestMismatch(f'Chunk {index} digest mismatch')
+            # On disk before the chunk map says so, or a crash could leave a marked hole
+            submit_io(getattr(os, 'fdatasync', os.fsync), self.data_fd)()
+            write_at(self.digests_fd, hasher.digest(), index * self.digest_size, self.lock)
+            write_at(self.map_fd, b'\x01', index, self.lock)
+        finally:
+            if blocks:
+                blocks.abandon()
+            with self.lock:
+                self.writers -= 1
+                self.idle.notify_all()
+        with self.lock:
+            self.received.add(index)
+
+    def missing(self):
+        received = self.read_received()
+        return [i for i in range(self.total_chunks) if i not in received]
+
+    def status(self):
+        received = self.read_received()
+        return {
+            'upload_id': self.upload_id,
+            'name': self.name,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': self.total_chunks,
+            'digest_algorithm': self.algorithm,
+            'received': sorted(received)
+        }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            while self.writers:
+                self.idle.wait()
+            if self.disk:
+                try:
+                    self.disk.wait_sync()  # A sync started by the last chunk may still be running
+                except OSError:
+                    pass  # finalize() syncs again and reports it
+            for fd in (self.data_fd, self.map_fd, self.digests_fd):
+                if fd is not None:
+                    os.close(fd)
+            self.data_fd = self.map_fd = self.digests_fd = None
+
+    def file_digest(self):
+        with open(self.digests_path, 'rb') as f:
+            digests = f.read()
+        size = self.digest_size
+        return combine_digests(self.algorithm, [digests[i:i + size] for i in range(0, len(digests), size)])
+
+    def finalize(self, expected_digest=None):
+        self.close()
+        digest = self.file_digest()
+        if expected_digest and expected_digest != digest:
+            raise DigestMismatch(f'Digest mismatch for {self.name}: expected {expected_digest}, got {digest}')
+        name = secure_filename(self.name)
+        with open(self.data_path, 'rb+') as f:
+            submit_io(sync_and_drop, f.fileno())()
+            metadata_store(self.folder).put(name, os.fstat(f.fileno()), f'{tree_label(self.algorithm)}:{digest}')
+        destination = os.path.join(self.folder, name)
+        os.replace(self.data_path, destination)
+        ContentStore(self.folder).remove_manifest(name)
+        file_index.refresh(name)
+        for path in (self.map_path, self.claim_path, self.digests_path):
+            os.remove(path)
+        return digest
+
+    def claim(self):
+        # Renaming the metadata away is atomic, so only one process gets to finalize
+        try:
+            os.rename(self.meta_path, self.claim_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def unclaim(self):
+        # Finalizing failed; the upload can be resumed or finalized again
+        try:
+            os.rename(self.claim_path, self.meta_path)
+        except OSError:
+            pass
+
+    def abort(self):
+        self.close()
+        for path in (self.data_path, self.map_path, self.meta_path, self.claim_path, self.digests_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+chunked_uploads = {}
+chunked_uploads_lock = threading.Lock()
+client_streams = {}
+client_streams_lock = threading.Lock()
+
+def acquire_client_stream(client):
+    with client_streams_lock:
+        if client_streams.get(client, 0) >= int(config['Server']['max_streams_per_client']):
+            return False
+        client_streams[client] = client_streams.get(client, 0) + 1
+        return True
+
+def release_client_stream(client):
+    with client_streams_lock:
+        client_streams[client] -= 1
+        if not client_streams[client]:
+            del client_streams[client]
+
+SERVER_STARTED = time.time()  # temp files older than this belong to a previous run
+PARTIAL_SWEEP_INTERVAL = 3600
+
+def sweep_partial_uploads(folder):
+    """Deletes resumable uploads nobody has added to in partial_upload_hours, and dead temp files"""
+    hours = config['Server'].getint('partial_upload_hours')
+    cutoff = time.time() - hours * 3600
+    uploads = {}  # upload id -> newest modification time of its files
+    try:
+        with os.scandir(partial_folder(folder)) as it:
+            entries = list(it)
+    except OSError:
+        return
+    for entry in entries:
+        upload_id, _, suffix = entry.name.partition('.')
+        try:
+            mtime = entry.stat().st_mtime
+        except OSError:
+            continue
+        if suffix == 'upload':
+            # IncomingFile temps only outlive their request when a run crashed
+            if mtime < SERVER_STARTED:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        elif len(upload_id) == 32:
+            uploads[upload_id] = max(mtime, uploads.get(upload_id, 0))
+    if not hours:
+        return
+    expired = [upload_id for upload_id, mtime in uploads.items() if mtime < cutoff]
+    for upload_id in expired:
+        with chunked_uploads_lock:
+            upload = chunked_uploads.pop(upload_id, None)
+        if upload is not None:
+            upload.close()
+        for entry in entries:
+            if entry.name.partition('.')[0] == upload_id:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+    if expired:
+        print(f"Removed {len(expired)} abandoned uploads from {partial_folder(folder)}")
+
+def run_partial_sweeper():
+    while True:
+        sweep_partial_uploads(UPLOAD_FOLDER)
+        time.sleep(PARTIAL_SWEEP_INTERVAL)
+
+def get_chunked_upload(upload_id):
+    # Upload IDs are uuid4 hex strings; anything else could escape the partial folder
+    if len(upload_id) != 32 or any(c not in '0123456789abcdef' for c in upload_id):
+        return None
+    with chunked_uploads_lock:
+        upload = chunked_uploads.get(upload_id)
+        if upload is not None and not os.path.exists(upload.meta_path):
+            # Finalized or cancelled through another prefork worker
+            chunked_uploads.pop(upload_id)
+            upload.close()
+            upload = None
+        if upload is None and os.path.exists(os.path.join(partial_folder(), upload_id + '.json')):
+            # Resume an upload that was started before a server restart
+            upload = ChunkedUpload.load(upload_id)
+            chunked_uploads[upload_id] = upload
+        return upload
+
+@app.route('/upload/init', methods=['POST'])
+def init_chunked_upload():
+    data = request.get_json(silent=True) or {}
+    name = secure_filename(str(data.get('name', '')))
+    try:
+        size = int(data.get('size', -1))
+    except (TypeError, ValueError):
+        size = -1
+    if not name:
+        return jsonify({'error': 'No selected file'}), 400
+    if size < 0:
+        return jsonify({'error': 'Invalid file size'}), 400
+    try:
+        check_free_space(size)
+    except AdmissionError as e:
+        return e.response()
+
+    upload = ChunkedUpload(uuid.uuid4().hex, name, size, CHUNK_SIZE, digest_algorithm())
+    try:
+        upload.create()
+    except OSError as e:
+        upload.abort()
+        return jsonify({'error': str(e)}), 500
+    with chunked_uploads_lock:
+        chunked_uploads[upload.upload_id] = upload
+    return jsonify(upload.status())
+
+@app.route('/upload/<upload_id>', methods=['GET', 'DELETE'])
+def chunked_upload_status(upload_id):
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    if request.method == 'DELETE':
+        with chunked_uploads_lock:
+            chunked_uploads.pop(upload_id, None)
+        upload.abort()
+        return jsonify({'message': 'Upload cancelled'})
+    return jsonify(upload.status())
+
+@app.route('/upload/<upload_id>/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    if index >= upload.total_chunks:
+        return jsonify({'error': 'Chunk index out of range'}), 400
+    try:
+        body, length = request_body(upload.chunk_length(index) + 1)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 415
+    if length is None:
+        # Compressed chunks are small enough to decode up front and measure
+        try:
+            data = body_bytes(body)
+        except IOError as e:
+            return jsonify({'error': str(e)}), 400
+        body, length = io.BytesIO(data), len(data)
+    if length != upload.chunk_length(index):
+        return jsonify({'error': f'Chunk {index} must be {upload.chunk_length(index)} bytes'}), 400
+
+    try:
+        expected_digest = parse_client_digest(request.headers.get('X-Chunk-Digest'), upload.algorithm)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    # Cap parallel streams per client so one browser can't take over the server
+    client = request.remote_addr
+    if not acquire_client_stream(client):
+        return jsonify({'error': 'Too many parallel uploads'}), 429, {'Retry-After': '1'}
+    try:
+        # Space for the whole file was allocated when the upload started
+        upload_scheduler.admit(0, upload.name)
+    except AdmissionError as e:
+        release_client_stream(client)
+        return e.response()
+    try:
+        upload.write_chunk(index, body, expected_digest)
+    except DigestMismatch as e:
+        return jsonify({'error': str(e)}), 422
+    except (IOError, OSError) as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        upload_scheduler.release()
+        release_client_stream(client)
+    return jsonify({'index': index, 'received': len(upload.received)})
+
+@app.route('/upload/<upload_id>/finalize', methods=['POST'])
+def finalize_chunked_upload(upload_id):
+    upload = get_chunked_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Unknown upload'}), 404
+    missing = upload.missing()
+    if missing:
+        return jsonify({'error': 'Upload incomplete', 'missing': missing}), 409
+    body = request.get_json(silent=True) or {}
+    try:
+        expected_digest = parse_client_digest(body.get('digest'), tree_label(upload.algorithm))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    with chunked_uploads_lock:
+        if chunked_uploads.pop(upload_id, None) is None:
+            return jsonify({'error': 'Upload already finalized'}), 409
+    try:
+        begun = os.path.getmtime(upload.meta_path)  # Chunks arrive over many requests
+    except OSError:
+        begun = None
+    if begun is None or not upload.claim():
+        upload.close()
+        return jsonify({'error': 'Upload already finalized'}), 409
+    try:
+        digest = upload.finalize(expected_digest)
+    except DigestMismatch as e:
+        upload.unclaim()
+        return jsonify({'error': str(e)}), 422
+    except OSError as e:
+        upload.unclaim()
+        return jsonify({'error': str(e)}), 500
+    note_transfer('upload', upload.name, upload.size, time.time() - begun)
+    return jsonify({'message': 'File uploaded successfully', 'digest': f'{tree_label(upload.algorithm)}:{digest}'})
+
+# Deduplicated uploads: the client chunks and hashes the file, asks which
+# chunks the store lacks, sends only those, then commits the manifest
+@app.route('/store/missing', methods=['POST'])
+def store_missing_chunks():
+    chunk_ids = (request.get_json(silent=True) or {}).get('chunks')
+    if not isinstance(chunk_ids, list) or not all(isinstance(c, str) and valid_chunk_id(c) for c in chunk_ids):
+        return jsonify({'error': 'chunks must be a list of SHA-256 hex digests'}), 400
+    return jsonify({'missing': content_store().missing(chunk_ids)})
+
+@app.route('/store/chunks/<chunk_id>', methods=['PUT'])
+def store_chunk(chunk_id):
+    if not valid_chunk_id(chunk_id):
+        return jsonify({'error': 'Invalid chunk id'}), 400
+    length = request.content_length
+    if length is None or length > CDC_MAX_SIZE:
+        return jsonify({'error': f'Chunks must have a Content-Length of at most {CDC_MAX_SIZE} bytes'}), 400
+
+    client = request.remote_addr
+    if not acquire_client_stream(client):
+        return jsonify({'error': 'Too many parallel uploads'}), 429, {'Retry-After': '1'}
+    try:
+        upload_scheduler.admit(length)
+    except AdmissionError as e:
+        release_client_stream(client)
+        return e.response()
+    try:
+        stored = content_store().receive_chunk(chunk_id, request.stream, length)
+    except DigestMismatch as e:
+        return jsonify({'error': str(e)}), 422
+    except (IOError, OSError) as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        upload_scheduler.release()
+        release_client_stream(client)
+    return jsonify({'chunk': chunk_id, 'stored': stored})
+
+@app.route('/store/files', methods=['POST'])
+def store_file():
+    data = request.get_json(silent=True) or {}
+    name = secure_filename(data.get('name') or '')
+    chunks = data.get('chunks')
+    if not name:
+        return jsonify({'error': 'A file name is required'}), 400
+    try:
+        chunks = [(chunk_id, int(length)) for chunk_id, length in chunks]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'chunks must be a list of [id, length] pairs'}), 400
+    if not all(isinstance(chunk_id, str) and valid_chunk_id(chunk_id) and 0 < length <= CDC_MAX_SIZE
+               for chunk_id, length in chunks):
+        return jsonify({'error': 'chunks must be a list of [id, length] pairs'}), 400
+
+    store = content_store()
+    unique = dict(chunks)
+    missing = store.missing(unique)
+    if missing:
+        return jsonify({'error': 'Chunks missing from the store', 'missing': missing}), 409
+    try:
+        sizes = {chunk_id: os.path.getsize(store.chunk_path(chunk_id)) for chunk_id in unique}
+        if any(sizes[chunk_id] != length for chunk_id, length in chunks):
+            return jsonify({'error': 'Chunk lengths do not match the stored chunks'}), 400
+        header = store.write_manifest(name, chunks, sum(length for _, length in chunks))
+    except OSError as e:
+        return jsonify({'error': str(e)}), 500
+    file_index.refresh(name)
+    note_transfer('upload', name, header['size'])  # Only new chunks crossed the wire; seconds cover the commit
+    return jsonify({'message': 'File uploaded successfully', 'name': name, 'size': header['size'],
+                    'chunks': len(chunks), 'unique_chunks': len(unique)})
+
+# HTML template with enhanced multiple file upload support
+HTML_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Secure File Transfer</title>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
+    <style>
+        body {
             font-family: Arial, sans-serif;
             max-width: 900px;
             margin: 0 auto;
@@ -189,6 +2967,10 @@ HTML_TEMPLATE = '''
             position: relative;
             color: black;
         }
+        .upload-queue {
+            font-size: 0.85em;
+            color: #6c757d;
+        }
         .progress-outer {
             width: 100%;
             height: 20px;
@@ -206,12 +2988,72 @@ HTML_TEMPLATE = '''
         .file-list {
             margin-top: 20px;
         }
+        .file-controls {
+            display: flex;
+            gap: 10px;
+            align-items: center;
+            margin-bottom: 10px;
+        }
+        .file-controls input {
+            flex: 1;
+            padding: 8px;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+        }
+        .file-controls select {
+            padding: 8px;
+            border-radius: 4px;
+        }
+        .file-viewport {
+            position: relative;
+            height: 60vh;
+            overflow-y: auto;
+        }
         .file-item {
             display: flex;
             justify-content: space-between;
             align-items: center;
             padding: 10px;
             border-bottom: 1px solid #eee;
+            position: absolute;
+            left: 0;
+            right: 0;
+            top: 0;
+            height: 60px;
+            box-sizing: border-box;
+        }
+        .file-item strong {
+            white-space: nowrap;
+            overflow: hidden;
+            text-overflow: ellipsis;
+        }
+        .file-thumb {
+            width: 40px;
+            height: 40px;
+            object-fit: cover;
+            border-radius: 4px;
+            margin-right: 10px;
+            flex-shrink: 0;
+        }
+        .file-info {
+            flex: 1;
+            min-width: 0;
+        }
+        .file-actions {
+            display: flex;
+            gap: 6px;
+        }
+        .text-preview {
+            margin-top: 10px;
+            border: 1px solid #ddd;
+            border-radius: 4px;
+            padding: 10px;
+        }
+        .text-preview pre {
+            max-height: 40vh;
+            overflow: auto;
+            white-space: pre-wrap;
+            word-break: break-all;
         }
         .button {
             background-color: #4CAF50;
@@ -436,13 +3278,29 @@ HTML_TEMPLATE = '''
                             <label for="portInput">Port:</label>
                             <input type="number" id="portInput" placeholder="443">
                         </div>
-                    </div>
-                </div>
-                
-                <div id="certificatesTab" class="tab-content">
-                    <div class="setting-item">
-                        <h3>SSL Certificate</h3>
-                        <div class="certificate-upload">
+                        <div class="setting-item">
+                            <label for="uploadConcurrencyInput">Parallel File Uploads:</label>
+                            <input type="number" id="uploadConcurrencyInput" min="1" placeholder="3">
+                        </div>
+                        <div class="setting-item">
+                            <label for="chunkStreamsInput">Streams per File:</label>
+                            <input type="number" id="chunkStreamsInput" min="1" placeholder="4">
+                        </div>
+                        <div class="setting-item">
+                            <label for="bandwidthLimitInput">Bandwidth Limit (Mbit/s, 0 = none):</label>
+                            <input type="number" id="bandwidthLimitInput" min="0" placeholder="0">
+                        </div>
+                        <div class="setting-item">
+                            <label for="clientBandwidthInput">Per-Device Limit (Mbit/s, 0 = none):</label>
+                            <input type="number" id="clientBandwidthInput" min="0" placeholder="0">
+                        </div>
+                    </div>
+                </div>
+                
+                <div id="certificatesTab" class="tab-content">
+                    <div class="setting-item">
+                        <h3>SSL Certificate</h3>
+                        <div class="certificate-upload">
                             <p>Upload Certificate File (.pem)</p>
                             <input type="file" id="certFile" accept=".pem,.crt">
                         </div>
@@ -486,7 +3344,42 @@ HTML_TEMPLATE = '''
             <button class="button cancel-button" id="cancelButton">Cancel All</button>
         </div>
         
-        <div class="file-list" id="fileList"></div>
+        <div class="file-list" id="fileList">
+            <h2>Uploaded Files</h2>
+            <div class="file-controls">
+                <input type="search" id="fileSearch" placeholder="Search files...">
+                <select id="fileSort">
+                    <option value="name-asc">Name (A-Z)</option>
+                    <option value="name-desc">Name (Z-A)</option>
+                    <option value="mtime-desc">Newest first</option>
+                    <option value="mtime-asc">Oldest first</option>
+                    <option value="size-desc">Largest first</option>
+                    <option value="size-asc">Smallest first</option>
+                </select>
+                <small id="fileCount"></small>
+            </div>
+            <div class="file-controls">
+                <select id="archiveFolder">
+                    <option value="">All files</option>
+                </select>
+                <select id="archiveFormat">
+                    <option value="format=zip">.zip</option>
+                    <option value="format=zip&compression=deflate">.zip (compressed)</option>
+                    <option value="format=tar">.tar</option>
+                </select>
+                <button class="button" id="archiveButton">Download folder</button>
+            </div>
+            <div class="file-viewport" id="fileViewport">
+                <div id="fileSpacer"></div>
+            </div>
+            <div class="text-preview" id="textPreview" style="display: none;">
+                <div class="file-controls">
+                    <strong id="textPreviewName"></strong>
+                    <button class="button" id="textPreviewClose">Close</button>
+                </div>
+                <pre id="textPreviewBody"></pre>
+            </div>
+        </div>
     </div>
 
     <script>
@@ -541,6 +3434,7 @@ HTML_TEMPLATE = '''
                     itemDiv.className = 'upload-item';
                     itemDiv.innerHTML = `
                         <div>${file.name} (${formatSize(file.size)})</div>
+                        <div class="upload-queue" id="queue-${file.name}"></div>
                         <div class="progress-outer">
                             <div class="progress-inner" id="progress-${file.name}"></div>
                         </div>
@@ -583,51 +3477,463 @@ HTML_TEMPLATE = '''
             setTimeout(() => status.style.display = 'none', 3000);
         }
         
-        async function uploadFile(file) {
-            const formData = new FormData();
-            formData.append('file', file);
-            
+        const RETRY_DELAY = 2000; // ms between attempts after a network error
+        
+        function sleep(ms) {
+            return new Promise(resolve => setTimeout(resolve, ms));
+        }
+        
+        function resumeKey(file) {
+            return `upload:${file.name}:${file.size}:${file.lastModified}`;
+        }
+        
+        // Retries network failures until the upload is cancelled; HTTP errors are final
+        async function withRetry(state, action) {
+            while (true) {
+                if (state.cancelled) throw new Error('Upload cancelled');
+                try {
+                    return await action();
+                } catch (error) {
+                    if (state.cancelled || !error.retryable) throw error;
+                    await sleep(error.retryAfter || RETRY_DELAY);
+                }
+            }
+        }
+        
+        function request(state, method, url, body, onProgress, headers) {
             const xhr = new XMLHttpRequest();
-            const progressBar = document.getElementById(`progress-${file.name}`);
-            
             return new Promise((resolve, reject) => {
-                xhr.upload.addEventListener('progress', (e) => {
-                    if (e.lengthComputable) {
-                        const percent = (e.loaded / e.total) * 100;
-                        progressBar.style.width = percent + '%';
-                    }
-                });
+                if (onProgress) {
+                    xhr.upload.addEventListener('progress', (e) => onProgress(e.loaded));
+                }
                 
                 xhr.onload = () => {
+                    state.xhrs.delete(xhr);
+                    let data = {};
+                    try { data = JSON.parse(xhr.responseText); } catch (e) {}
                     if (xhr.status === 200) {
-                        resolve();
+                        resolve(data);
                     } else {
-                        reject(new Error(xhr.statusText));
+                        const error = new Error(data.error || xhr.statusText);
+                        error.status = xhr.status;
+                        // 429 means the server's per-client stream cap is full, 503 that its
+                        // upload queue is; 507 (disk full) won't get better by retrying
+                        error.retryable = (xhr.status >= 500 && xhr.status !== 507) || xhr.status === 429;
+                        if (xhr.status === 429 || xhr.status === 503) {
+                            error.retryAfter = (parseInt(xhr.getResponseHeader('Retry-After')) || 1) * 1000;
+                        }
+                        reject(error);
                     }
                 };
                 
-                xhr.onerror = () => reject(new Error('Network error'));
+                xhr.onerror = () => {
+                    state.xhrs.delete(xhr);
+                    const error = new Error('Network error');
+                    error.retryable = true;
+                    reject(error);
+                };
+                xhr.onabort = () => {
+                    state.xhrs.delete(xhr);
+                    reject(new Error('Upload cancelled'));
+                };
                 
-                xhr.open('POST', `${API_BASE}/upload`, true);
-                xhr.send(formData);
-                activeUploads.set(file.name, xhr);
+                xhr.open(method, url, true);
+                if (socket && socket.id) {
+                    xhr.setRequestHeader('X-Socket-Id', socket.id); // Queue positions are sent to this socket
+                }
+                Object.entries(headers || {}).forEach(([name, value]) => xhr.setRequestHeader(name, value));
+                if (body !== null && !(body instanceof Blob)) {
+                    xhr.setRequestHeader('Content-Type', 'application/json');
+                    body = JSON.stringify(body);
+                }
+                xhr.send(body);
+                state.xhrs.add(xhr);
+            });
+        }
+        
+        // SHA-256 runs in a Web Worker so digesting chunks never blocks the page.
+        // The file digest is the hash of the chunk digests, same as the server's.
+        // For deduplicated uploads the worker also cuts the file into the same
+        // content-defined chunks as the server's cdc_cut(), and it packs batches
+        // of small files into one tar body for /upload/batch.
+        const HASH_WORKER_SOURCE = `
+            const CDC_MIN_SIZE = 256 * 1024;
+            const CDC_MAX_SIZE = 4 * 1024 * 1024;
+            const CDC_WINDOW = 48;
+            const CDC_ANCHOR = 0x8f;
+            const CDC_MASK = 0xfff;
+            const READ_SIZE = 16 * 1024 * 1024;
+            
+            const CRC_TABLE = new Int32Array(256).map((_, n) => {
+                for (let k = 0; k < 8; k++) n = n & 1 ? 0xedb88320 ^ (n >>> 1) : n >>> 1;
+                return n;
+            });
+            function crc32(data, start, end) {
+                let crc = -1;
+                for (let i = start; i < end; i++) crc = CRC_TABLE[(crc ^ data[i]) & 0xff] ^ (crc >>> 8);
+                return (crc ^ -1) >>> 0;
+            }
+            function cdcCut(data, start, final) {
+                const limit = Math.min(start + CDC_MAX_SIZE, data.length);
+                let pos = data.indexOf(CDC_ANCHOR, start + CDC_MIN_SIZE);
+                while (pos !== -1 && pos < limit) {
+                    if ((crc32(data, pos - CDC_WINDOW, pos) & CDC_MASK) === 0) return pos;
+                    pos = data.indexOf(CDC_ANCHOR, pos + 1);
+                }
+                if (start + CDC_MAX_SIZE <= data.length) return start + CDC_MAX_SIZE;
+                return final ? data.length : -1;
+            }
+            const toHex = (buffer) => Array.from(new Uint8Array(buffer), b => b.toString(16).padStart(2, '0')).join('');
+            
+            async function chunkFile(file) {
+                const chunks = [];
+                let buffer = new Uint8Array(0);
+                let bufferStart = 0;
+                let pos = 0;
+                while (true) {
+                    const readOffset = bufferStart + buffer.length;
+                    const final = readOffset >= file.size;
+                    if (!final && buffer.length - pos < CDC_MAX_SIZE) {
+                        const slice = new Uint8Array(await file.slice(readOffset, readOffset + READ_SIZE).arrayBuffer());
+                        const next = new Uint8Array(buffer.length - pos + slice.length);
+                        next.set(buffer.subarray(pos));
+                        next.set(slice, buffer.length - pos);
+                        bufferStart += pos;
+                        buffer = next;
+                        pos = 0;
+                        continue;
+                    }
+                    if (pos >= buffer.length) return chunks;
+                    const cut = cdcCut(buffer, pos, final);
+                    const digest = await crypto.subtle.digest('SHA-256', buffer.subarray(pos, cut));
+                    chunks.push({id: toHex(digest), offset: bufferStart + pos, length: cut - pos});
+                    pos = cut;
+                }
+            }
+            
+            const encoder = new TextEncoder();
+            const NEWLINE = String.fromCharCode(10);
+            const tarPadding = (size) => new Uint8Array((512 - size % 512) % 512);
+            function tarHeader(name, size, mtime, type) {
+                // ustar header; fields are NUL-terminated because the array starts zeroed
+                const header = new Uint8Array(512);
+                const put = (text, offset, length) => header.set(encoder.encode(text).subarray(0, length), offset);
+                const octal = (value, digits) => value.toString(8).padStart(digits, '0');
+                put(name, 0, 100);
+                put('0000644', 100, 8);
+                put('0000000', 108, 8);
+                put('0000000', 116, 8);
+                put(octal(size, 11), 124, 12);
+                put(octal(Math.floor(mtime / 1000), 11), 136, 12);
+                put('        ', 148, 8);
+                put(type, 156, 1);
+                put('ustar', 257, 6);
+                put('00', 263, 2);
+                put(octal(header.reduce((total, byte) => total + byte, 0), 6), 148, 6);
+                header[155] = 32;
+                return header;
+            }
+            function packTar(entries) {
+                // Only headers are built here; the Blob refers to the files, so nothing is read yet
+                const parts = [];
+                for (const {name, file} of entries) {
+                    if (encoder.encode(name).length > 100) {
+                        // pax record for names that don't fit the ustar field
+                        const body = ' path=' + name + NEWLINE;
+                        const bodyLength = encoder.encode(body).length;
+                        let length = bodyLength; // The length counts its own digits
+                        while (length !== bodyLength + String(length).length) length = bodyLength + String(length).length;
+                        const record = encoder.encode(length + body);
+                        parts.push(tarHeader('PaxHeader', record.length, file.lastModified, 'x'), record, tarPadding(record.length));
+                    }
+                    parts.push(tarHeader(name, file.size, file.lastModified, '0'), file, tarPadding(file.size));
+                }
+                parts.push(new Uint8Array(1024));
+                return new Blob(parts, {type: 'application/x-tar'});
+            }
+            
+            self.onmessage = async (e) => {
+                const {id, blob, parts, file, tar} = e.data;
+                try {
+                    if (tar) {
+                        self.postMessage({id, result: packTar(tar)});
+                        return;
+                    }
+                    if (file) {
+                        self.postMessage({id, result: await chunkFile(file)});
+                        return;
+                    }
+                    let buffer;
+                    if (blob) {
+                        buffer = await blob.arrayBuffer();
+                    } else {
+                        buffer = new Uint8Array(parts.reduce((total, part) => total + part.byteLength, 0));
+                        let offset = 0;
+                        parts.forEach(part => { buffer.set(new Uint8Array(part), offset); offset += part.byteLength; });
+                    }
+                    self.postMessage({id, result: await crypto.subtle.digest('SHA-256', buffer)});
+                } catch (error) {
+                    self.postMessage({id, error: String(error)});
+                }
+            };
+        `;
+        let hashWorker = null;
+        let nextHashId = 0;
+        const pendingHashes = new Map();
+        
+        const canHash = () => window.isSecureContext && window.crypto && crypto.subtle && window.Worker;
+        const toHex = (buffer) => Array.from(new Uint8Array(buffer), b => b.toString(16).padStart(2, '0')).join('');
+        
+        function hashInWorker(payload) {
+            if (!hashWorker) {
+                const source = URL.createObjectURL(new Blob([HASH_WORKER_SOURCE], {type: 'text/javascript'}));
+                hashWorker = new Worker(source);
+                hashWorker.onmessage = (e) => {
+                    const {resolve, reject} = pendingHashes.get(e.data.id);
+                    pendingHashes.delete(e.data.id);
+                    if (e.data.error) reject(new Error(e.data.error));
+                    else resolve(e.data.result);
+                };
+            }
+            return new Promise((resolve, reject) => {
+                const id = nextHashId++;
+                pendingHashes.set(id, {resolve, reject});
+                hashWorker.postMessage({id, ...payload});
             });
         }
         
+        async function startUpload(state, file) {
+            const key = resumeKey(file);
+            const savedId = localStorage.getItem(key);
+            if (savedId) {
+                try {
+                    return await request(state, 'GET', `${API_BASE}/upload/${savedId}`, null);
+                } catch (error) {
+                    if (error.status !== 404) throw error;
+                    localStorage.removeItem(key);
+                }
+            }
+            const upload = await request(state, 'POST', `${API_BASE}/upload/init`,
+                                         {name: file.name, size: file.size});
+            localStorage.setItem(key, upload.upload_id);
+            return upload;
+        }
+        
+        // Runs worker over items with at most `limit` in flight, stopping on the first error
+        async function runPool(items, limit, worker) {
+            const queue = [...items];
+            let failed = false;
+            const runners = Array.from({length: Math.min(limit, queue.length)}, async () => {
+                while (queue.length && !failed) {
+                    try {
+                        await worker(queue.shift());
+                    } catch (error) {
+                        failed = true;
+                        throw error;
+                    }
+                }
+            });
+            await Promise.all(runners);
+        }
+        
+        async function loadUploadSettings() {
+            const settings = {upload_concurrency: 3, chunk_streams: 4, dedup: false};
+            try {
+                const response = await fetch(`${API_BASE}/config`);
+                const config = await response.json();
+                settings.upload_concurrency = parseInt(config.upload_concurrency) || settings.upload_concurrency;
+                settings.chunk_streams = parseInt(config.chunk_streams) || settings.chunk_streams;
+                settings.dedup = ['true', 'yes', 'on', '1'].includes(String(config.dedup).toLowerCase());
+            } catch (error) {
+                // Fall back to the defaults
+            }
+            return settings;
+        }
+        
+        async function uploadFile(file, chunkStreams) {
+            const progressBar = document.getElementById(`progress-${file.name}`);
+            const state = {xhrs: new Set(), cancelled: false, uploadId: null};
+            activeUploads.set(file.name, state);
+            
+            const upload = await withRetry(state, () => startUpload(state, file));
+            state.uploadId = upload.upload_id;
+            const chunkLength = (index) => Math.min(upload.chunk_size, file.size - index * upload.chunk_size);
+            const received = new Set(upload.received);
+            let uploadedBytes = upload.received.reduce((total, index) => total + chunkLength(index), 0);
+            const inFlight = new Map(); // chunk index -> bytes sent so far
+            const showProgress = () => {
+                let bytes = uploadedBytes;
+                inFlight.forEach(loaded => bytes += loaded);
+                progressBar.style.width = (file.size ? bytes / file.size * 100 : 100) + '%';
+            };
+            showProgress();
+            
+            // Chunks are verified as they arrive; the whole-file digest can only be
+            // sent when every chunk was hashed here rather than in an earlier session
+            const hashing = upload.digest_algorithm === 'sha256' && canHash();
+            const chunkDigests = [];
+            
+            const missing = [];
+            for (let index = 0; index < upload.total_chunks; index++) {
+                if (!received.has(index)) missing.push(index);
+            }
+            await runPool(missing, chunkStreams, async (index) => {
+                const start = index * upload.chunk_size;
+                const blob = file.slice(start, start + chunkLength(index));
+                const headers = {};
+                if (hashing) {
+                    chunkDigests[index] = await hashInWorker({blob});
+                    headers['X-Chunk-Digest'] = 'sha256:' + toHex(chunkDigests[index]);
+                }
+                let mismatches = 0;
+                await withRetry(state, () => request(
+                    state, 'PUT', `${API_BASE}/upload/${upload.upload_id}/${index}`, blob,
+                    (loaded) => { inFlight.set(index, loaded); showProgress(); }, headers
+                ).catch(error => {
+                    // The chunk was corrupted on the way; resend it a few times
+                    if (error.status === 422 && ++mismatches < 3) error.retryable = true;
+                    inFlight.delete(index);
+                    throw error;
+                }));
+                inFlight.delete(index);
+                uploadedBytes += blob.size;
+                showProgress();
+            });
+            
+            let finalizeBody = null;
+            if (hashing && upload.received.length === 0) {
+                const parts = Array.from({length: upload.total_chunks}, (_, index) => chunkDigests[index]);
+                finalizeBody = {digest: 'sha256-tree:' + toHex(await hashInWorker({parts}))};
+            }
+            await withRetry(state, () => request(
+                state, 'POST', `${API_BASE}/upload/${upload.upload_id}/finalize`, finalizeBody));
+            localStorage.removeItem(resumeKey(file));
+        }
+        
+        // Sends only the chunks the server's content store doesn't have yet.
+        // Nothing to resume: chunks that made it last time are simply not missing.
+        async function uploadDeduplicated(file, chunkStreams) {
+            const progressBar = document.getElementById(`progress-${file.name}`);
+            const state = {xhrs: new Set(), cancelled: false, uploadId: null};
+            activeUploads.set(file.name, state);
+            
+            const chunks = await hashInWorker({file});
+            if (state.cancelled) throw new Error('Upload cancelled');
+            const sendMissing = async (missing) => {
+                // Send each missing chunk once, from its first occurrence in the file
+                const needed = new Set(missing);
+                const toSend = chunks.filter(chunk => needed.delete(chunk.id));
+                let uploadedBytes = file.size - toSend.reduce((total, chunk) => total + chunk.length, 0);
+                const inFlight = new Map();
+                const showProgress = () => {
+                    let bytes = uploadedBytes;
+                    inFlight.forEach(loaded => bytes += loaded);
+                    progressBar.style.width = (file.size ? bytes / file.size * 100 : 100) + '%';
+                };
+                showProgress();
+                await runPool(toSend, chunkStreams, async (chunk) => {
+                    const blob = file.slice(chunk.offset, chunk.offset + chunk.length);
+                    let mismatches = 0;
+                    await withRetry(state, () => request(
+                        state, 'PUT', `${API_BASE}/store/chunks/${chunk.id}`, blob,
+                        (loaded) => { inFlight.set(chunk.id, loaded); showProgress(); }
+                    ).catch(error => {
+                        if (error.status === 422 && ++mismatches < 3) error.retryable = true;
+                        inFlight.delete(chunk.id);
+                        throw error;
+                    }));
+                    inFlight.delete(chunk.id);
+                    uploadedBytes += chunk.length;
+                    showProgress();
+                });
+            };
+            
+            const {missing} = await withRetry(state, () => request(
+                state, 'POST', `${API_BASE}/store/missing`, {chunks: [...new Set(chunks.map(chunk => chunk.id))]}));
+            await sendMissing(missing);
+            const manifest = {name: file.name, chunks: chunks.map(chunk => [chunk.id, chunk.length])};
+            try {
+                await withRetry(state, () => request(state, 'POST', `${API_BASE}/store/files`, manifest));
+            } catch (error) {
+                // A chunk was collected in between; send it again and retry once
+                if (error.status !== 409) throw error;
+                const retry = await request(state, 'POST', `${API_BASE}/store/missing`, {chunks: manifest.chunks.map(c => c[0])});
+                await sendMissing(retry.missing);
+                await withRetry(state, () => request(state, 'POST', `${API_BASE}/store/files`, manifest));
+            }
+        }
+        
+        // Small files go up together as one tar stream, which saves a request,
+        // a multipart parse and a file list update per file
+        const BATCH_FILE_SIZE = 1024 * 1024; // files up to this size are batched
+        const BATCH_MAX_FILES = 1000;
+        const BATCH_MAX_BYTES = 64 * 1024 * 1024;
+        
+        function makeBatches(files) {
+            const batches = [];
+            let batch = [];
+            let bytes = 0;
+            for (const file of files) {
+                if (batch.length >= BATCH_MAX_FILES || bytes + file.size > BATCH_MAX_BYTES) {
+                    batches.push(batch);
+                    batch = [];
+                    bytes = 0;
+                }
+                batch.push(file);
+                bytes += file.size;
+            }
+            if (batch.length) batches.push(batch);
+            return batches;
+        }
+        
+        async function uploadBatch(files) {
+            const state = {xhrs: new Set(), cancelled: false, uploadId: null};
+            activeUploads.set(`batch:${files[0].name}`, state);
+            const body = await hashInWorker({tar: files.map(file => ({name: file.webkitRelativePath || file.name, file}))});
+            if (state.cancelled) throw new Error('Upload cancelled');
+            
+            // Where each file ends in the tar body, to move its progress bar
+            const ends = [];
+            let offset = 0;
+            files.forEach(file => ends.push(offset += 512 + file.size + (512 - file.size % 512) % 512));
+            const bars = files.map(file => document.getElementById(`progress-${file.name}`));
+            let done = 0;
+            const showProgress = (loaded) => {
+                while (done < files.length && loaded >= ends[done]) bars[done++].style.width = '100%';
+            };
+            await withRetry(state, () => request(
+                state, 'POST', `${API_BASE}/upload/batch?name=${encodeURIComponent(files[0].name)}`, body,
+                showProgress, {'Content-Type': 'application/x-tar'}));
+            showProgress(Infinity);
+        }
+        
         uploadButton.addEventListener('click', async () => {
             uploadButton.disabled = true;
             let completed = 0;
             const totalFiles = selectedFiles.size;
+            const settings = await loadUploadSettings();
+            
+            const files = Array.from(selectedFiles.values());
+            const small = settings.dedup ? [] : files.filter(file => file.size <= BATCH_FILE_SIZE);
+            const jobs = small.length > 1 ? makeBatches(small).map(batch => ({batch})) : [];
+            const batched = new Set(jobs.length ? small : []);
+            files.filter(file => !batched.has(file)).forEach(file => jobs.push({file}));
             
-            for (const [filename, file] of selectedFiles) {
+            await runPool(jobs, settings.upload_concurrency, async ({batch, file}) => {
                 try {
-                    await uploadFile(file);
-                    completed++;
+                    if (batch) {
+                        await uploadBatch(batch);
+                    } else if (settings.dedup && canHash()) {
+                        await uploadDeduplicated(file, settings.chunk_streams);
+                    } else {
+                        await uploadFile(file, settings.chunk_streams);
+                    }
+                    completed += batch ? batch.length : 1;
                     showStatus(`Uploaded ${completed}/${totalFiles} files`);
                 } catch (error) {
-                    showStatus(`Error uploading ${filename}: ${error.message}`, true);
+                    showStatus(`Error uploading ${batch ? `${batch.length} files` : file.name}: ${error.message}`, true);
                 }
-            }
+            });
             
             selectedFiles.clear();
             activeUploads.clear();
@@ -639,7 +3945,15 @@ HTML_TEMPLATE = '''
         });
         
         cancelButton.addEventListener('click', () => {
-            activeUploads.forEach(xhr => xhr.abort());
+            activeUploads.forEach((state, filename) => {
+                state.cancelled = true;
+                state.xhrs.forEach(xhr => xhr.abort());
+                if (state.uploadId) {
+                    fetch(`${API_BASE}/upload/${state.uploadId}`, {method: 'DELETE'});
+                    const file = selectedFiles.get(filename);
+                    if (file) localStorage.removeItem(resumeKey(file));
+                }
+            });
             selectedFiles.clear();
             activeUploads.clear();
             totalSize = 0;
@@ -649,83 +3963,310 @@ HTML_TEMPLATE = '''
             sizeWarning.style.display = 'none';
         });
         
+        // Virtualized file list: every entry lives in memory, but only the rows
+        // inside the viewport (plus a small overscan) exist in the DOM
+        const ROW_HEIGHT = 60; // px, must match .file-item height
+        const OVERSCAN = 10;
+        const PAGE_SIZE = 5000;
+        const COMPARATORS = {
+            name: (a, b) => (a.name < b.name ? -1 : a.name > b.name ? 1 : 0),
+            size: (a, b) => a.size - b.size || COMPARATORS.name(a, b),
+            mtime: (a, b) => a.mtime - b.mtime || COMPARATORS.name(a, b)
+        };
+        const fileViewport = document.getElementById('fileViewport');
+        const fileSpacer = document.getElementById('fileSpacer');
+        const fileSearch = document.getElementById('fileSearch');
+        const fileSort = document.getElementById('fileSort');
+        const fileCount = document.getElementById('fileCount');
+        const filesByName = new Map();
+        const sortIndexes = new Map(); // sort key -> files in ascending order, rebuilt after changes
+        const rowPool = [];
+        let viewCache = null; // sorted + filtered files currently shown
+        let renderPending = false;
+        let filesVersion = null;
+        let loadingFiles = false;
+        let queuedUpdates = []; // deltas that arrived while the list was loading
+        
+        function addFileEntry(file) {
+            file.searchName = file.name.toLowerCase();
+            filesByName.set(file.name, file);
+        }
+        
+        function filesChanged() {
+            sortIndexes.clear();
+            viewCache = null;
+            scheduleRender();
+            updateArchiveFolders();
+        }
+        
+        const archiveFolder = document.getElementById('archiveFolder');
+        let archiveFolderKey = '';
+        
+        function updateArchiveFolders() {
+            const folders = new Set();
+            for (const name of filesByName.keys()) {
+                for (let i = name.indexOf('/'); i !== -1; i = name.indexOf('/', i + 1)) {
+                    folders.add(name.slice(0, i));
+                }
+            }
+            const sorted = Array.from(folders).sort();
+            const key = sorted.join('//');
+            if (key === archiveFolderKey) return;
+            archiveFolderKey = key;
+            const selected = archiveFolder.value;
+            archiveFolder.length = 1;
+            sorted.forEach(folder => archiveFolder.add(new Option(folder, folder)));
+            archiveFolder.value = folders.has(selected) ? selected : '';
+        }
+        
+        document.getElementById('archiveButton').addEventListener('click', () => {
+            const folder = archiveFolder.value ? '/' + encodePath(archiveFolder.value) : '';
+            const format = document.getElementById('archiveFormat').value;
+            window.location.href = `${API_BASE}/archive${folder}?${format}`;
+        });
+        
+        function sortedFiles(key) {
+            let index = sortIndexes.get(key);
+            if (!index) {
+                index = Array.from(filesByName.values()).sort(COMPARATORS[key]);
+                sortIndexes.set(key, index);
+            }
+            return index;
+        }
+        
+        function currentView() {
+            if (viewCache) return viewCache;
+            const [key, order] = fileSort.value.split('-');
+            let files = sortedFiles(key);
+            if (order === 'desc') files = files.slice().reverse();
+            const term = fileSearch.value.trim().toLowerCase();
+            if (term) files = files.filter(file => file.searchName.includes(term));
+            viewCache = files;
+            return files;
+        }
+        
+        const THUMBNAIL_EXTENSIONS = new Set(['jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp', 'tif', 'tiff',
+                                              'mp4', 'm4v', 'mov', 'mkv', 'webm', 'avi']);
+        const TEXT_EXTENSIONS = new Set(['txt', 'md', 'log', 'csv', 'tsv', 'json', 'xml', 'yml', 'yaml', 'ini',
+                                         'cfg', 'conf', 'toml', 'py', 'js', 'ts', 'html', 'css', 'sh', 'c', 'h',
+                                         'cpp', 'java', 'go', 'rs', 'sql']);
+        const extension = (name) => name.slice(name.lastIndexOf('.') + 1).toLowerCase();
+        
+        function createRow() {
+            const row = document.createElement('div');
+            row.className = 'file-item';
+            row.innerHTML = `
+                <img class="file-thumb" alt="">
+                <div class="file-info">
+                    <strong></strong>
+                    <br>
+                    <small></small>
+                </div>
+                <div class="file-actions">
+                    <button class="button" data-action="preview">Preview</button>
+                    <button class="button" data-action="download">Download</button>
+                </div>
+            `;
+            const thumb = row.querySelector('img');
+            thumb.onerror = () => thumb.style.visibility = 'hidden';
+            fileViewport.appendChild(row);
+            return row;
+        }
+        
+        function renderVisible() {
+            renderPending = false;
+            const files = currentView();
+            fileSpacer.style.height = files.length * ROW_HEIGHT + 'px';
+            fileCount.textContent = `${files.length} of ${filesByName.size} files`;
+            
+            const first = Math.max(0, Math.floor(fileViewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+            const count = Math.ceil(fileViewport.clientHeight / ROW_HEIGHT) + 2 * OVERSCAN;
+            while (rowPool.length < count) rowPool.push(createRow());
+            
+            rowPool.forEach((row, i) => {
+                const file = files[first + i];
+                if (!file) {
+                    row.style.display = 'none';
+                    return;
+                }
+                row.style.display = '';
+                row.style.transform = `translateY(${(first + i) * ROW_HEIGHT}px)`;
+                if (row.dataset.name !== file.name || row.dataset.size !== file.size_readable) {
+                    row.dataset.name = file.name;
+                    row.dataset.size = file.size_readable;
+                    row.querySelector('strong').textContent = file.name;
+                    row.querySelector('small').textContent = file.size_readable;
+                    // Thumbnails are rendered on first request; mtime in the URL lets the browser keep them
+                    const thumb = row.querySelector('img');
+                    if (THUMBNAIL_EXTENSIONS.has(extension(file.name))) {
+                        thumb.style.visibility = '';
+                        thumb.src = `${API_BASE}/thumbnail/${encodePath(file.name)}?size=128&v=${file.mtime}`;
+                    } else {
+                        thumb.style.visibility = 'hidden';
+                        thumb.removeAttribute('src');
+                    }
+                    row.querySelector('[data-action="preview"]').style.display =
+                        TEXT_EXTENSIONS.has(extension(file.name)) ? '' : 'none';
+                }
+            });
+        }
+        
+        function scheduleRender() {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(renderVisible);
+        }
+        
+        fileViewport.addEventListener('scroll', scheduleRender);
+        window.addEventListener('resize', scheduleRender);
+        fileViewport.addEventListener('click', (e) => {
+            const button = e.target.closest('button');
+            if (!button) return;
+            const name = button.closest('.file-item').dataset.name;
+            if (button.dataset.action === 'preview') previewFile(name);
+            else downloadFile(name);
+        });
+        fileSort.addEventListener('change', () => {
+            viewCache = null;
+            scheduleRender();
+        });
+        let searchTimer = null;
+        fileSearch.addEventListener('input', () => {
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => {
+                viewCache = null;
+                fileViewport.scrollTop = 0;
+                scheduleRender();
+            }, 150);
+        });
+        
+        async function fetchAllFiles() {
+            const files = [];
+            let version = null;
+            for (let offset = 0; ; offset += PAGE_SIZE) {
+                const response = await fetch(`${API_BASE}/files?offset=${offset}&limit=${PAGE_SIZE}`);
+                const page = await response.json();
+                const pageVersion = response.headers.get('X-Files-Version');
+                if (version === null) version = pageVersion;
+                // A change between pages shifts the offsets, so start over
+                if (pageVersion !== version) return null;
+                files.push(...page);
+                if (page.length < PAGE_SIZE) return {files, version: parseInt(version)};
+            }
+        }
+        
         async function loadFileList() {
+            if (loadingFiles) return;
+            loadingFiles = true;
             try {
-                const response = await fetch(`${API_BASE}/files`);
-                const files = await response.json();
-                
-                const fileList = document.getElementById('fileList');
-                fileList.innerHTML = '<h2>Uploaded Files</h2>';
-                
-                files.forEach(file => {
-                    const fileItem = document.createElement('div');
-                    fileItem.className = 'file-item';
-                    fileItem.innerHTML = `
-                        <div>
-                            <strong>${file.name}</strong>
-                            <br>
-                            <small>${file.size_readable}</small>
-                        </div>
-                        <button class="button" onclick="downloadFile('${file.name}')">Download</button>
-                    `;
-                    fileList.appendChild(fileItem);
-                });
+                let result = null;
+                for (let attempt = 0; attempt < 3 && !result; attempt++) {
+                    result = await fetchAllFiles();
+                }
+                if (!result) throw new Error('file list kept changing');
+                filesByName.clear();
+                result.files.forEach(addFileEntry);
+                filesVersion = result.version;
+                filesChanged();
             } catch (error) {
                 showStatus('Error loading file list: ' + error.message, true);
+            } finally {
+                loadingFiles = false;
+            }
+            // The pages may predate some of these; the older ones are skipped below
+            const queued = queuedUpdates.sort((a, b) => a.version - b.version);
+            queuedUpdates = [];
+            queued.forEach(applyFilesUpdate);
+        }
+        
+        function applyFilesUpdate(data) {
+            if (loadingFiles) {
+                queuedUpdates.push(data);
+                return;
             }
+            if (filesVersion === null) return; // The first load hasn't succeeded; the next one will be current
+            if (data.version <= filesVersion) return; // Already reflected in our copy
+            if (data.resync || data.base_version > filesVersion) {
+                loadFileList(); // Missed at least one delta
+                return;
+            }
+            data.removed.forEach(name => filesByName.delete(name));
+            data.added.forEach(addFileEntry);
+            data.changed.forEach(addFileEntry);
+            filesVersion = data.version;
+            filesChanged();
+        }
+        
+        function encodePath(name) {
+            return name.split('/').map(encodeURIComponent).join('/');
         }
         
         function downloadFile(filename) {
-            window.location.href = `${API_BASE}/download/${filename}`;
+            window.location.href = `${API_BASE}/download/${encodePath(filename)}`;
         }
         
+        const textPreview = document.getElementById('textPreview');
+        
+        async function previewFile(filename) {
+            try {
+                const response = await fetch(`${API_BASE}/head/${encodePath(filename)}`);
+                if (!response.ok) {
+                    const data = await response.json().catch(() => ({}));
+                    throw new Error(data.error || response.statusText);
+                }
+                let text = await response.text();
+                if (response.headers.get('X-Truncated') === 'true') text += '...';
+                document.getElementById('textPreviewName').textContent = filename;
+                document.getElementById('textPreviewBody').textContent = text;
+                textPreview.style.display = 'block';
+            } catch (error) {
+                showStatus(`Cannot preview ${filename}: ${error.message}`, true);
+            }
+        }
+        
+        document.getElementById('textPreviewClose').addEventListener('click', () => {
+            textPreview.style.display = 'none';
+        });
+        
         // Load initial file list
         loadFileList();
 
     // Initialize Socket.IO
         let socket;
+        let restartPending = false;
         initializeSocket();
         
         function initializeSocket() {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
             const socketUrl = `${protocol}//${window.location.host}`;
-            socket = io(socketUrl);
+            // WebSocket only: with several workers a polling client could hit a different process each request
+            socket = io(socketUrl, {transports: ['websocket']});
             
             socket.on('connect', () => {
+                if (restartPending) {
+                    window.location.reload(); // Settings may have changed under the page
+                    return;
+                }
                 updateServerStatus(true);
+                loadFileList(); // Deltas may have been missed while disconnected
             });
             
             socket.on('disconnect', () => {
                 updateServerStatus(false);
             });
             
-            socket.on('files_update', function(data) {
-                        socket.on('files_update', function(data) {
-            const fileList = document.getElementById('fileList');
-            fileList.innerHTML = '<h2>Uploaded Files</h2>';
+            socket.on('files_update', applyFilesUpdate);
             
-            data.files.forEach(file => {
-                const fileItem = document.createElement('div');
-                fileItem.className = 'file-item';
-                fileItem.innerHTML = `
-                    <div>
-                        <strong>${file.name}</strong>
-                        <br>
-                        <small>${file.size_readable}</small>
-                    </div>
-                    <button class="button" onclick="downloadFile('${file.name}')">
-                        Download
-                    </button>`;
-                fileList.appendChild(fileItem);
-                    });
-                });
+            socket.on('upload_queue', ({name, position, waiting}) => {
+                const label = document.getElementById(`queue-${name}`);
+                if (label) {
+                    label.textContent = position ? `Waiting for the disk: ${position} of ${waiting} in line` : '';
+                }
             });
             
             socket.on('server_restart', () => {
-                showStatus('Server is restarting. Please wait...', false);
-                setTimeout(() => {
-                    window.location.reload();
-                }, 5000);
+                restartPending = true;
+                showStatus('Server will restart once active transfers finish...', false);
             });
         }
         
@@ -754,6 +4295,10 @@ HTML_TEMPLATE = '''
                 
                 document.getElementById('hostInput').value = config.host;
                 document.getElementById('portInput').value = config.port;
+                document.getElementById('uploadConcurrencyInput').value = config.upload_concurrency;
+                document.getElementById('chunkStreamsInput').value = config.chunk_streams;
+                document.getElementById('bandwidthLimitInput').value = config.bandwidth_limit_mbps;
+                document.getElementById('clientBandwidthInput').value = config.client_bandwidth_mbps;
             } catch (error) {
                 showStatus('Error loading settings: ' + error.message, true);
             }
@@ -774,7 +4319,11 @@ HTML_TEMPLATE = '''
         async function saveSettings() {
             const settings = {
                 host: document.getElementById('hostInput').value,
-                port: document.getElementById('portInput').value
+                port: document.getElementById('portInput').value,
+                upload_concurrency: document.getElementById('uploadConcurrencyInput').value,
+                chunk_streams: document.getElementById('chunkStreamsInput').value,
+                bandwidth_limit_mbps: document.getElementById('bandwidthLimitInput').value,
+                client_bandwidth_mbps: document.getElementById('clientBandwidthInput').value
             };
             
             try {
@@ -786,11 +4335,15 @@ HTML_TEMPLATE = '''
                     body: JSON.stringify(settings)
                 });
                 
-                if (response.ok) {
-                    showStatus('Settings saved successfully. Server will restart...', false);
+                const result = await response.json();
+                if (!response.ok) {
+                    throw new Error(result.error || 'Failed to save settings');
+                }
+                if (result.restart_required.length) {
+                    showStatus('Settings saved. Server will restart to apply ' + result.restart_required.join(', ') + '...', false);
                     socket.emit('request_restart');
                 } else {
-                    throw new Error('Failed to save settings');
+                    showStatus('Settings applied', false);
                 }
             } catch (error) {
                 showStatus('Error saving settings: ' + error.message, true);
@@ -823,13 +4376,21 @@ HTML_TEMPLATE = '''
                 const response = await fetch('/generate_cert', {
                     method: 'POST'
                 });
-                
-                if (response.ok) {
-                    showStatus('New certificate generated successfully. Server will restart...', false);
-                    socket.emit('request_restart');
-                } else {
+                if (!response.ok) {
                     throw new Error('Failed to generate certificate');
                 }
+                showStatus('Generating certificate...', false);
+                
+                // The server generates it in the background and swaps it in live
+                let job = await response.json();
+                while (job.status === 'pending' || job.status === 'running') {
+                    await sleep(500);
+                    job = await (await fetch(`/generate_cert/${job.id}`)).json();
+                }
+                if (job.status !== 'done') {
+                    throw new Error(job.error || 'Failed to generate certificate');
+                }
+                showStatus('New certificate is live. Reload the page to trust it.', false);
             } catch (error) {
                 showStatus('Error generating certificate: ' + error.message, true);
             }
@@ -844,10 +4405,16 @@ HTML_TEMPLATE = '''
 @app.route('/config', methods=['GET', 'POST'])
 def manage_config():
     if request.method == 'POST':
-        data = request.get_json()
-        config['Server'].update(data)
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        try:
+            applied, restart_required = apply_config(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         save_config(config)
-        return jsonify({'message': 'Configuration updated successfully'})
+        return jsonify({'message': 'Configuration updated successfully', 'applied': applied,
+                        'restart_required': restart_required})
     return jsonify(dict(config['Server']))
 
 # Force HTTPS
@@ -857,25 +4424,32 @@ def before_request():
         url = request.url.replace('http://', 'https://', 1)
         return redirect(url)
 
+# The page has no template logic, so it is sent as prebuilt bytes: one
+# precompressed copy per encoding, made on first request, behind an ETag
+# that only changes when the page itself does
+index_variants = {}  # encoding or None -> body
+INDEX_ETAG = '"%s"' % hashlib.sha256(HTML_TEMPLATE.encode()).hexdigest()[:16]
+
+def index_page(encoding):
+    body = index_variants.get(encoding)
+    if body is None:
+        body = HTML_TEMPLATE.encode()
+        if encoding:
+            compressor = new_compressor(encoding, COMPRESSION_LEVELS[encoding][1])
+            body = compressor.compress(body) + compressor.flush()
+        index_variants[encoding] = body
+    return body
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
-
-class FileHandler(FileSystemEventHandler):
-    def on_any_event(self, event):
-        if event.is_directory:
-            return
-        
-        files = []
-        for filename in os.listdir(UPLOAD_FOLDER):
-            filepath = os.path.join(UPLOAD_FOLDER, filename)
-            size = os.path.getsize(filepath)
-            files.append({
-                'name': filename,
-                'size': size,
-                'size_readable': convert_size(size)
-            })
-        socketio.emit('files_update', {'files': files})
+    encoding = negotiate_encoding()
+    headers = {'ETag': variant_etag(INDEX_ETAG, encoding) if encoding else INDEX_ETAG,
+               'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    if not is_resource_modified(request.environ, headers['ETag'].strip('"')):
+        return app.response_class(status=304, headers=headers)
+    return app.response_class(index_page(encoding), headers=headers, mimetype='text/html')
 
 @app.route('/upload_cert', methods=['POST'])
 def upload_certificate():
@@ -892,53 +4466,1108 @@ def upload_certificate():
     
     try:
         file.save(filename)
-        return jsonify({'message': f'{cert_type} uploaded successfully'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    try:
+        # Goes live once the certificate and key on disk match
+        reload_certificate()
+        announce_certificate_reload()
+        return jsonify({'message': f'{cert_type} uploaded successfully', 'reloaded': True})
+    except (ssl.SSLError, OSError):
+        return jsonify({'message': f'{cert_type} uploaded successfully', 'reloaded': False})
 
 @app.route('/generate_cert', methods=['POST'])
 def generate_new_certificate():
-    try:
-        generate_ssl_certificate(
-            config['Server']['cert_path'],
-            config['Server']['key_path']
-        )
-        return jsonify({'message': 'Certificate generated successfully'})
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    data = request.get_json(silent=True) or {}
+    options = {
+        'key_type': data.get('key_type', config['Server']['cert_key_type']),
+        'common_name': data.get('common_name', 'localhost')
+    }
+    if options['key_type'] not in ('ecdsa', 'rsa'):
+        return jsonify({'error': 'key_type must be ecdsa or rsa'}), 400
+    job = {'id': uuid.uuid4().hex, 'status': 'pending', 'created': time.time(), **options}
+    save_cert_job(job)
+    cert_executor.submit(run_cert_job, job, options)
+    return jsonify(job), 202, {'Location': f"/generate_cert/{job['id']}"}
+
+@app.route('/generate_cert/<job_id>', methods=['GET'])
+def certificate_job_status(job_id):
+    job = read_cert_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+# Graceful restarts
+class RequestTracker:
+    """WSGI middleware counting requests until their responses finish streaming,
+    so a restart can wait for transfers instead of cutting them off"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.active = 0
+        self.lock = threading.Lock()
+        self.draining = False
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith('/socket.io'):
+            return self.wsgi_app(environ, start_response)
+        if self.draining:
+            # Clients retry 5xx, and chunked uploads resume once the server is back
+            start_response('503 Service Unavailable', [('Content-Type', 'application/json'), ('Retry-After', '5')])
+            return [b'{"error": "Server is restarting"}']
+        with self.lock:
+            self.active += 1
+        try:
+            return ClosingIterator(self.wsgi_app(environ, start_response), self.finished)
+        except BaseException:
+            self.finished()
+            raise
+
+    def finished(self):
+        with self.lock:
+            self.active -= 1
+
+    def drain(self, timeout):
+        self.draining = True
+        time.sleep(1)  # Connections accepted a moment ago may not have reached the app yet
+        deadline = time.monotonic() + timeout
+        while self.active and time.monotonic() < deadline:
+            time.sleep(0.5)
+        return self.active == 0
+
+request_tracker = RequestTracker(app.wsgi_app)
+app.wsgi_app = request_tracker
+
+def drain_requests():
+    if not request_tracker.drain(config['Server'].getint('drain_timeout')):
+        print(f"Restarting with {request_tracker.active} requests still active")
+
+def reexec_server():
+    # Command line options were saved to the config file at startup, so the
+    # new process reads everything, including changed settings, from there
+    print("Restarting...")
+    sys.stdout.flush()  # exec discards anything still buffered
+    os.execv(sys.executable, [sys.executable, os.path.abspath(sys.argv[0])])
+
+def handle_drain_signal(signum, frame):
+    # Prefork worker: finish active requests, then exit for the supervisor.
+    # The handler may run inside eventlet's hub, which must not block.
+    def drain_and_exit():
+        drain_requests()
+        os._exit(0)
+    eventlet.spawn(drain_and_exit)
+
+@socketio.on('connect')
+def handle_connect():
+    metrics.inc('localhttps_socketio_clients')
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    metrics.inc('localhttps_socketio_clients', value=-1)
 
 @socketio.on('request_restart')
 def handle_restart():
+    metrics.inc('localhttps_socketio_emits_total', (('event', 'server_restart'),))
     socketio.emit('server_restart')
     threading.Thread(target=restart_server).start()
 
 def restart_server():
     time.sleep(5)  # Give clients time to receive the restart notification
-    os._exit(0)  # Force restart by exiting
+    if PREFORK_PARENT:
+        os.kill(PREFORK_PARENT, signal.SIGUSR1)  # The supervisor drains every worker, then restarts
+        return
+    drain_requests()
+    reexec_server()
 
 @app.route('/files', methods=['GET'])
 def list_files():
-    files = []
-    for filename in os.listdir(app.config['UPLOAD_FOLDER']):
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        size = os.path.getsize(filepath)
-        files.append({
-            'name': filename,
-            'size': size,
-            'size_readable': convert_size(size)
-        })
-    return jsonify(files)
+    sort = request.args.get('sort', 'name')
+    if sort not in FileIndex.SORT_KEYS:
+        return jsonify({'error': f'Unknown sort key {sort}'}), 400
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = request.args.get('limit')
+        limit = max(int(limit), 0) if limit is not None else None
+    except ValueError:
+        return jsonify({'error': 'offset and limit must be integers'}), 400
 
-@app.route('/download/<filename>', methods=['GET'])
+    started = time.perf_counter()
+    file_index.ensure_current()
+    # Read before querying: a change landing in between is then replayed by the
+    # next delta, which clients apply idempotently
+    version = file_index.version
+    total, files = file_index.query(
+        sort=sort,
+        reverse=request.args.get('order', 'asc') == 'desc',
+        prefix=request.args.get('prefix', ''),
+        search=request.args.get('search', ''),
+        offset=offset,
+        limit=limit
+    )
+    response = jsonify(files)
+    response.headers['X-Total-Count'] = str(total)
+    # Clients patch their copy with files_update deltas starting at this version
+    response.headers['X-Files-Version'] = str(version)
+    metrics.observe('localhttps_listing_seconds', time.perf_counter() - started)
+    return response
+
+@app.route('/transfers', methods=['GET'])
+def list_transfers():
+    """Most recent uploads and downloads, optionally of one file or direction"""
+    direction = request.args.get('direction')
+    if direction not in (None, 'upload', 'download'):
+        return jsonify({'error': 'direction must be upload or download'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 100)), 0), TRANSFER_HISTORY_LIMIT)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    try:
+        transfers = metadata_store().transfers(request.args.get('name'), direction, limit)
+    except sqlite3.Error as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify(transfers)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return render_metrics(metrics.collect()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# Compression
+# Downloads are compressed on the fly when the client accepts it and the file
+# looks compressible; files downloaded often get a precompressed copy cached
+# under .cache/compressed. Uploads may send gzip (or zstd) request bodies.
+COMPRESSION_LEVELS = {'zstd': (3, 12), 'br': (4, 9), 'gzip': (1, 6)}  # (streaming, cached)
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+COMPRESSION_MIN_SAVING = 0.1  # skip files whose sample shrinks by less than this
+COMPRESSION_CACHE_HITS = 3  # downloads of one variant before it is precompressed
+INCOMPRESSIBLE_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.br', '.lz4', '.7z', '.rar', '.jar', '.apk',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.woff', '.woff2', '.deb', '.rpm', '.whl', '.dmg'
+}
+COMPRESSIBLE_MEDIA_TYPES = {'image/svg+xml', 'image/bmp', 'image/x-ms-bmp', 'image/tiff'}
+
+def compression_encodings():
+    # Preferred first
+    return (['zstd'] if zstandard else []) + (['br'] if brotli else []) + ['gzip']
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+def new_compressor(encoding, level):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if encoding == 'br':
+        return BrotliCompressor(level)
+    return zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 selects the gzip container
+
+def negotiate_encoding():
+    if not config['Server'].getboolean('compression') or request.headers.get('Range'):
+        return None  # Ranges are always served from the uncompressed file
+    best, best_quality = None, 0
+    for encoding in compression_encodings():
+        quality = request.accept_encodings.quality(encoding)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+compressible_files = {}  # identity ETag -> whether the file is worth compressing
+
+def looks_compressible(name, path, manifest, size, etag):
+    if size < COMPRESSION_MIN_SIZE or os.path.splitext(name)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    media_type = mimetypes.guess_type(name)[0] or ''
+    if media_type.startswith(('image/', 'video/', 'audio/')) and media_type not in COMPRESSIBLE_MEDIA_TYPES:
+        return False
+    result = compressible_files.get(etag)
+    if result is None:
+        # Unknown types get a quick trial compression of their first block
+        with open_download(path, manifest) as f:
+            sample = f.read(COMPRESSION_SAMPLE_SIZE)
+        result = len(zlib.compress(sample, 1)) < len(sample) * (1 - COMPRESSION_MIN_SAVING)
+        if len(compressible_files) > 10000:
+            compressible_files.clear()
+        compressible_files[etag] = result
+    return result
+
+def variant_etag(etag, encoding):
+    return f'{etag[:-1]}-{encoding}"'
+
+def iter_compressed(path, manifest, encoding):
+    compressor = new_compressor(encoding, COMPRESSION_LEVELS[encoding][0])
+    with open_download(path, manifest) as f:
+        while True:
+            data = f.read(DOWNLOAD_BLOCK_SIZE)
+            if not data:
+                break
+            output = compressor.compress(data)
+            if output:
+                yield output
+    yield compressor.flush()
+
+class CompressionCache:
+    """Precompressed variants of frequently downloaded files, evicted least recently used first"""
+
+    def __init__(self):
+        self.hits = {}
+        self.building = set()
+        self.lock = threading.Lock()
+
+    def folder(self):
+        return os.path.join(app.config['UPLOAD_FOLDER'], '.cache', 'compressed')
+
+    def path(self, etag, encoding):
+        return os.path.join(self.folder(), hashlib.sha1(etag.encode()).hexdigest() + '.' + encoding)
+
+    def open(self, etag, encoding):
+        # Returns (file object, length) for a cached variant, or None
+        path = self.path(etag, encoding)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        try:
+            os.utime(path)  # Recency for eviction
+        except OSError:
+            pass
+        return f, os.fstat(f.fileno()).st_size
+
+    def record_hit(self, etag, encoding, path, manifest):
+        key = (etag, encoding)
+        with self.lock:
+            if len(self.hits) > 10000:
+                self.hits.clear()
+            self.hits[key] = self.hits.get(key, 0) + 1
+            if self.hits[key] < COMPRESSION_CACHE_HITS or key in self.building:
+                return
+            self.building.add(key)
+        threading.Thread(target=self.build, args=(etag, encoding, path, manifest), daemon=True).start()
+
+    def build(self, etag, encoding, path, manifest):
+        destination = self.path(etag, encoding)
+        temp_path = f'{destination}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(self.folder(), exist_ok=True)
+            compressor = new_compressor(encoding, COMPRESSION_LEVELS[encoding][1])
+            with open_download(path, manifest) as source, open(temp_path, 'wb') as f:
+                while True:
+                    data = source.read(DOWNLOAD_BLOCK_SIZE)
+                    if not data:
+                        break
+                    f.write(compressor.compress(data))
+                    time.sleep(0)  # Let other green threads run between blocks
+                f.write(compressor.flush())
+            os.replace(temp_path, destination)
+            self.evict()
+        except OSError as e:
+            print(f"Could not precompress {os.path.basename(path)}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        finally:
+            with self.lock:
+                self.building.discard((etag, encoding))
+
+    def evict(self):
+        budget = config['Server'].getint('compression_cache_mb') * 1024 * 1024
+        entries = []
+        with os.scandir(self.folder()) as it:
+            for entry in it:
+                if not entry.name.endswith('.tmp'):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+
+compression_cache = CompressionCache()
+
+# Compressed request bodies are decoded as they are read; brotli has no
+# bounded streaming decoder, so it is only offered for downloads
+BODY_DECODERS = {'gzip': lambda stream: gzip.GzipFile(fileobj=stream, mode='rb')}
+if zstandard:
+    BODY_DECODERS['zstd'] = lambda stream: zstandard.ZstdDecompressor().stream_reader(stream, read_across_frames=True)
+DECODE_ERRORS = (EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard else ())
+
+class DecodedBody:
+    """Request body decoded per its Content-Encoding, capped at limit bytes"""
+
+    def __init__(self, stream, encoding, limit):
+        self.encoding = encoding
+        self.reader = BODY_DECODERS[encoding](stream)
+        self.remaining = limit
+        self.unchecked = 0  # decoded bytes since free space was last checked
+
+    def readinto(self, view):
+        try:
+            read = self.reader.readinto(view)
+        except DECODE_ERRORS as e:
+            raise IOError(f'Malformed {self.encoding} body: {e}')
+        self.remaining -= read
+        if self.remaining < 0:
+            raise IOError('Decoded body is too large')
+        self.unchecked += read
+        if self.unchecked >= FREE_SPACE_CHECK:
+            # Admission could only reserve space for the compressed size
+            self.unchecked = 0
+            check_free_space(FREE_SPACE_CHECK)
+        return read
+
+    def read(self, size=-1):
+        # For readers that want bytes, like tarfile
+        if size < 0:
+            return body_bytes(self)
+        buffer = bytearray(size)
+        return bytes(memoryview(buffer)[:self.readinto(buffer)])
+
+def body_bytes(body):
+    data = bytearray()
+    view = copy_buffer()
+    while True:
+        read = read_into(body, view)
+        if not read:
+            return bytes(data)
+        data += view[:read]
+
+def request_body(limit=None):
+    # The body stream and its decoded length, which is unknown when it is compressed
+    encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding == 'identity':
+        return request.stream, request.content_length
+    if encoding not in BODY_DECODERS:
+        raise ValueError(f'Unsupported Content-Encoding {encoding}, use one of: {", ".join(BODY_DECODERS)}')
+    return DecodedBody(request.stream, encoding, limit or app.config['MAX_CONTENT_LENGTH']), None
+
+# Downloads
+DOWNLOAD_BLOCK_SIZE = 1024 * 1024  # 1MB reads keep per-byte overhead low
+MAX_RANGES = 64  # more ranges than this and the Range header is ignored
+
+def open_download(path, manifest):
+    return ManifestFile(content_store(), manifest) if manifest else open(path, 'rb')
+
+class FileRange:
+    """File object limited to [start, stop), usable with wsgi.file_wrapper"""
+
+    def __init__(self, path, start, stop, manifest=None):
+        self.file = open_download(path, manifest)
+        self.file.seek(start)
+        self.remaining = stop - start
+
+    def fileno(self):
+        return self.file.fileno()  # Deduplicated files have none and are read instead
+
+    def tell(self):
+        return self.file.tell()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+class FileSlice:
+    """count bytes of a file from offset, left for the server to send from the descriptor"""
+
+    def __init__(self, file, fd, offset, count):
+        self.file = file
+        self.fd = fd
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        # Bandwidth shaping cuts responses into smaller pieces
+        start, stop, _ = index.indices(self.count)
+        return FileSlice(self.file, self.fd, self.offset + start, max(stop - start, 0))
+
+    def tobytes(self):
+        return os.pread(self.fd, self.count, self.offset)
+
+class SendfileWrapper:
+    """wsgi.file_wrapper of the eventlet server: files with a descriptor become
+    FileSlices its protocol sends itself, see send_file_slice()"""
+
+    def __init__(self, file, block_size=DOWNLOAD_BLOCK_SIZE):
+        self.file = file
+        self.block_size = max(block_size, DOWNLOAD_BLOCK_SIZE)  # wrap_file() defaults to 8KB
+
+    def __iter__(self):
+        try:
+            fd = self.file.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        if fd is None or not hasattr(os, 'preadv'):
+            yield from iter(lambda: self.file.read(self.block_size), b'')
+            return
+        offset = self.file.tell()
+        remaining = getattr(self.file, 'remaining', None)
+        if remaining is None:
+            remaining = max(os.fstat(fd).st_size - offset, 0)
+        # One slice per block, so shaping, metrics and drains still see the body move
+        while remaining:
+            count = min(self.block_size, remaining)
+            yield FileSlice(self.file, fd, offset, count)
+            offset += count
+            remaining -= count
+
+    def close(self):
+        self.file.close()
+
+def file_etag(st):
+    return f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def parse_byte_ranges(header, size):
+    # Returns sorted, merged (start, stop) pairs, [] if nothing is satisfiable,
+    # or None if the header is malformed and should be ignored
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for part in spec.split(','):
+        first, dash, last = part.strip().partition('-')
+        if not dash or not (first.isdigit() or last.isdigit()):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if first:
+            start = int(first)
+            stop = int(last) + 1 if last else size
+            if last and stop <= start:
+                return None
+        else:
+            start, stop = max(size - int(last), 0), size
+        stop = min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged if len(merged) <= MAX_RANGES else None
+
+def if_range_matches(etag, mtime):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag  # Strong comparison only
+    if if_range.startswith('W/'):
+        return False
+    date = parse_date(if_range)
+    return date is not None and int(date.timestamp()) >= int(mtime)
+
+def iter_file_ranges(path, ranges, part_headers=None, closing=b'', manifest=None):
+    with open_download(path, manifest) as f:
+        for i, (start, stop) in enumerate(ranges):
+            if part_headers:
+                yield part_headers[i]
+            f.seek(start)
+            remaining = stop - start
+            while remaining:
+                data = f.read(min(DOWNLOAD_BLOCK_SIZE, remaining))
+                if not data:
+                    return  # File shrank underneath us
+                remaining -= len(data)
+                yield data
+    if closing:
+        yield closing
+
+def content_disposition(filename):
+    try:
+        filename.encode('ascii')
+        return f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+def hidden_path(name):
+    # Dot files and folders hold in-progress uploads, metadata and the content store
+    return any(part.startswith('.') for part in name.split('/'))
+
+def locate_file(filename):
+    # (path, manifest) for a file in the upload folder, or None
+    path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+    if path is None or hidden_path(filename):
+        return None
+    if os.path.isfile(path):
+        return path, None
+    # Deduplicated files only exist as a manifest in the content store
+    if '/' in filename:
+        return None
+    manifest = content_store().load_manifest(filename)
+    if manifest is None:
+        return None
+    return content_store().manifest_path(filename), manifest
+
+@app.route('/download/<path:filename>', methods=['GET'])
 def download_file(filename):
+    located = locate_file(filename)
+    if located is None:
+        return jsonify({'error': 'File not found'}), 404
+    path, manifest = located
     try:
-        return send_file(
-            os.path.join(app.config['UPLOAD_FOLDER'], filename),
-            as_attachment=True
-        )
-    except Exception as e:
+        st = os.stat(path)
+    except OSError as e:
         return jsonify({'error': str(e)}), 404
 
+    size = manifest['size'] if manifest else st.st_size
+    etag = file_etag(st)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(st.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': content_disposition(os.path.basename(filename))
+    }
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = negotiate_encoding()
+    if encoding and looks_compressible(filename, path, manifest, size, etag):
+        headers['Vary'] = 'Accept-Encoding'
+        headers['ETag'] = variant_etag(etag, encoding)
+        headers['Content-Encoding'] = encoding
+        if not is_resource_modified(request.environ, headers['ETag'].strip('"'), last_modified=http_date(st.st_mtime)):
+            return app.response_class(status=304, headers=headers)
+        note_transfer('download', filename)
+        cached = compression_cache.open(etag, encoding)
+        if cached:
+            f, length = cached
+            headers['Content-Length'] = str(length)
+            return app.response_class(wrap_file(request.environ, f, DOWNLOAD_BLOCK_SIZE), headers=headers,
+                                      mimetype=mimetype, direct_passthrough=True)
+        compression_cache.record_hit(etag, encoding, path, manifest)
+        return app.response_class(iter_compressed(path, manifest, encoding), headers=headers,
+                                  mimetype=mimetype, direct_passthrough=True)
+    if config['Server'].getboolean('compression'):
+        headers['Vary'] = 'Accept-Encoding'
+
+    if not is_resource_modified(request.environ, etag.strip('"'), last_modified=http_date(st.st_mtime)):
+        return app.response_class(status=304, headers=headers)
+    note_transfer('download', filename)
+
+    ranges = None
+    range_header = request.headers.get('Range')
+    if range_header and if_range_matches(etag, st.st_mtime):
+        ranges = parse_byte_ranges(range_header, size)
+        if ranges == []:
+            headers['Content-Range'] = f'bytes */{size}'
+            return app.response_class(status=416, headers=headers)
+
+    if not ranges or len(ranges) == 1:
+        # Whole file or one range: hand the server a file object so the eventlet
+        # server can send it from the descriptor
+        start, stop = ranges[0] if ranges else (0, size)
+        status = 206 if ranges else 200
+        if ranges:
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        headers['Content-Length'] = str(stop - start)
+        body = wrap_file(request.environ, FileRange(path, start, stop, manifest), DOWNLOAD_BLOCK_SIZE)
+        return app.response_class(body, status=status, headers=headers,
+                                  mimetype=mimetype, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    part_headers = [
+        (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+         f'Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n').encode()
+        for start, stop in ranges
+    ]
+    # Every part after the first is preceded by the CRLF that ends the previous one
+    part_headers = [part_headers[0]] + [b'\r\n' + h for h in part_headers[1:]]
+    closing = f'\r\n--{boundary}--\r\n'.encode()
+    headers['Content-Length'] = str(
+        sum(len(h) for h in part_headers) + sum(stop - start for start, stop in ranges) + len(closing)
+    )
+    body = iter_file_ranges(path, ranges, part_headers, closing, manifest)
+    return app.response_class(body, status=206, headers=headers,
+                              mimetype=f'multipart/byteranges; boundary={boundary}',
+                              direct_passthrough=True)
+
+# Archive downloads
+ZIP_LIMIT = 0xFFFFFFFF  # Sizes and offsets from here on need Zip64 records
+ZIP_MIN_DOS_TIME = 315532800  # 1980-01-01, the earliest time a zip entry can hold
+ARCHIVE_FORMATS = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+
+class ArchiveMember:
+    """A file going into an archive, stat'ed up front so the archive size is known"""
+
+    def __init__(self, arcname, path, manifest, size, mtime):
+        self.arcname = arcname
+        self.path = path
+        self.manifest = manifest
+        self.size = size
+        self.mtime = mtime
+
+    def blocks(self):
+        # Exactly size bytes, the headers already promised that many
+        remaining = self.size
+        with open_download(self.path, self.manifest) as f:
+            while remaining:
+                data = f.read(min(DOWNLOAD_BLOCK_SIZE, remaining))
+                if not data:
+                    raise IOError(f'{self.arcname} shrank while it was being archived')
+                remaining -= len(data)
+                yield data
+
+def archive_members(folder):
+    upload_folder = app.config['UPLOAD_FOLDER']
+    prefix = folder + '/' if folder else ''
+    root = os.path.basename(folder) + '/' if folder else ''
+    members = []
+    _, entries = file_index.query(prefix=prefix)
+    for entry in entries:
+        name = entry['name']
+        path = os.path.join(upload_folder, *name.split('/'))
+        manifest = None
+        try:
+            if '/' not in name and not os.path.isfile(path):
+                manifest = content_store().load_manifest(name)
+                if manifest is None:
+                    continue
+                path = content_store().manifest_path(name)
+            st = os.stat(path)
+        except OSError:
+            continue  # Removed since it was indexed
+        members.append(ArchiveMember(root + name[len(prefix):], path, manifest,
+                                     manifest['size'] if manifest else st.st_size, st.st_mtime))
+    return members
+
+def coalesce(pieces):
+    # Headers are tiny; gather them up so each write to the socket is a full block
+    buffer = bytearray()
+    for piece in pieces:
+        if len(piece) >= DOWNLOAD_BLOCK_SIZE:
+            if buffer:
+                yield bytes(buffer)
+                buffer.clear()
+            yield piece
+            continue
+        buffer += piece
+        if len(buffer) >= DOWNLOAD_BLOCK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+def dos_datetime(mtime):
+    t = time.localtime(max(mtime, ZIP_MIN_DOS_TIME))
+    return ((t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+            t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+class ZipStream:
+    """Writes a zip archive front to back without seeking: each entry's CRC and
+    sizes follow its data in a data descriptor and are repeated in the central
+    directory at the end. Stored archives have a size known before the first
+    byte; deflated ones don't, since the compressed sizes aren't known yet"""
+
+    def __init__(self, members, deflate):
+        self.members = members
+        self.deflate = deflate
+
+    def method(self, member):
+        # Media and archives barely shrink, deflating them only costs CPU
+        if not self.deflate or member.size < COMPRESSION_MIN_SIZE:
+            return 0
+        name = member.arcname
+        if os.path.splitext(name)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return 0
+        media_type = mimetypes.guess_type(name)[0] or ''
+        if media_type.startswith(('image/', 'video/', 'audio/')) and media_type not in COMPRESSIBLE_MEDIA_TYPES:
+            return 0
+        return zlib.DEFLATED
+
+    def size(self):
+        if self.deflate:
+            return None
+        return sum(piece if isinstance(piece, int) else len(piece) for piece in self.pieces(dry_run=True))
+
+    def __iter__(self):
+        return coalesce(self.pieces())
+
+    def pieces(self, dry_run=False):
+        # With dry_run, file data is yielded as its length instead of being read
+        offset = 0
+        central = []
+        for member in self.members:
+            name = member.arcname.encode()
+            method = self.method(member)
+            # Deflate can grow incompressible data a little, so leave room for that
+            zip64 = member.size * 1.05 + 1024 >= ZIP_LIMIT if method else member.size >= ZIP_LIMIT
+            extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else b''
+            date, clock = dos_datetime(member.mtime)
+            flags = 0x808  # CRC and sizes in a data descriptor, UTF-8 names
+            local = struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', 45 if zip64 else 20, flags, method, clock, date,
+                                0, ZIP_LIMIT if zip64 else 0, ZIP_LIMIT if zip64 else 0, len(name), len(extra))
+            yield local + name + extra
+            header_offset = offset
+            offset += len(local) + len(name) + len(extra)
+
+            crc, compressed = 0, 0
+            if dry_run:
+                compressed = member.size
+                yield compressed
+            else:
+                compressor = zlib.compressobj(COMPRESSION_LEVELS['gzip'][0], zlib.DEFLATED, -15) if method else None
+                for data in member.blocks():
+                    crc = zlib.crc32(data, crc)
+                    if compressor:
+                        data = compressor.compress(data)
+                    compressed += len(data)
+                    if data:
+                        yield data
+                if compressor:
+                    data = compressor.flush()
+                    compressed += len(data)
+                    yield data
+            if zip64:
+                descriptor = struct.pack('<4sLQQ', b'PK\x07\x08', crc, compressed, member.size)
+            else:
+                descriptor = struct.pack('<4sLLL', b'PK\x07\x08', crc, compressed, member.size)
+            yield descriptor
+            offset += compressed + len(descriptor)
+            central.append((name, method, clock, date, crc, compressed, member.size, header_offset))
+
+        start = offset
+        for name, method, clock, date, crc, compressed, size, header_offset in central:
+            fields = []
+            if size >= ZIP_LIMIT or compressed >= ZIP_LIMIT:
+                fields += [size, compressed]
+                size = compressed = ZIP_LIMIT
+            if header_offset >= ZIP_LIMIT:
+                fields.append(header_offset)
+                header_offset = ZIP_LIMIT
+            extra = struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields) if fields else b''
+            version = 45 if fields else 20
+            record = struct.pack('<4sBBHHHHHLLLHHHHHLL', b'PK\x01\x02', version, 3, version, 0x808, method,
+                                 clock, date, crc, compressed, size, len(name), len(extra), 0, 0, 0,
+                                 0o100644 << 16, header_offset)
+            yield record + name + extra
+            offset += len(record) + len(name) + len(extra)
+
+        count, length = len(central), offset - start
+        if count >= 0xFFFF or start >= ZIP_LIMIT or length >= ZIP_LIMIT:
+            yield struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count, length, start)
+            yield struct.pack('<4sLQL', b'PK\x06\x07', 0, offset, 1)
+        yield struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                          min(length, ZIP_LIMIT), min(start, ZIP_LIMIT), 0)
+
+class TarStream:
+    """Writes a POSIX (pax) tar archive, whose size is always known up front"""
+
+    def __init__(self, members):
+        self.members = members
+
+    def header(self, member):
+        info = tarfile.TarInfo(member.arcname)
+        info.size = member.size
+        info.mtime = int(member.mtime)
+        info.mode = 0o644
+        return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+    def size(self):
+        return sum(len(self.header(member)) + -(-member.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                   for member in self.members) + 2 * tarfile.BLOCKSIZE
+
+    def __iter__(self):
+        return coalesce(self.pieces())
+
+    def pieces(self):
+        for member in self.members:
+            yield self.header(member)
+            yield from member.blocks()
+            padding = -member.size % tarfile.BLOCKSIZE
+            if padding:
+                yield bytes(padding)
+        yield bytes(2 * tarfile.BLOCKSIZE)
+
+@app.route('/archive', methods=['GET'])
+@app.route('/archive/<path:folder>', methods=['GET'])
+def download_archive(folder=''):
+    """Stream the upload folder, or one folder in it, as a zip or tar archive"""
+    folder = folder.strip('/')
+    if hidden_path(folder) or safe_join(app.config['UPLOAD_FOLDER'], folder) is None:
+        return jsonify({'error': 'Folder not found'}), 404
+    archive_format = request.args.get('format', 'zip')
+    compression = request.args.get('compression', 'stored')
+    if archive_format not in ARCHIVE_FORMATS:
+        return jsonify({'error': f'Unsupported format {archive_format}, use zip or tar'}), 400
+    if compression not in ('stored', 'deflate'):
+        return jsonify({'error': f'Unsupported compression {compression}, use stored or deflate'}), 400
+
+    members = archive_members(folder)
+    if folder and not members:
+        return jsonify({'error': 'Folder not found'}), 404
+    if archive_format == 'zip':
+        archive = ZipStream(members, compression == 'deflate')
+    else:
+        archive = TarStream(members)
+    filename = f"{os.path.basename(folder) or 'files'}.{archive_format}"
+    headers = {'Content-Disposition': content_disposition(filename)}
+    size = archive.size()
+    if size is not None:
+        headers['Content-Length'] = str(size)
+    return app.response_class(iter(archive), headers=headers, mimetype=ARCHIVE_FORMATS[archive_format],
+                              direct_passthrough=True)
+
+# Previews
+# Thumbnails are rendered by previews.py worker processes, started on first use
+# and kept for the next one, then cached under .cache/previews in one folder
+# per file name, so the watchdog events for a file can drop its thumbnails.
+# Cached names also carry the file's ETag, so a change the watcher missed is
+# never served.
+THUMBNAIL_SIZES = (128, 256, 512)
+PREVIEW_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'previews.py')
+PREVIEW_TIMEOUT = 60  # seconds before a stuck preview worker is killed
+TEXT_HEAD_SIZE = 8192
+
+class PreviewPool:
+    """Long-lived preview worker processes, at most preview_workers busy at once"""
+
+    def __init__(self):
+        self.idle = []
+        self.busy = 0
+        self.available = threading.Condition()
+
+    def run(self, job):
+        with self.available:
+            while self.busy >= config['Server'].getint('preview_workers'):
+                self.available.wait()
+            self.busy += 1
+            process = self.idle.pop() if self.idle else None
+        try:
+            if process is None or process.poll() is not None:
+                process = subprocess.Popen([sys.executable, PREVIEW_WORKER], stdin=subprocess.PIPE,
+                                           stdout=subprocess.PIPE)
+            timer = threading.Timer(PREVIEW_TIMEOUT, process.kill)
+            timer.start()
+            try:
+                process.stdin.write(json.dumps(job).encode() + b'\n')
+                process.stdin.flush()
+                line = process.stdout.readline()
+            finally:
+                timer.cancel()
+            if not line:
+                raise IOError('Preview worker exited')
+        except BaseException:
+            if process is not None:
+                process.kill()
+                process.wait()
+                process = None
+            raise
+        finally:
+            with self.available:
+                self.busy -= 1
+                if process is not None:
+                    self.idle.append(process)
+                self.available.notify()
+        result = json.loads(line)
+        if 'error' in result:
+            raise ValueError(result['error'])
+
+preview_pool = PreviewPool()
+
+class PreviewCache:
+    """Thumbnails on disk, one folder per file name, evicted least recently used first"""
+
+    def __init__(self):
+        self.building = {}  # path -> Event set once it is built or failed
+        self.failed = {}  # path -> why it couldn't be built
+        self.total = None  # bytes cached, counted on the first eviction check
+        self.lock = threading.Lock()
+
+    def folder(self):
+        return os.path.join(app.config['UPLOAD_FOLDER'], '.cache', 'previews')
+
+    def entry_folder(self, name):
+        return os.path.join(self.folder(), hashlib.sha1(name.encode()).hexdigest())
+
+    def path(self, name, etag, size):
+        return os.path.join(self.entry_folder(name), f'{size}-{hashlib.sha1(etag.encode()).hexdigest()[:16]}.jpg')
+
+    def get(self, name, etag, size, kind, sources):
+        # Path of the cached thumbnail, rendering it first if needed; ValueError if it can't be
+        path = self.path(name, etag, size)
+        while True:
+            try:
+                os.utime(path)  # Recency for eviction
+                return path
+            except OSError:
+                pass
+            with self.lock:
+                if path in self.failed:
+                    raise ValueError(self.failed[path])
+                done = self.building.get(path)
+                if done is None:
+                    self.building[path] = threading.Event()
+                    break
+            done.wait(PREVIEW_TIMEOUT)  # Someone else is rendering it
+        try:
+            self.build(path, kind, sources, size)
+        finally:
+            with self.lock:
+                self.building.pop(path).set()
+        return path
+
+    def build(self, path, kind, sources, size):
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            preview_pool.run({'kind': kind, 'sources': sources, 'destination': temp_path, 'size': size})
+            os.replace(temp_path, path)
+        except (ValueError, OSError) as e:
+            with self.lock:
+                if len(self.failed) > 10000:
+                    self.failed.clear()
+                self.failed[path] = str(e)
+            raise ValueError(str(e))
+        finally:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+        with self.lock:
+            if self.total is not None:
+                self.total += os.path.getsize(path)
+        self.evict(keep=path)
+
+    def invalidate(self, name):
+        folder = self.entry_folder(name)
+        removed = 0
+        try:
+            with os.scandir(folder) as it:
+                entries = [entry for entry in it if not entry.name.endswith('.tmp')]
+        except OSError:
+            return  # Nothing cached for it
+        for entry in entries:
+            try:
+                removed += entry.stat().st_size
+            except OSError:
+                pass
+        shutil.rmtree(folder, ignore_errors=True)
+        with self.lock:
+            if self.total is not None:
+                self.total -= removed
+
+    def evict(self, keep=None):
+        # Only rescans once the running total says the budget may be exceeded;
+        # keep is the thumbnail about to be served
+        budget = config['Server'].getint('preview_cache_mb') * 1024 * 1024
+        if self.total is not None and self.total <= budget:
+            return
+        entries = []
+        with os.scandir(self.folder()) as folders:
+            for folder in folders:
+                try:
+                    with os.scandir(folder.path) as it:
+                        for entry in it:
+                            if not entry.name.endswith('.tmp') and entry.path != keep:
+                                st = entry.stat()
+                                entries.append((st.st_mtime, st.st_size, entry.path))
+                except OSError:
+                    continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                continue
+        with self.lock:
+            self.total = total
+
+preview_cache = PreviewCache()
+
+def thumbnail_kind(name):
+    media_type = mimetypes.guess_type(name)[0] or ''
+    if media_type.startswith('image/') and media_type != 'image/svg+xml':
+        return 'image'
+    if media_type.startswith('video/'):
+        return 'video'
+    return None
+
+@app.route('/thumbnail/<path:filename>', methods=['GET'])
+def thumbnail(filename):
+    """JPEG thumbnail of an image or video, rendered on first request"""
+    located = locate_file(filename)
+    if located is None:
+        return jsonify({'error': 'File not found'}), 404
+    path, manifest = located
+    kind = thumbnail_kind(filename)
+    if kind is None:
+        return jsonify({'error': 'No thumbnail for this file type'}), 404
+    size = request.args.get('size', '256')
+    if not size.isdigit() or int(size) not in THUMBNAIL_SIZES:
+        return jsonify({'error': f'size must be one of {", ".join(map(str, THUMBNAIL_SIZES))}'}), 400
+    size = int(size)
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        return jsonify({'error': str(e)}), 404
+
+    etag = variant_etag(file_etag(st), f'thumbnail{size}')
+    # The page adds the file's mtime as v, so such URLs never change content
+    headers = {'ETag': etag, 'Cache-Control': 'max-age=31536000' if 'v' in request.args else 'no-cache'}
+    if not is_resource_modified(request.environ, etag.strip('"')):
+        return app.response_class(status=304, headers=headers)
+    sources = [content_store().chunk_path(chunk_id) for chunk_id, _ in manifest['chunks']] if manifest else [path]
+    try:
+        cached = preview_cache.get(filename, etag, size, kind, sources)
+        f = open(cached, 'rb')
+    except (ValueError, OSError) as e:
+        return jsonify({'error': f'No thumbnail: {e}'}), 404
+    headers['Content-Length'] = str(os.fstat(f.fileno()).st_size)
+    return app.response_class(wrap_file(request.environ, f), headers=headers, mimetype='image/jpeg',
+                              direct_passthrough=True)
+
+@app.route('/head/<path:filename>', methods=['GET'])
+def text_head(filename):
+    """The first few KB of a text file, cut at a line break"""
+    # One small read costs less than a cache lookup, so heads aren't cached
+    located = locate_file(filename)
+    if located is None:
+        return jsonify({'error': 'File not found'}), 404
+    path, manifest = located
+    data = bytearray()
+    try:
+        with open_download(path, manifest) as f:
+            while len(data) <= TEXT_HEAD_SIZE:
+                block = f.read(TEXT_HEAD_SIZE + 1 - len(data))
+                if not block:
+                    break
+                data += block
+    except OSError as e:
+        return jsonify({'error': str(e)}), 404
+    if b'\0' in data:
+        return jsonify({'error': 'Not a text file'}), 415
+    truncated = len(data) > TEXT_HEAD_SIZE
+    if truncated:
+        data = data[:TEXT_HEAD_SIZE]
+        if b'\n' in data:
+            data = data[:data.rindex(b'\n') + 1]
+    return app.response_class(data.decode('utf-8', 'replace'), mimetype='text/plain',
+                              headers={'X-Truncated': str(truncated).lower(), 'Cache-Control': 'no-cache'})
+
 def convert_size(size_bytes):
     """Convert bytes to human readable format"""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -947,43 +5576,358 @@ def convert_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.2f} TB"
 
-if __name__ == '__main__':
-    cert_path = 'certificate.pem'
-    key_path = 'private_key.pem'
-    
-    # Check if certificate files exist, if not create them
-    if not (os.path.exists(cert_path) and os.path.exists(key_path)):
-        print("Generating SSL certificate...")
-        os.system(f'openssl req -x509 -newkey rsa:4096 -nodes -out {cert_path} '
-                 f'-keyout {key_path} -days 365 -subj "/CN=localhost"')
-        print("SSL certificate generated.")
-    
-    # Create SSL context
-    ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
-    ssl_context.load_cert_chain(cert_path, key_path)
-    
-    # Configure SSL context for security
-    ssl_context.minimum_version = ssl.TLSVersion.TLSv1_2
-    ssl_context.set_ciphers('ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256:ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384')
-    ssl_context.options |= ssl.OP_NO_TLSv1 | ssl.OP_NO_TLSv1_1
-    ssl_context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
-    
-    # Start the Flask application with SSL
-    print("Starting secure file transfer server...")
-    app.run(
-        host='0.0.0.0',
-        port=443,
-        ssl_context=ssl_context,
-        debug=False,
-        threaded=True
+def serve_eventlet(listener, ssl_context):
+    import eventlet.wsgi
+
+    class TimedHandshakeProtocol(eventlet.wsgi.HttpProtocol):
+        # eventlet leaves the handshake to the first read; doing it up front
+        # lets it be timed, under the same timeout that read would have had
+        def setup(self):
+            if self.server.keepalive and not isinstance(self.server.keepalive, bool):
+                self.request.settimeout(self.server.keepalive)
+            started = time.perf_counter()
+            try:
+                self.request.do_handshake()
+                metrics.observe('localhttps_tls_handshake_seconds', time.perf_counter() - started)
+            except OSError:
+                pass  # Surfaces again on the first read, as it did before
+            self.request.settimeout(self.server.socket_timeout)
+            super().setup()
+            self.send_buffer = None  # Reused by every download on this connection
+
+        def get_environ(self):
+            # eventlet decodes chunked bodies and ends them itself, but without
+            # saying so Werkzeug reads any body lacking a Content-Length as empty
+            environ = super().get_environ()
+            environ['wsgi.input_terminated'] = True
+            environ['wsgi.file_wrapper'] = SendfileWrapper
+            return environ
+
+        def handle_one_response(self):
+            application = self.application
+            def sending_files(environ, start_response):
+                response = {}
+                def starting(status, headers, exc_info=None):
+                    response['write'] = start_response(status, headers, exc_info)
+                    response['sized'] = any(name.lower() == 'content-length' for name, _ in headers)
+                    return response['write']
+                result = application(environ, starting)
+                return ClosingIterator(self.send_file_slices(result, response), getattr(result, 'close', None))
+            self.application = sending_files
+            super().handle_one_response()
+
+        def send_file_slices(self, result, response):
+            # FileSlices skip eventlet's write(), which joins and copies every block.
+            # Only bodies of known length, made of nothing but slices, go this way:
+            # chunked framing and eventlet's write buffer would otherwise get in the way
+            direct = None
+            for data in result:
+                if not isinstance(data, FileSlice):
+                    direct = False
+                    yield data
+                elif direct is False or not response.get('sized'):
+                    direct = False
+                    yield data.tobytes()
+                else:
+                    if direct is None:
+                        response['write'](b'')  # The headers
+                        direct = True
+                    self.send_file_slice(data)
+
+        def send_file_slice(self, piece):
+            sslobj = getattr(self.connection, '_sslobj', None)
+            if sslobj is not None and getattr(sslobj, 'uses_ktls_for_send', lambda: False)():
+                # The kernel encrypts, so the file never passes through Python
+                sent = self.connection.sendfile(piece.file, piece.offset, piece.count)
+            else:
+                if self.send_buffer is None:
+                    self.send_buffer = bytearray(DOWNLOAD_BLOCK_SIZE)
+                sent = 0
+                while sent < piece.count:
+                    view = memoryview(self.send_buffer)[:min(piece.count - sent, DOWNLOAD_BLOCK_SIZE)]
+                    read = os.preadv(piece.fd, [view], piece.offset + sent)
+                    if not read:
+                        break
+                    self.connection.sendall(view[:read])
+                    sent += read
+            if sent < piece.count:
+                raise IOError('File shrank while it was being sent')
+
+    keepalive = int(config['Server']['keepalive_timeout'])
+    eventlet.wsgi.server(
+        ssl_context.wrap_socket(listener, server_side=True),
+        app,
+        max_size=int(config['Server']['max_connections']),
+        keepalive=keepalive if keepalive > 0 else False,
+        protocol=TimedHandshakeProtocol,
+        log_output=False,
+        debug=False
     )
 
-    parser = argparse.ArgumentParser(description='Secure File Transfer Server')
-    parser.add_argument('--host', help='Host address')
-    parser.add_argument('--port', type=int, help='Port number')
-    parser.add_argument('--cert', help='Path to SSL certificate')
-    parser.add_argument('--key', help='Path to SSL private key')
-    args = parser.parse_args()
+def run_server(ssl_context):
+    host = config['Server']['host']
+    port = int(config['Server']['port'])
+    print(f"Starting secure file transfer server on {host}:{port} ({SERVER_MODE})...")
+    if SERVER_MODE == 'eventlet':
+        serve_eventlet(eventlet.listen((host, port)), ssl_context)
+    else:
+        socketio.run(
+            app,
+            host=host,
+            port=port,
+            ssl_context=ssl_context,
+            debug=False,
+            allow_unsafe_werkzeug=True
+        )
+
+# Prefork workers
+PREFORK_PARENT = None  # Supervisor pid, set inside worker processes
+
+def send_frame(sock, payload):
+    sock.sendall(struct.pack('!I', len(payload)) + payload)
+
+def recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def recv_frame(sock):
+    header = recv_exact(sock, 4)
+    if header is None:
+        return None
+    return recv_exact(sock, struct.unpack('!I', header)[0])
+
+class LocalQueueManager(socketio_module.PubSubManager):
+    """Socket.IO client manager that shares emits between workers through the local queue hub"""
+    name = 'localqueue'
+
+    def __init__(self, path, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self.sock = None
+        self.lock = threading.Lock()
+
+    def _connection(self):
+        with self.lock:
+            if self.sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.path)
+                self.sock = sock
+            return self.sock
+
+    def _reset(self):
+        with self.lock:
+            if self.sock is not None:
+                self.sock.close()
+                self.sock = None
+
+    def _publish(self, data):
+        try:
+            send_frame(self._connection(), json.dumps(data).encode())
+        except OSError:
+            self._reset()
+
+    def _listen(self):
+        while True:
+            try:
+                payload = recv_frame(self._connection())
+            except OSError:
+                payload = None
+            if payload is None:
+                # Hub went away; back off and let _thread() reconnect
+                self._reset()
+                time.sleep(1)
+                raise ConnectionError('Lost connection to the local message queue')
+            yield json.loads(payload)
+
+    def _handle_emit(self, message):
+        if message.get('event') == 'files_update' and message.get('host_id') != self.host_id:
+            file_index.apply_delta(message['data'][0])
+        super()._handle_emit(message)
+
+def run_queue_hub(path):
+    # Relays every frame from one worker to all connected workers (including the sender)
+    hub = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hub.bind(path)
+    hub.listen(64)
+    workers = set()
+    workers_lock = threading.Lock()
+
+    def relay(conn):
+        try:
+            while True:
+                payload = recv_frame(conn)
+                if payload is None:
+                    break
+                with workers_lock:
+                    targets = list(workers)
+                for target in targets:
+                    try:
+                        send_frame(target, payload)
+                    except OSError:
+                        pass  # Its own relay thread will notice and clean up
+        finally:
+            with workers_lock:
+                workers.discard(conn)
+            conn.close()
+
+    while True:
+        conn, _ = hub.accept()
+        with workers_lock:
+            workers.add(conn)
+        threading.Thread(target=relay, args=(conn,), daemon=True).start()
+
+def run_worker(index, listener, ssl_context, queue_path):
+    global PREFORK_PARENT
+    PREFORK_PARENT = os.getppid()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The supervisor handles Ctrl+C
+    signal.signal(signal.SIGHUP, handle_reload_signal)
+    signal.signal(signal.SIGUSR1, handle_drain_signal)
+    reload_config_file()  # The supervisor's copy may predate live changes
+    bandwidth.use_row(index)
+    upload_scheduler.use_row(index)
+
+    metrics.folder = os.path.join(os.path.dirname(queue_path), 'metrics')
+    os.makedirs(metrics.folder, exist_ok=True)
+    threading.Thread(target=metrics.run_flusher, daemon=True).start()
+
+    manager = LocalQueueManager(queue_path)
+    manager.set_server(socketio.server)
+    socketio.server.manager = manager
+    # Start listening right away so the hub never queues frames for an idle worker
+    socketio.server.manager_initialized = True
+    manager.initialize()
+
+    # Only worker 0 watches the folder; the others keep a replica of its index
+    # current from the files_update deltas that arrive through the queue
+    observer = None
+    if index == 0:
+        observer = start_file_monitor()
+    else:
+        file_index.replica = True
+        file_index.seed(UPLOAD_FOLDER, stored=True)
+        file_index.version = 0  # Unknown until the first delta from worker 0 arrives
+        file_index.watched = True
+    config_observer = start_config_watcher()
+    try:
+        serve_eventlet(listener, ssl_context)
+    finally:
+        config_observer.stop()
+        if observer:
+            observer.stop()
+            observer.join()
+
+def run_prefork(ssl_context, workers):
+    host = config['Server']['host']
+    port = int(config['Server']['port'])
+    # Workers inherit this listening socket across fork() and accept from it in turn
+    listener = eventlet.listen((host, port))
+    queue_dir = tempfile.mkdtemp(prefix='localhttps-')
+    queue_path = os.path.join(queue_dir, 'socketio.sock')
+    bandwidth.share_between(workers)
+    upload_scheduler.share_between(workers)
+    children = {}
+    restarting = [False]
+
+    def spawn(role):
+        pid = os.fork()
+        if pid == 0:
+            # A fresh hub: the inherited one's epoll set is shared with every other process
+            eventlet.hubs.use_hub()
+            try:
+                if role == 'hub':
+                    listener.close()
+                    run_queue_hub(queue_path)
+                else:
+                    while not os.path.exists(queue_path):
+                        time.sleep(0.05)
+                    run_worker(role, listener, ssl_context, queue_path)
+            finally:
+                os._exit(0)
+        children[pid] = role
+
+    def stop(signum, frame):
+        raise SystemExit(0)
+
+    def reload(signum, frame):
+        # Workers forked later must inherit the new certificate too
+        handle_reload_signal(signum, frame)
+        for pid, role in list(children.items()):
+            if role != 'hub':
+                os.kill(pid, signal.SIGHUP)
+
+    def restart(signum, frame):
+        # Workers drain and exit; they are not respawned, the whole server is
+        restarting[0] = True
+        for pid, role in list(children.items()):
+            if role != 'hub':
+                os.kill(pid, signal.SIGUSR1)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, reload)
+    signal.signal(signal.SIGUSR1, restart)
+    print(f"Starting secure file transfer server on {host}:{port} ({SERVER_MODE}, {workers} workers)...")
+    try:
+        spawn('hub')
+        for index in range(workers):
+            spawn(index)
+        while True:
+            pid, _ = os.wait()
+            role = children.pop(pid, None)
+            if restarting[0]:
+                if all(role == 'hub' for role in children.values()):
+                    break
+                continue
+            if role is not None:
+                print(f"Worker {role} exited, restarting...")
+                time.sleep(1)
+                if role == 'hub' and os.path.exists(queue_path):
+                    os.remove(queue_path)
+                spawn(role)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        shutil.rmtree(queue_dir, ignore_errors=True)
+    if restarting[0]:
+        listener.close()
+        reexec_server()
+
+def report_startup():
+    previous = startup_marks[0][1]
+    for phase, ended in startup_marks[1:]:
+        print(f"{phase:<24}{(ended - previous) * 1000:8.1f} ms")
+        previous = ended
+    print(f"{'total':<24}{(previous - startup_marks[0][1]) * 1000:8.1f} ms, {len(sys.modules)} modules loaded")
+    print("Run with python -X importtime for a per-module breakdown")
+
+def profile_startup(ssl_context):
+    # What a single-process start does before it serves, timed step by step
+    observer = start_file_monitor()
+    mark_startup('file index and monitor')
+    config_observer = start_config_watcher()
+    mark_startup('config watcher')
+    index_page(None)
+    for encoding in compression_encodings():
+        index_page(encoding)
+    mark_startup('index page')
+    config_observer.stop()
+    observer.stop()
+    observer.join()
+    report_startup()
+
+mark_startup('module setup')
+
+if __name__ == '__main__':
+    args = build_arg_parser().parse_args()
     
     if args.host:
         config['Server']['host'] = args.host
@@ -993,27 +5937,40 @@ if __name__ == '__main__':
         config['Server']['cert_path'] = args.cert
     if args.key:
         config['Server']['key_path'] = args.key
+    if args.server:
+        config['Server']['server_mode'] = args.server
+    if args.max_connections:
+        config['Server']['max_connections'] = str(args.max_connections)
+    if args.keepalive is not None:
+        config['Server']['keepalive_timeout'] = str(args.keepalive)
+    if args.workers:
+        config['Server']['workers'] = str(args.workers)
     
     save_config(config)
-    observer = start_file_monitor()
-    
-    try:
-        ssl_context = setup_ssl_context(
-            config['Server']['cert_path'],
-            config['Server']['key_path']
-        )
-        
-        print(f"Starting secure file transfer server on {config['Server']['host']}:{config['Server']['port']}...")
-        socketio.run(
-            app,
-            host=config['Server']['host'],
-            port=int(config['Server']['port']),
-            ssl_context=ssl_context,
-            debug=False
-        )
-    finally:
-        observer.stop()
-        observer.join()
-    pass
+    mark_startup('configuration')
+    ssl_context = setup_ssl_context(
+        config['Server']['cert_path'],
+        config['Server']['key_path']
+    )
+    mark_startup('certificate and TLS')
+    if args.profile_startup:
+        profile_startup(ssl_context)
+        sys.exit(0)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, handle_reload_signal)  # kill -HUP reloads the config and certificate
+    workers = int(config['Server']['workers'])
+    if workers > 1 and SERVER_MODE == 'eventlet' and hasattr(os, 'fork'):
+        run_prefork(ssl_context, workers)
+    else:
+        if workers > 1:
+            print("Multiple workers need the eventlet server and fork(), running a single process")
+        observer = start_file_monitor()
+        config_observer = start_config_watcher()
+        try:
+            run_server(ssl_context)
+        finally:
+            config_observer.stop()
+            observer.stop()
+            observer.join()
 
 #=========<Code End>==========#